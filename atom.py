@@ -1,10 +1,22 @@
-from expr import Expr
-from head import Head
+from typing import Set
+from expr import Expr, bloom_bit
+from head import Head, head_mask
 
 
 class Atom(Expr):
+    __slots__ = ()
+
     def __init__(self, head: Head):
-        super().__init__(head, args=[], attr=[])
+        self.head = head
+        self.args = ()
+        self.attr = head_mask(head)
+        self.order = None
+        self.symbol_bloom = 0
+        self.head_bloom = bloom_bit(head)
+        self.depth = 0
+
+    def summarize(self):
+        pass
 
     def __full__(self):
         return self.__str__()
@@ -12,14 +24,20 @@ class Atom(Expr):
     def __str__(self):
         raise NotImplementedError
 
-    def __eq__(self, other):
+    def intern_key(self) -> tuple:
         raise NotImplementedError
 
-    def __hash__(self):
-        raise NotImplementedError
+    def order_key(self) -> tuple:
+        return (2, self.head, *self.intern_key()[1:])
+
+    def __reduce__(self):
+        # the fields of the intern key are the constructor arguments
+        return type(self), self.intern_key()[1:]
 
 
 class String(Atom):
+    __slots__ = ('text',)
+
     def __init__(self, text: str):
         super().__init__("String")
         self.text = text
@@ -27,30 +45,29 @@ class String(Atom):
     def __str__(self):
         return self.text
 
-    def __eq__(self, other):
-        return type(other) is String and self.text == other.text
-
-    def __hash__(self):
-        return hash((self.head, self.text))
+    def intern_key(self) -> tuple:
+        return type(self), self.text
 
 
 class Symbol(Atom):
+    __slots__ = ('text',)
+
     def __init__(self, text: str):
         super().__init__("Symbol")
         assert " " not in text
         self.text = text
+        self.symbol_bloom = bloom_bit(text)
 
     def __str__(self):
         return self.text
 
-    def __eq__(self, other):
-        return type(other) is Symbol and self.text == other.text
-
-    def __hash__(self):
-        return hash((self.head, self.text))
+    def intern_key(self) -> tuple:
+        return type(self), self.text
 
 
 class Boolean(Atom):
+    __slots__ = ('value',)
+
     def __init__(self, value: bool):
         super().__init__("Boolean")
         self.value = value
@@ -58,11 +75,8 @@ class Boolean(Atom):
     def __str__(self):
         return str(self.value)
 
-    def __eq__(self, other):
-        return type(other) is Boolean and self.value == other.value
-
-    def __hash__(self):
-        return hash((self.head, self.value))
+    def intern_key(self) -> tuple:
+        return type(self), self.value
 
 
 TRUE = Boolean(True)
@@ -71,7 +85,7 @@ FALSE = Boolean(False)
 
 def symbols(text: str):
     from rule import Blank
-    return ((Blank(c[1:]) if c[0] is '_' else Symbol(c)) for c in text.split(" ") if len(c) > 0)
+    return ((Blank(c[1:]) if c[0] == '_' else Symbol(c)) for c in text.split(" ") if len(c) > 0)
 
 
 def atomize(primitive):
@@ -89,11 +103,14 @@ def atomize(primitive):
     elif type(primitive) is float:
         return Real(primitive)
     elif type(primitive) is complex:
-        return Complex(primitive.real, primitive.imag)
+        return Complex(Real(primitive.real), Real(primitive.imag))
 
     raise "Primitive not atomizable"
 
 
+# number types, filled in by nums when it is imported, is_numeric is called for every evaluated node
+NUMBER_TYPES: Set[type] = set()
+
+
 def is_numeric(expr: Expr):
-    from nums import Integer, Rational, Real, Complex
-    return type(expr) in (Integer, Rational, Real, Complex)
\ No newline at end of file
+    return type(expr) in NUMBER_TYPES
\ No newline at end of file
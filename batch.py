@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from expr import Expr
+from rule import Rule, eval_expr
+from rewrite import Strategy, rewrite
+from serialize import dumps, loads
+
+# simplification of many independent expressions on a process pool. Chunks of expressions are sent
+# in the serialize encoding, which is written and read without recursion so deep expressions can be
+# sent, and decoding interns the nodes in the receiving process. Subtrees shared inside a chunk are
+# sent once. Rules are pickled, unpickling rebuilds them through their constructors.
+# GLOBAL_RULES are not sent, workers have the ones registered at import time (and with the fork
+# start method everything the parent registered before the pool was created).
+#   for result in simplify_many(exprs, rules, workers=8):
+#       ...
+
+# rules and rewrite settings of the current worker process, sent once per worker by the initializer
+WORKER_RULES: List[Rule] = []
+WORKER_SETTINGS: Dict[str, object] = {}
+
+
+def simplify(expr: Expr, rules: List[Rule], strategy: Strategy = Strategy.INNERMOST, max_steps: int = 10000) -> Expr:
+    result = eval_expr(expr)[1]
+    if len(rules) > 0:
+        result = rewrite(result, rules, strategy, max_steps)[1]
+    return result
+
+
+def init_worker(rules: List[Rule], strategy: Strategy, max_steps: int):
+    WORKER_RULES[:] = rules
+    WORKER_SETTINGS["strategy"] = strategy
+    WORKER_SETTINGS["max_steps"] = max_steps
+
+
+def simplify_chunk(start: int, data: bytes) -> Tuple[int, bytes]:
+    strategy, max_steps = WORKER_SETTINGS["strategy"], WORKER_SETTINGS["max_steps"]
+    return start, dumps(simplify(expr, WORKER_RULES, strategy, max_steps) for expr in loads(data))
+
+
+def chunks(exprs: Iterable[Expr], size: int) -> Iterator[Tuple[int, List[Expr]]]:
+    iterator = iter(exprs)
+    start = 0
+    while True:
+        chunk = list(islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+def simplify_unordered(exprs: Iterable[Expr], rules: List[Rule] = (), workers: Optional[int] = None, chunksize: int = 64,
+                       strategy: Strategy = Strategy.INNERMOST, max_steps: int = 10000) -> Iterator[Tuple[int, Expr]]:
+    # (input position, simplified expression) pairs as soon as their chunk is done. exprs is consumed
+    # lazily, at most a few chunks per worker are in flight. workers=1 simplifies in this process.
+    rules = list(rules)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for i, expr in enumerate(exprs):
+            yield i, simplify(expr, rules, strategy, max_steps)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(rules, strategy, max_steps)) as pool:
+        for start, results in run_chunks(pool, chunks(exprs, chunksize), 4 * workers):
+            yield from enumerate(results, start)
+
+
+def run_chunks(pool: Executor, pending: Iterator[Tuple[int, List[Expr]]], window: int) -> Iterator[Tuple[int, List[Expr]]]:
+    running = set()
+    for start, chunk in islice(pending, window):
+        running.add(pool.submit(simplify_chunk, start, dumps(chunk)))
+
+    while len(running) > 0:
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            start, data = future.result()
+            yield start, loads(data)
+        for start, chunk in islice(pending, len(done)):
+            running.add(pool.submit(simplify_chunk, start, dumps(chunk)))
+
+
+def simplify_many(exprs: Iterable[Expr], rules: List[Rule] = (), workers: Optional[int] = None, chunksize: int = 64,
+                  strategy: Strategy = Strategy.INNERMOST, max_steps: int = 10000) -> Iterator[Expr]:
+    # simplified expressions in input order, a result is yielded once it and everything before it is done
+    buffered: Dict[int, Expr] = {}
+    position = 0
+    for i, result in simplify_unordered(exprs, rules, workers, chunksize, strategy, max_steps):
+        buffered[i] = result
+        while position in buffered:
+            yield buffered.pop(position)
+            position += 1
@@ -0,0 +1,257 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+from statistics import median
+from typing import Callable, Dict, List, Optional
+from expr import Expr
+from atom import Symbol, symbols
+from nums import Integer
+from rule import Rule, match_expr, apply_rule, eval_expr, replace, EVAL_CACHE
+from poly import expand
+from profiling import count_nodes
+
+# benchmark suite for the core operations on generated expression families.
+# python bench.py --sizes 10,100,1000 --json results.json [--compare baseline.json]
+
+FORMAT_VERSION = 1
+
+x, y, _x, _y, _z = symbols("x y _x _y _z")
+
+
+def wide_sum(n: int) -> Expr:
+    # sum of n terms c*s_i*x^k with repeated s_i, built pairwise so construction goes through flattening
+    terms = [Expr("Mult", [Integer(i % 7 + 1), Symbol("s{}".format(i % (n // 2 + 1))), Expr("Power", [x, Integer(i % 3 + 1)])])
+             for i in range(n)]
+    while len(terms) > 1:
+        terms = [Expr("Plus", terms[i:i + 2]) if i + 1 < len(terms) else terms[i] for i in range(0, len(terms), 2)]
+    return terms[0]
+
+
+def deep_nesting(n: int) -> Expr:
+    # f(f(...f(x, s_0)..., s_n-2), s_n-1), n levels of a non commutative head
+    node = x
+    for i in range(n):
+        node = Expr("f", [node, Symbol("s{}".format(i % 10))])
+    return node
+
+
+def polynomial(n: int) -> Expr:
+    # expanded (1+x+y)^d with about n terms
+    d = max(1, int((2 * n) ** 0.5) - 1)
+    return expand(Expr("Power", [Expr("Plus", [Integer(1), x, y]), Integer(d)]))
+
+
+def rebuild(expr: Expr) -> Expr:
+    # constructs every compound node of expr again from its args, bottom up
+    built: Dict[Expr, Expr] = {}
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack[-1]
+        if node in built:
+            stack.pop()
+            continue
+        pending = [arg for arg in node.args if arg not in built]
+        if len(pending) > 0:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        built[node] = node if len(node.args) == 0 else Expr(node.head, [built[arg] for arg in node.args], node.attr)
+    return built[expr]
+
+
+FAMILIES: Dict[str, Callable[[int], Expr]] = {
+    "wide_sum": wide_sum,
+    "deep_nesting": deep_nesting,
+    "polynomial": polynomial
+}
+
+# what each family is benchmarked with: how it is constructed (polynomial is rebuilt, its builder
+# times expand) and patterns and a rule that match in it. A benchmark without a pattern for a
+# family (no commutative head in deep_nesting, a commutative root elsewhere) is skipped.
+WORKLOADS: Dict[str, Dict[str, object]] = {
+    "wide_sum": {
+        "construct": lambda n, expr: wide_sum(n),
+        "commutative": Expr("Plus", [Expr("Mult", [_x, Expr("Power", [x, Integer(2)])]), _y]),
+        "noncommutative": None,
+        "rule": Rule(Expr("Power", [_x, Integer(2)]), Expr("Mult", [x, x]))
+    },
+    "deep_nesting": {
+        "construct": lambda n, expr: deep_nesting(n),
+        "commutative": None,
+        "noncommutative": Expr("f", [Expr("f", [_x, _y]), _z]),
+        "rule": Rule(Expr("f", [_x, Symbol("s1")]), x)
+    },
+    "polynomial": {
+        "construct": lambda n, expr: rebuild(expr),
+        "commutative": Expr("Plus", [Expr("Mult", [_x, Expr("Power", [x, Integer(2)])]), _y]),
+        "noncommutative": None,
+        "rule": Rule(Expr("Power", [_x, Integer(2)]), Expr("Mult", [x, x]))
+    }
+}
+
+
+def match_benchmark(kind: str) -> Callable[[str, int, Expr], Optional[Callable[[], object]]]:
+    def benchmark(family: str, n: int, expr: Expr) -> Optional[Callable[[], object]]:
+        pattern = WORKLOADS[family][kind]
+        if pattern is None:
+            return None
+        return lambda: match_expr(expr, pattern, [], {})
+    return benchmark
+
+
+def rule_benchmark(family: str, n: int, expr: Expr) -> Callable[[], object]:
+    rule = WORKLOADS[family]["rule"]
+    rule.compile()
+    return lambda: apply_rule(expr, rule)
+
+
+# each benchmark gets the family name, the size and the built expression and returns the callable
+# to time, or None if it doesn't apply to the family
+BENCHMARKS: Dict[str, Callable[[str, int, Expr], Optional[Callable[[], object]]]] = {
+    "construct": lambda family, n, expr: lambda: WORKLOADS[family]["construct"](n, expr),
+    "flatten": lambda family, n, expr: lambda: expr.flatten(force=True, recursive=True),
+    "match_commutative": match_benchmark("commutative"),
+    "match_noncommutative": match_benchmark("noncommutative"),
+    "apply_rule": rule_benchmark,
+    "eval_expr": lambda family, n, expr: lambda: eval_expr(expr),
+    "replace": lambda family, n, expr: lambda: replace(expr, Symbol("s1"), Integer(1))
+}
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> Dict[str, float]:
+    # calls per repetition are doubled until one repetition takes min_time, times are per call
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+
+    times = [elapsed / number]
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat - 1):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            times.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return {"number": number, "repeat": repeat, "best": min(times), "median": median(times)}
+
+
+def run(sizes: List[int], repeat: int = 5, min_time: float = 0.05, only: Optional[List[str]] = None) -> List[dict]:
+    # the eval cache is off so repeated calls measure the work and not a lookup
+    cache_size = EVAL_CACHE.maxsize
+    EVAL_CACHE.resize(0)
+    results = []
+    try:
+        for family, build in FAMILIES.items():
+            for n in sizes:
+                try:
+                    expr = build(n)
+                except RecursionError as e:
+                    results.append({"benchmark": "build", "family": family, "size": n, "error": type(e).__name__})
+                    continue
+
+                nodes = count_nodes(expr)
+                for name, benchmark in BENCHMARKS.items():
+                    if only is not None and name not in only:
+                        continue
+                    func = benchmark(family, n, expr)
+                    if func is None:
+                        continue
+                    result = {"benchmark": name, "family": family, "size": n, "nodes": nodes}
+                    try:
+                        result.update(measure(func, repeat, min_time))
+                    except RecursionError as e:
+                        result["error"] = type(e).__name__
+                    results.append(result)
+    finally:
+        EVAL_CACHE.resize(cache_size)
+    return results
+
+
+def result_key(result: dict) -> tuple:
+    return result["benchmark"], result["family"], result["size"]
+
+
+def compare(results: List[dict], baseline: List[dict], threshold: float) -> List[dict]:
+    # results whose best time is more than threshold (relative) slower than in the baseline
+    previous = {result_key(result): result for result in baseline if "best" in result}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or "best" not in result:
+            continue
+        ratio = result["best"] / old["best"]
+        if ratio > 1 + threshold:
+            regressions.append({**result, "baseline": old["best"], "ratio": ratio})
+    return regressions
+
+
+def report(results: List[dict]) -> str:
+    lines = ["{:<22}{:<14}{:>7}{:>9}{:>14}{:>14}".format("benchmark", "family", "size", "nodes", "best [us]", "median [us]")]
+    for result in results:
+        if "error" in result:
+            timing = "{:>28}".format(result["error"])
+        else:
+            timing = "{:>14.2f}{:>14.2f}".format(result["best"] * 1e6, result["median"] * 1e6)
+        lines.append("{:<22}{:<14}{:>7}{:>9}".format(result["benchmark"], result["family"], result["size"],
+                                                     result.get("nodes", "")) + timing)
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="benchmark expression construction, matching, rewriting and evaluation")
+    parser.add_argument("--sizes", default="10,100,1000", help="comma separated family sizes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per repetition")
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--json", help="write results to this file, - for stdout")
+    parser.add_argument("--compare", help="baseline json from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = run([int(n) for n in args.sizes.split(",")], args.repeat, args.min_time,
+                  args.only.split(",") if args.only else None)
+
+    document = {
+        "version": FORMAT_VERSION,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "results": results
+    }
+    if args.json == "-":
+        json.dump(document, sys.stdout, indent=1)
+        print()
+    else:
+        print(report(results))
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(document, file, indent=1)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline["results"], args.threshold)
+        for result in regressions:
+            print("regression: {} {} {}: {:.2f}x".format(result["benchmark"], result["family"], result["size"], result["ratio"]),
+                  file=sys.stderr)
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+from typing import Dict, List, Tuple
+from collections import Counter
+from expr import Expr
+from atom import Atom, Symbol
+
+# nodes are interned, so an expression already is a dag of its unique subterms. These helpers make
+# the sharing explicit: every compound subterm used more than once is bound to a temporary symbol.
+
+
+def count_uses(expr: Expr) -> Counter:
+    # number of parents referencing each unique node, every node is visited once
+    uses = Counter([expr])
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack.pop()
+        for arg in node.args:
+            uses[arg] += 1
+            if uses[arg] == 1:
+                stack.append(arg)
+    return uses
+
+
+def cse(expr: Expr, min_uses: int = 2, prefix: str = 't') -> Tuple[List[Tuple[Symbol, Expr]], Expr]:
+    # returns ([(temporary, value)], result) where every value only refers to earlier temporaries
+    uses = count_uses(expr)
+    taken = {node.text for node in uses if type(node) is Symbol}
+
+    bindings: List[Tuple[Symbol, Expr]] = []
+    replaced: Dict[Expr, Expr] = {}
+    counter = 0
+
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack[-1]
+        if node in replaced:
+            stack.pop()
+            continue
+
+        pending = [arg for arg in node.args if arg not in replaced]
+        if len(pending) > 0:
+            stack.extend(pending)
+            continue
+
+        stack.pop()
+        args = [replaced[arg] for arg in node.args]
+        value = node if all(new is old for new, old in zip(args, node.args)) else node.copy(args)
+
+        if uses[node] >= min_uses and not isinstance(node, Atom) and node is not expr:
+            while prefix + str(counter) in taken:
+                counter += 1
+            temp = Symbol(prefix + str(counter))
+            counter += 1
+            bindings.append((temp, value))
+            value = temp
+        replaced[node] = value
+
+    return bindings, replaced[expr]
+
+
+def format_cse(expr: Expr, full=False) -> str:
+    # one line per temporary followed by the result, its length grows with the unique subterms
+    bindings, result = cse(expr)
+    show = (lambda e: e.__full__()) if full else str
+    lines = ['{} = {}'.format(temp, show(value)) for temp, value in bindings]
+    return '\n'.join(lines + [show(result)])
@@ -0,0 +1,196 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from expr import Expr
+from atom import Atom, Symbol, is_numeric
+from nums import Integer
+from rule import GLOBAL_RULES, BlankTyped, Blank, eval_expr
+
+# symbolic derivatives of Plus, Mult, Power and Neg. Expressions are dags of interned nodes, so
+# derivatives are memoized per node and a subterm shared by many parents is differentiated once.
+# Subtrees whose symbol bloom doesn't have the variable are constant and skipped without a visit.
+#   diff(expr, x)                  # d expr / dx
+#   gradient(expr, [x, y, z])      # all partial derivatives in one reverse pass
+# gradient propagates adjoints from the root down (reverse mode), its cost is a constant multiple of
+# the size of the expression whatever the number of symbols (a Mult of n factors counts n^2).
+# Other heads are left as D(f, x) and Power(b, e) with e depending on the variable uses Log(b).
+# D(f, x) evaluates through GLOBAL_RULES after install() has added its rule.
+
+ZERO = Integer(0)
+ONE = Integer(1)
+MINUS_ONE = Integer(-1)
+
+
+def plus(terms: List[Expr]) -> Expr:
+    terms = [term for term in terms if term is not ZERO]
+    if len(terms) == 0:
+        return ZERO
+    return terms[0] if len(terms) == 1 else Expr("Plus", terms)
+
+
+def mult(factors: List[Expr]) -> Expr:
+    if any(factor is ZERO for factor in factors):
+        return ZERO
+    factors = [factor for factor in factors if factor is not ONE]
+    if len(factors) == 0:
+        return ONE
+    return factors[0] if len(factors) == 1 else Expr("Mult", factors)
+
+
+def neg(expr: Expr) -> Expr:
+    if expr is ZERO:
+        return ZERO
+    return expr.args[0] if expr.head == "Neg" else Expr("Neg", [expr])
+
+
+def power_rule(base: Expr, exponent: Expr) -> Expr:
+    # d/db b^e = e*b^(e-1)
+    if is_numeric(exponent):
+        lowered = eval_expr(Expr("Plus", [exponent, MINUS_ONE]))[1]
+    else:
+        lowered = Expr("Plus", [exponent, MINUS_ONE])
+    if lowered is ZERO:
+        return exponent
+    return mult([exponent, base if lowered is ONE else Expr("Power", [base, lowered])])
+
+
+def depends(expr: Expr, bloom: int) -> bool:
+    # False if expr certainly contains none of the symbols of the bloom mask
+    return expr.symbol_bloom & bloom != 0
+
+
+def others(factors: List[Expr]) -> List[Expr]:
+    # product of all factors but the i-th for every i
+    return [mult(factors[:i] + factors[i + 1:]) for i in range(len(factors))]
+
+
+def diff(expr: Expr, var: Symbol, memo: Optional[Dict[Expr, Expr]] = None, evaluate: bool = True) -> Expr:
+    # memo maps nodes to their derivatives by var, pass the same dict to differentiate several
+    # expressions sharing subterms
+    if memo is None:
+        memo = {}
+    bloom = var.symbol_bloom
+
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack[-1]
+        if node in memo:
+            stack.pop()
+            continue
+        if not depends(node, bloom) or isinstance(node, Atom):
+            memo[node] = ONE if node is var else ZERO
+            stack.pop()
+            continue
+        pending = [arg for arg in node.args if arg not in memo]
+        if len(pending) > 0:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        memo[node] = diff_node(node, [memo[arg] for arg in node.args], var)
+
+    result = memo[expr]
+    return eval_expr(result)[1] if evaluate else result
+
+
+def diff_node(node: Expr, darg: List[Expr], var: Symbol) -> Expr:
+    args = node.args
+    if node.head == "Plus":
+        return plus(darg)
+    if node.head == "Neg":
+        return neg(darg[0])
+    if node.head == "Mult":
+        return plus([mult([d, rest]) for d, rest in zip(darg, others(list(args))) if d is not ZERO])
+    if node.head == "Power":
+        base, exponent = args
+        dbase, dexponent = darg
+        terms = [mult([dbase, power_rule(base, exponent)])]
+        if dexponent is not ZERO:
+            # d/dx b^e = b^e*(e'*Log(b) + e*b'/b)
+            terms.append(mult([dexponent, node, Expr("Log", [base])]))
+        return plus(terms)
+    if all(d is ZERO for d in darg):
+        # the bloom only rules symbols out, args that turn out constant make a constant
+        return ZERO
+    return Expr("D", [node, var])
+
+
+def gradient(expr: Expr, variables: Iterable[Symbol], evaluate: bool = True) -> Dict[Symbol, Expr]:
+    variables = list(variables)
+    bloom = 0
+    for var in variables:
+        bloom |= var.symbol_bloom
+
+    # nodes that may depend on a variable in post order, a node comes after all its args. The bloom
+    # skips most constant subtrees, dependent has the nodes that really contain a variable.
+    targets = set(variables)
+    order: List[Expr] = []
+    dependent = set()
+    seen = set()
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack[-1]
+        if node in seen:
+            stack.pop()
+            continue
+        pending = [arg for arg in node.args if arg not in seen and depends(arg, bloom)]
+        if len(pending) > 0:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        seen.add(node)
+        if node in targets or any(arg in dependent for arg in node.args):
+            dependent.add(node)
+            order.append(node)
+
+    # contributions to the adjoint of every node, summed when the node is reached, after all its parents
+    contributions: Dict[Expr, List[Expr]] = {expr: [ONE]}
+    adjoints: Dict[Expr, Expr] = {}
+    for node in reversed(order):
+        adjoint = plus(contributions.pop(node, []))
+        adjoints[node] = adjoint
+        if adjoint is ZERO or isinstance(node, Atom):
+            continue
+        for arg, partial in partials(node, dependent):
+            contributions.setdefault(arg, []).append(mult([adjoint, partial]))
+
+    results = {var: adjoints.get(var, ZERO) for var in variables}
+    if evaluate:
+        visited = {}
+        results = {var: eval_expr(result, visited)[1] for var, result in results.items()}
+    return results
+
+
+def partials(node: Expr, dependent: Set[Expr]) -> List[Tuple[Expr, Expr]]:
+    # (arg, d node / d arg) for the args that depend on the variables
+    args = node.args
+    if node.head == "Plus":
+        return [(arg, ONE) for arg in args if arg in dependent]
+    if node.head == "Neg":
+        return [(args[0], MINUS_ONE)]
+    if node.head == "Mult":
+        return [(arg, rest) for arg, rest in zip(args, others(list(args))) if arg in dependent]
+    if node.head == "Power":
+        base, exponent = args
+        result = []
+        if base in dependent:
+            result.append((base, power_rule(base, exponent)))
+        if exponent in dependent:
+            result.append((exponent, mult([node, Expr("Log", [base])])))
+        return result
+    # like diff, other heads are left as derivatives by their args
+    return [(arg, Expr("D", [node, arg])) for arg in args if arg in dependent]
+
+
+def eval_derivative(expr: Expr) -> Expr:
+    # D(f, x) of a head diff doesn't know stays as it is
+    f = expr.args[0]
+    if isinstance(f, Atom) or f.head in ("Plus", "Mult", "Power", "Neg"):
+        return diff(f, expr.args[1])
+    return expr
+
+
+DERIVATIVE_PATTERN = Expr("D", [Blank("f"), BlankTyped("x", "Symbol")])
+
+
+def install():
+    # adds the rule evaluating D(f, x) to GLOBAL_RULES, installing twice adds it once
+    if all(pattern is not DERIVATIVE_PATTERN for pattern, _ in GLOBAL_RULES["D"]):
+        GLOBAL_RULES["D"].append((DERIVATIVE_PATTERN, eval_derivative))
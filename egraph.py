@@ -0,0 +1,413 @@
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+from expr import Expr
+from atom import Atom, Symbol, atomize, is_numeric
+from head import Attribute, Head, HeadNumericEval
+from rule import Rule, Blank, BlankTyped, check_conditions
+
+# equality saturation. An e-graph stores many equivalent expressions at once: e-classes (ids into a
+# union-find) hold e-nodes, an e-node is an atom or a tuple (head, attr, *arg class ids), and e-nodes
+# are hash-consed so each one exists in a single class. Rules add their right hand side to the class
+# their left hand side matched instead of replacing it, so no rule ordering is needed, and the
+# cheapest expression of a class is extracted at the end. Congruence is restored in batches after
+# each round of rule applications (deferred rebuilding). Numeric e-nodes whose args are all
+# numbers are folded like in eval_expr.
+#   graph = EGraph()
+#   root = graph.add(expr)
+#   graph.run(rules, node_limit=100000, time_limit=5.0)
+#   best = graph.extract(root)
+# Matching is syntactic per e-node with commutative heads matched in any order, a pattern matches
+# e-nodes of exactly its arity (no absorbing of associative runs).
+
+ENode = Union[Atom, tuple]
+
+# step of a compiled right hand side
+Step = Union[str, Atom, Tuple[Head, int, List[int]]]
+
+# cost of an e-node from the costs of its args, node is the atom or the head of a compound e-node
+CostFunction = Callable[[Union[Atom, Head], List[float]], float]
+
+
+def node_count(node: Union[Atom, Head], arg_costs: List[float]) -> float:
+    return 1 + sum(arg_costs)
+
+
+def tree_depth(node: Union[Atom, Head], arg_costs: List[float]) -> float:
+    return 1 + max(arg_costs, default=0)
+
+
+class EGraph:
+    def __init__(self):
+        self.parent: List[int] = []                     # union-find over class ids
+        self.nodes: Dict[int, List[ENode]] = {}         # e-nodes of each canonical class
+        self.uses: Dict[int, List[Tuple[ENode, int]]] = {}     # (e-node, its class) of the e-nodes with the class as arg
+        self.hashcons: Dict[ENode, int] = {}
+        self.constants: Dict[int, Atom] = {}            # the number in the class, if there is one
+        self.by_head: Dict[Head, Set[int]] = {}         # classes with an e-node of the head, may hold merged ids
+        self.pending: List[int] = []                    # classes whose uses need repairing after unions
+        self.changed: Set[int] = set()                  # classes added or merged into, may hold merged ids
+        self.unions = 0
+
+    def __len__(self) -> int:
+        return len(self.hashcons)
+
+    def find(self, cid: int) -> int:
+        root = cid
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[cid] != root:
+            self.parent[cid], cid = root, self.parent[cid]
+        return root
+
+    def canonical(self, node: ENode) -> ENode:
+        if isinstance(node, Atom):
+            return node
+        args = [self.find(arg) for arg in node[2:]]
+        if node[1] & Attribute.COMMUTATIVE:
+            args.sort()
+        return (node[0], node[1], *args)
+
+    def add(self, expr: Expr) -> int:
+        # class of expr, adding its missing subterms without recursion
+        ids: Dict[Expr, int] = {}
+        stack = [expr]
+        while len(stack) > 0:
+            node = stack[-1]
+            if node in ids:
+                stack.pop()
+                continue
+            pending = [arg for arg in node.args if arg not in ids]
+            if len(pending) > 0:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            if isinstance(node, Atom):
+                ids[node] = self.add_node(node)
+            else:
+                ids[node] = self.add_node((node.head, node.attr, *(ids[arg] for arg in node.args)))
+        return ids[expr]
+
+    def add_node(self, node: ENode) -> int:
+        node = self.canonical(node)
+        cid = self.hashcons.get(node)
+        if cid is not None:
+            return self.find(cid)
+
+        cid = len(self.parent)
+        self.parent.append(cid)
+        self.nodes[cid] = [node]
+        self.uses[cid] = []
+        self.hashcons[node] = cid
+        self.changed.add(cid)
+
+        if isinstance(node, Atom):
+            self.by_head.setdefault(node.head, set()).add(cid)
+            if is_numeric(node):
+                self.constants[cid] = node
+        else:
+            self.by_head.setdefault(node[0], set()).add(cid)
+            for arg in node[2:]:
+                self.uses[arg].append((node, cid))
+            folded = self.fold(node)
+            if folded is not None:
+                self.union(cid, self.add_node(folded))
+        return cid
+
+    def fold(self, node: tuple) -> Optional[Atom]:
+        if not node[1] & Attribute.NUMERIC or len(node) == 2:
+            return None
+        args = [self.constants.get(self.find(arg)) for arg in node[2:]]
+        if any(arg is None for arg in args):
+            return None
+        folded = HeadNumericEval[node[0]](args)
+        return None if folded is None else atomize(folded)
+
+    def union(self, a: int, b: int) -> bool:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return False
+        # the class with fewer e-nodes and uses is merged into the other one
+        if len(self.nodes[a]) + len(self.uses[a]) < len(self.nodes[b]) + len(self.uses[b]):
+            a, b = b, a
+
+        self.parent[b] = a
+        merged = self.nodes.pop(b)
+        self.nodes[a].extend(merged)
+        self.uses[a].extend(self.uses.pop(b))
+        constant = self.constants.pop(b, None)
+        if constant is not None and a not in self.constants:
+            self.constants[a] = constant
+        # the e-nodes of a are already indexed under a
+        for node in merged:
+            self.by_head.setdefault(node.head if isinstance(node, Atom) else node[0], set()).add(a)
+
+        self.pending.append(a)
+        self.changed.add(a)
+        self.unions += 1
+        return True
+
+    def rebuild(self):
+        # restores the invariants after unions: e-nodes in the hash-cons are canonical and congruent
+        # e-nodes (same head, equivalent args) are in the same class
+        while len(self.pending) > 0:
+            todo = {self.find(cid) for cid in self.pending}
+            self.pending = []
+            for cid in todo:
+                self.repair(self.find(cid))
+
+    def repair(self, cid: int):
+        uses: Dict[ENode, int] = {}
+        for node, node_class in self.uses[cid]:
+            self.hashcons.pop(node, None)
+            node = self.canonical(node)
+            node_class = self.find(node_class)
+            existing = uses.get(node)
+            if existing is not None and self.union(existing, node_class):
+                node_class = self.find(node_class)
+            uses[node] = node_class
+
+            if node_class not in self.constants:
+                folded = self.fold(node)
+                if folded is not None:
+                    self.union(node_class, self.add_node(folded))
+
+        for node, node_class in uses.items():
+            self.hashcons[node] = self.find(node_class)
+        cid = self.find(cid)
+        self.uses[cid] = list(uses.items())
+        self.nodes[cid] = list(dict.fromkeys(self.canonical(node) for node in self.nodes[cid]))
+
+    def classes(self, head: Head) -> List[int]:
+        ids = self.by_head.get(head)
+        if ids is None:
+            return []
+        canonical = {self.find(cid) for cid in ids}
+        self.by_head[head] = canonical
+        return list(canonical)
+
+    def ematch(self, pattern: Expr, within: Optional[Set[int]] = None) -> List[Tuple[int, Dict[str, int]]]:
+        # (class, blank name -> class) for every way pattern matches an e-node, only in the classes
+        # within if it is given
+        if type(pattern) is Blank:
+            cids = list(self.nodes) if within is None else [cid for cid in within if cid in self.nodes]
+            return [(cid, {pattern.text: cid}) for cid in cids]
+        head = pattern.head_type if type(pattern) is BlankTyped else pattern.head
+        cids = self.classes(head)
+        if within is not None:
+            cids = [cid for cid in cids if cid in within]
+        return [(cid, binding) for cid in cids for binding in self.match(pattern, cid, {})]
+
+    def ancestors(self, cids: Set[int], depth: int) -> Set[int]:
+        # canonical cids and the classes up to depth e-nodes above them
+        found = {self.find(cid) for cid in cids}
+        level = found
+        for _ in range(depth):
+            level = {self.find(user) for cid in level for _, user in self.uses[cid]} - found
+            found |= level
+        return found
+
+    def match(self, pattern: Expr, cid: int, binding: Dict[str, int]) -> Iterator[Dict[str, int]]:
+        kind = type(pattern)
+        if kind is Blank or kind is BlankTyped:
+            bound = binding.get(pattern.text)
+            if bound is not None:
+                if bound == cid:
+                    yield binding
+            elif kind is Blank or any(pattern.head_type == (node.head if isinstance(node, Atom) else node[0])
+                                      for node in self.nodes[cid]):
+                yield {**binding, pattern.text: cid}
+            return
+
+        if isinstance(pattern, Atom):
+            found = self.hashcons.get(pattern)
+            if found is not None and self.find(found) == cid:
+                yield binding
+            return
+
+        arity = len(pattern.args)
+        for node in self.nodes[cid]:
+            if isinstance(node, Atom) or node[0] != pattern.head or len(node) - 2 != arity:
+                continue
+            args = [self.find(arg) for arg in node[2:]]
+            if node[1] & Attribute.COMMUTATIVE:
+                yield from self.match_unordered(pattern.args, 0, args, binding)
+            else:
+                yield from self.match_ordered(pattern.args, 0, args, binding)
+
+    def match_ordered(self, patterns: Tuple[Expr, ...], i: int, args: List[int], binding: Dict[str, int]) -> Iterator[Dict[str, int]]:
+        if i == len(patterns):
+            yield binding
+            return
+        for arg_binding in self.match(patterns[i], args[i], binding):
+            yield from self.match_ordered(patterns, i + 1, args, arg_binding)
+
+    def match_unordered(self, patterns: Tuple[Expr, ...], i: int, args: List[int], binding: Dict[str, int]) -> Iterator[Dict[str, int]]:
+        # patterns[i] against each remaining arg, equal args are tried once
+        if i == len(patterns):
+            yield binding
+            return
+        for j, arg in enumerate(args):
+            if arg in args[:j]:
+                continue
+            rest = args[:j] + args[j + 1:]
+            for arg_binding in self.match(patterns[i], arg, binding):
+                yield from self.match_unordered(patterns, i + 1, rest, arg_binding)
+
+    def instantiate(self, program: List[Step], binding: Dict[str, int]) -> int:
+        ids: List[int] = []
+        for step in program:
+            if type(step) is str:
+                ids.append(binding[step])
+            elif isinstance(step, Atom):
+                ids.append(self.add_node(step))
+            else:
+                head, attr, args = step
+                ids.append(self.add_node((head, attr, *(ids[arg] for arg in args))))
+        return ids[-1]
+
+    def run(self, rules: List[Rule], iterations: int = 30, node_limit: int = 100000, time_limit: float = 10.0) -> str:
+        # applies all rules to all classes per iteration until nothing changes or a budget runs out,
+        # returns why it stopped: "saturated", "iterations", "nodes" or "time". After the first
+        # iteration a rule is only matched in classes that can reach a changed class within the
+        # depth of its pattern, matches in the others were already applied.
+        deadline = perf_counter() + time_limit
+        programs = {rule: rhs_program(rule.rhs, rule.lhs) for rule in rules}
+        conditional = any(len(rule.conditions) > 0 for rule in rules)
+        changed = None
+        costs = None
+        for _ in range(iterations):
+            size, unions = len(self), self.unions
+
+            # all matches are found and their conditions checked before any rule changes the graph.
+            # Conditions see the smallest expressions, a class whose smallest one changed is rechecked.
+            if conditional:
+                previous, costs = costs, self.costs(node_count)
+                if changed is not None:
+                    changed |= {cid for cid, best in costs.items() if previous.get(cid) != best}
+            within = {}
+            self.changed = set()
+            matches = []
+            for rule in rules:
+                if changed is not None and rule.lhs.depth not in within:
+                    within[rule.lhs.depth] = self.ancestors(changed, rule.lhs.depth)
+                found = self.ematch(rule.lhs, None if changed is None else within[rule.lhs.depth])
+                if len(rule.conditions) > 0:
+                    found = [(cid, binding) for cid, binding in found if self.check(rule, binding, costs)]
+                matches.append((rule, found))
+
+            for rule, found in matches:
+                program = programs[rule]
+                for cid, binding in found:
+                    self.union(cid, self.instantiate(program, binding))
+                    if len(self) >= node_limit:
+                        self.rebuild()
+                        return "nodes"
+                    if perf_counter() > deadline:
+                        self.rebuild()
+                        return "time"
+            self.rebuild()
+            changed = self.changed
+
+            if len(self) == size and self.unions == unions:
+                return "saturated"
+        return "iterations"
+
+    def check(self, rule: Rule, binding: Dict[str, int], costs: Dict[int, Tuple[float, ENode]]) -> bool:
+        # conditions are checked on the smallest expression of each bound class
+        return check_conditions(list(rule.conditions), {name: self.build(cid, costs) for name, cid in binding.items()})
+
+    def costs(self, cost: CostFunction) -> Dict[int, Tuple[float, ENode]]:
+        # cheapest (cost, e-node) of every class, a class is revisited when one of its args got cheaper
+        best: Dict[int, Tuple[float, ENode]] = {}
+        work = list(self.nodes)
+        queued = set(work)
+        while len(work) > 0:
+            cid = work.pop()
+            queued.discard(cid)
+            current = best.get(cid)
+            for node in self.nodes[cid]:
+                if isinstance(node, Atom):
+                    candidate = cost(node, [])
+                else:
+                    arg_costs = [best.get(self.find(arg)) for arg in node[2:]]
+                    if any(arg is None for arg in arg_costs):
+                        continue
+                    candidate = cost(node[0], [arg[0] for arg in arg_costs])
+                if current is None or candidate < current[0]:
+                    current = (candidate, node)
+
+            if current is not None and best.get(cid) is not current:
+                best[cid] = current
+                for _, user in self.uses[cid]:
+                    user = self.find(user)
+                    if user not in queued:
+                        queued.add(user)
+                        work.append(user)
+        return best
+
+    def extract(self, cid: int, cost: CostFunction = node_count) -> Expr:
+        return self.build(self.find(cid), self.costs(cost))
+
+    def build(self, cid: int, costs: Dict[int, Tuple[float, ENode]]) -> Expr:
+        # cheapest nodes form a dag (costs grow towards the root), built bottom up
+        built: Dict[int, Expr] = {}
+        stack = [self.find(cid)]
+        while len(stack) > 0:
+            top = stack[-1]
+            if top in built:
+                stack.pop()
+                continue
+            node = costs[top][1]
+            if isinstance(node, Atom):
+                built[top] = node
+                stack.pop()
+                continue
+            args = [self.find(arg) for arg in node[2:]]
+            pending = [arg for arg in args if arg not in built]
+            if len(pending) > 0:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            built[top] = Expr(node[0], [built[arg] for arg in args], node[1])
+        return built[self.find(cid)]
+
+
+def rhs_program(rhs: Expr, lhs: Expr) -> List[Step]:
+    # steps building rhs in post order: a blank name (right hand sides refer to blanks by symbols of
+    # the same name), an atom, or (head, attr, indices of earlier steps), the last step is the root
+    names = set()
+    stack = [lhs]
+    while len(stack) > 0:
+        node = stack.pop()
+        if type(node) is Blank or type(node) is BlankTyped:
+            names.add(node.text)
+        stack.extend(node.args)
+
+    steps: Dict[Expr, int] = {}
+    program: List[Step] = []
+    stack = [rhs]
+    while len(stack) > 0:
+        node = stack[-1]
+        if node in steps:
+            stack.pop()
+            continue
+        if type(node) is Symbol and node.text in names:
+            program.append(node.text)
+        elif isinstance(node, Atom):
+            program.append(node)
+        else:
+            pending = [arg for arg in node.args if arg not in steps]
+            if len(pending) > 0:
+                stack.extend(pending)
+                continue
+            program.append((node.head, node.attr, [steps[arg] for arg in node.args]))
+        stack.pop()
+        steps[node] = len(program) - 1
+    return program
+
+
+def saturate(expr: Expr, rules: List[Rule], cost: CostFunction = node_count, **limits) -> Expr:
+    graph = EGraph()
+    root = graph.add(expr)
+    graph.run(rules, **limits)
+    return graph.extract(root, cost)
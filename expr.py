@@ -1,69 +1,198 @@
-from typing import List, Union
-from head import Head, HeadAttributes, HeadPrintFormat, Attribute, HeadArgNumber
+from functools import cmp_to_key
+from typing import Dict, List, Union
+from weakref import WeakValueDictionary
+from head import Head, HeadPrintFormat, Attribute, HeadArgNumber, head_mask, attribute_mask
 
 ExprArgType = Union['Expr', str, int]
 
+# subtrees shallower than this are traversed recursively, which is faster in python, deeper ones
+# with an explicit stack
+SHALLOW_DEPTH = 64
+
+# structurally equal nodes are built once and shared, an entry lives as long as its node is referenced
+INTERN_TABLE: 'WeakValueDictionary[tuple, Expr]' = WeakValueDictionary()
+
+
+class ExprMeta(type):
+    def __call__(cls, *args, **kwargs):
+        expr = super().__call__(*args, **kwargs)
+        key = expr.intern_key()
+
+        interned = INTERN_TABLE.get(key)
+        if interned is not None:
+            return interned
+
+        expr.summarize()
+        expr.hash = hash(key)
+        INTERN_TABLE[key] = expr
+        return expr
+
+
+# nodes are interned and must not be mutated after construction. Args are a tuple and
+# attributes an int bitmask, the mask of the head's attributes is shared between its nodes.
+# Every node summarizes its subtree: bloom masks of the symbols and heads it contains and its depth,
+# so traversals can skip subtrees that can't contain what they look for.
+class Expr(metaclass=ExprMeta):
+    __slots__ = ('head', 'args', 'attr', 'hash', 'order', 'symbol_bloom', 'head_bloom', 'depth', '__weakref__')
+
+    def __init__(self, head: Head, args: List[ExprArgType] = [], attr: Union[List[Attribute], int] = []):
+        from atom import atomize
 
-class Expr:
-    def __init__(self, head: Head, args: List[ExprArgType] = [], attr: List[Attribute] = []):
         self.head = head
-        self.args = args[:]
-        self.attr = set(HeadAttributes[self.head] + attr)
+        self.attr = head_mask(head) | (attr if isinstance(attr, int) else attribute_mask(attr))
+        self.order = None
 
-        for i in range(len(self.args)):
-            from atom import atomize
-            self.args[i] = atomize(self.args[i])
-            assert isinstance(self.args[i], Expr)
+        args = [arg if isinstance(arg, Expr) else atomize(arg) for arg in args]
 
-        if Attribute.FIXED_ARG_NUM in self.attr:
-            assert len(self.args) == HeadArgNumber[self.head]
+        if self.attr & Attribute.FIXED_ARG_NUM:
+            assert len(args) == HeadArgNumber[self.head]
 
-        if Attribute.ASSOCIATIVE in self.attr and Attribute.NO_FLATTEN not in self.attr:
-            self.flatten()
+        if self.attr & Attribute.ASSOCIATIVE and not self.attr & Attribute.NO_FLATTEN:
+            args = flatten_args(self.head, args)
 
-    def flatten(self, force=False, copy=False, recursive=False):
-        assert Attribute.ASSOCIATIVE in self.attr or force
+        # commutative nodes are stored in canonical order, so a+b and b+a are the same node
+        if self.attr & Attribute.COMMUTATIVE:
+            if any(arg.depth >= SHALLOW_DEPTH for arg in args):
+                args.sort(key=cmp_to_key(compare_terms))
+            else:
+                args.sort(key=Expr.sort_key)
 
-        result = self.copy() if copy else self
+        self.args = tuple(args)
 
-        i = 0
-        while i < len(result.args):
-            if isinstance(result.args[i], Expr) and result.args[i].head is self.head:
-                arg_len = len(result.args[i].args)
-                result.args[i:i+1] = result.args[i].args
-                i += arg_len - 1 if not recursive else -1
-            i += 1
+    def intern_key(self) -> tuple:
+        # children are already interned, so the key hashes and compares in O(len(args))
+        return (type(self), self.head, self.attr, *self.args)
+
+    def summarize(self):
+        symbol_bloom = 0
+        head_bloom = bloom_bit(self.head)
+        depth = 0
+        for arg in self.args:
+            symbol_bloom |= arg.symbol_bloom
+            head_bloom |= arg.head_bloom
+            if arg.depth >= depth:
+                depth = arg.depth + 1
+        self.symbol_bloom = symbol_bloom
+        self.head_bloom = head_bloom
+        self.depth = depth
+
+    def may_contain(self, symbol_bloom: int, head_bloom: int, depth: int) -> bool:
+        # False if no subterm can have all the symbols and heads of a summary of the given depth
+        return self.symbol_bloom & symbol_bloom == symbol_bloom and self.head_bloom & head_bloom == head_bloom \
+            and self.depth >= depth
 
-        return result
+    def sort_key(self) -> tuple:
+        # total term order: numbers, then other atoms by head and value, then compound expressions
+        # by head, arity and args. Cached, child keys are shared so equal subterms compare by identity.
+        # Keys are filled in bottom up with an explicit stack, so deep args don't recurse.
+        if self.order is None:
+            stack = [self]
+            while len(stack) > 0:
+                node = stack[-1]
+                pending = [arg for arg in node.args if arg.order is None]
+                if len(pending) > 0:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                if node.order is None:
+                    node.order = node.order_key()
+        return self.order
+
+    def order_key(self) -> tuple:
+        return (3, self.head, len(self.args), *(arg.sort_key() for arg in self.args))
+
+    def flatten(self, force=False, recursive=False):
+        assert self.attr & Attribute.ASSOCIATIVE or force
+        return self.copy(flatten_args(self.head, self.args, recursive))
+
+    def __reduce__(self):
+        # unpickling goes through the constructor, so the node is interned and hashed in the new process
+        return type(self), (self.head, list(self.args), self.attr)
 
     def copy(self, args=None):
         if args is None:
             args = self.args
-        return Expr(self.head, args, list(self.attr))
+        return Expr(self.head, args, self.attr)
 
     def __eq__(self, other):
-        if type(self) is not type(other):
-            return False
-        if self.head is not other.head:
-            return False
-        if len(self.args) is not len(other.args):
-            return False
-        for i in range(len(self.args)):
-            if self.args[i] != other.args[i]:
-                return False
-        return True
+        return self is other
 
     def __hash__(self):
-        return hash((self.head, *self.args))
+        return self.hash
 
     def __full__(self):
+        if self.depth >= SHALLOW_DEPTH:
+            return self.render(True)
         return str(self.head) + '(' + ','.join(i.__full__() for i in self.args) + ')'
 
     def __str__(self):
+        if self.depth >= SHALLOW_DEPTH:
+            return self.render(False)
         if self.head in HeadPrintFormat:
-            return HeadPrintFormat[self.head](self.head, self.args)
-        else:
-            return str(self.head) + '(' + ','.join(str(i) for i in self.args) + ')'
+            return HeadPrintFormat[self.head](self.head, self.args, [str(arg) for arg in self.args])
+        return str(self.head) + '(' + ','.join(str(arg) for arg in self.args) + ')'
+
+    def format(self, texts: List[str], full: bool) -> str:
+        if not full and self.head in HeadPrintFormat:
+            return HeadPrintFormat[self.head](self.head, self.args, texts)
+        return str(self.head) + '(' + ','.join(texts) + ')'
+
+    def template(self, first: Dict['Expr', str], full: bool) -> list:
+        # the text of the node as literal strings and the args whose texts go between them. The
+        # format gets a marker for every arg that starts with the first character of the arg's text,
+        # which is what decides about brackets.
+        if full or self.head not in HeadPrintFormat:
+            pieces = [str(self.head) + '(']
+            for i, arg in enumerate(self.args):
+                pieces += [arg, ','] if i < len(self.args) - 1 else [arg]
+            return pieces + [')']
+
+        marks = [first[arg] + '\x00{}\x00'.format(i) for i, arg in enumerate(self.args)]
+        parts = self.format(marks, False).split('\x00')
+        pieces = []
+        for i in range(0, len(parts) - 1, 2):
+            arg = self.args[int(parts[i + 1])]
+            pieces += [parts[i][:len(parts[i]) - len(first[arg])], arg]
+        return pieces + [parts[-1]]
+
+    def render(self, full: bool) -> str:
+        # with an explicit stack down to the shallow subtrees, so deep expressions print without deep
+        # recursion. Deep nodes are kept as templates referring to their args and written into one
+        # list at the end, so the text of a chain isn't copied at every level.
+        texts: Dict[Expr, str] = {}
+        templates: Dict[Expr, list] = {}
+        first: Dict[Expr, str] = {}
+        stack = [self]
+        while len(stack) > 0:
+            node = stack[-1]
+            if node in first:
+                stack.pop()
+                continue
+            if node.depth < SHALLOW_DEPTH:
+                texts[node] = node.__full__() if full else str(node)
+                first[node] = texts[node][:1]
+                stack.pop()
+                continue
+            pending = [arg for arg in node.args if arg not in first]
+            if len(pending) > 0:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            template = templates[node] = node.template(first, full)
+            first[node] = next((piece[:1] if type(piece) is str else first[piece] for piece in template
+                                if (piece if type(piece) is str else first[piece]) != ''), '')
+
+        out = []
+        stack = [self]
+        while len(stack) > 0:
+            item = stack.pop()
+            if type(item) is str:
+                out.append(item)
+            elif item in texts:
+                out.append(texts[item])
+            else:
+                stack.extend(reversed(templates[item]))
+        return ''.join(out)
 
     def __add__(self, other):
         return Expr("Plus", [self, other])
@@ -97,4 +226,45 @@ class Expr:
     def __gt__(self, other):
         return Expr("Greater", [self, other])
 
+
+def compare_terms(a: Expr, b: Expr) -> int:
+    # the order of sort_key without nested tuple comparisons, which recurse for deep terms
+    stack = [(a.sort_key(), b.sort_key(), 0)]
+    while len(stack) > 0:
+        x, y, i = stack.pop()
+        n = min(len(x), len(y))
+        while i < n:
+            u, v = x[i], y[i]
+            if u is not v:
+                if type(u) is tuple and type(v) is tuple:
+                    stack.append((x, y, i + 1))
+                    stack.append((u, v, 0))
+                    break
+                if u != v:
+                    return -1 if u < v else 1
+            i += 1
+        else:
+            if len(x) != len(y):
+                return -1 if len(x) < len(y) else 1
+    return 0
+
+
+def bloom_bit(key) -> int:
+    # one of 64 bits, a bloom mask with the bit of a key doesn't prove the key is there, one without it proves it isn't
+    return 1 << (hash(key) & 63)
+
+
+def flatten_args(head: Head, args: List[Expr], recursive=False) -> List[Expr]:
+    result = list(args)
+
+    i = 0
+    while i < len(result):
+        if isinstance(result[i], Expr) and result[i].head is head:
+            arg_len = len(result[i].args)
+            result[i:i+1] = result[i].args
+            i += arg_len - 1 if not recursive else -1
+        i += 1
+
+    return result
+
 # todo: evaluate expressions after crating in operator overloading
@@ -1,78 +1,200 @@
-from enum import Enum
-from typing import Callable, Dict, List
+from enum import IntEnum
+from typing import Callable, Dict, List, Optional
 from collections import defaultdict
-from itertools import product
 
 # Head: TypeAlias = str - TypeAlias python >= 3.11
 Head = str # todo: Change to Expr
 
 
-class Attribute(Enum):
-    COMMUTATIVE = 0     # orderless
-    ASSOCIATIVE = 1     # flattenable
-    FIXED_ARG_NUM = 2   # arg number defined in HeadArgNumber
-    NO_FLATTEN = 3      # don't flatten on create
-    UNEVALUATED = 4     # don't evaluate in eval_expr
-    NUMERIC = 5         # has special evaluation if all args are numeric
-    HAS_IDENTITY = 6    # defined in HeadIdentity, remove arguments of this type and return this when len(args)=0
+# nodes store their attributes as an int bitmask, test with expr.attr & Attribute.X
+class Attribute(IntEnum):
+    COMMUTATIVE = 1 << 0    # orderless
+    ASSOCIATIVE = 1 << 1    # flattenable
+    FIXED_ARG_NUM = 1 << 2  # arg number defined in HeadArgNumber
+    NO_FLATTEN = 1 << 3     # don't flatten on create
+    UNEVALUATED = 1 << 4    # don't evaluate in eval_expr
+    NUMERIC = 1 << 5        # has special evaluation if all args are numeric
+    HAS_IDENTITY = 1 << 6   # defined in HeadIdentity, remove arguments of this type and return this when len(args)=0
+
+
+class TrackedList(list):
+    # list owned by a TrackedDict, every mutation bumps both its own and the owner's version
+    def __init__(self, owner: 'TrackedDict', items=()):
+        super().__init__(items)
+        self.owner = owner
+        self.version = 0
+
+    def changed(self):
+        self.version += 1
+        self.owner.version += 1
+
+
+def tracked(method: Callable) -> Callable:
+    def mutate(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.changed()
+        return result
+    return mutate
+
+
+for name in ("append", "extend", "insert", "remove", "pop", "clear", "sort", "reverse",
+             "__setitem__", "__delitem__", "__iadd__", "__imul__"):
+    setattr(TrackedList, name, tracked(getattr(list, name)))
+
+
+class TrackedDict(defaultdict):
+    # defaultdict of lists with a version that changes whenever any of its lists change,
+    # lets caches built from the contents detect that they are stale
+    def __init__(self, items: Dict = {}):
+        super().__init__(list)
+        self.version = 0
+        for key, value in items.items():
+            self[key] = value
+
+    def __missing__(self, key):
+        # an empty list doesn't change anything, so don't bump the version
+        value = TrackedList(self)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, TrackedList(self, value))
+        self.version += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.version += 1
+        return dict.popitem(self)
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = [] if default is None else default
+        return self[key]
 
 
 # rename global variables to all caps
-HeadAttributes: Dict[Head, List[Attribute]] = defaultdict(list, {
+HeadAttributes: Dict[Head, List[Attribute]] = TrackedDict({
     "Plus": [Attribute.COMMUTATIVE, Attribute.ASSOCIATIVE, Attribute.NUMERIC, Attribute.HAS_IDENTITY],
     "Mult": [Attribute.COMMUTATIVE, Attribute.ASSOCIATIVE, Attribute.NUMERIC, Attribute.HAS_IDENTITY],
     "Power": [Attribute.FIXED_ARG_NUM, Attribute.NUMERIC],
     "Neg": [Attribute.FIXED_ARG_NUM, Attribute.NUMERIC],
     "Less": [Attribute.FIXED_ARG_NUM, Attribute.NUMERIC],
-    "Greater": [Attribute.FIXED_ARG_NUM, Attribute.NUMERIC]
+    "Greater": [Attribute.FIXED_ARG_NUM, Attribute.NUMERIC],
+    "D": [Attribute.FIXED_ARG_NUM]
 })
 
-# add parenthesis
-HeadPrintFormat: Dict[Head, Callable[[Head, list], str]] = {
-    "Plus": lambda head, args: '+'.join(str_parenth(head, args)),
-    "Mult": lambda head, args: '*'.join(str_parenth(head, args)),
-    "Power": lambda head, args: '{}^{}'.format(*str_parenth(head, args)),
-    "Neg": lambda head, args: '-{}'.format(*str_parenth(head, args)),
-    "Less": lambda head, args: '{}<{}'.format_map(*str_parenth(head, args)),
-    "Greater": lambda head, args: '{}>{}'.format_map(*str_parenth(head, args))
+
+class HeadMasks(dict):
+    # attribute bitmask of every head, built on first use and dropped when HeadAttributes change
+    def __init__(self):
+        super().__init__()
+        self.version = HeadAttributes.version
+
+    def __missing__(self, head: Head) -> int:
+        mask = attribute_mask(HeadAttributes.get(head, []))
+        self[head] = mask
+        return mask
+
+
+HEAD_MASKS = HeadMasks()
+
+
+def attribute_mask(attributes: List[Attribute]) -> int:
+    mask = 0
+    for attribute in attributes:
+        mask |= attribute
+    return int(mask)
+
+
+def head_mask(head: Head) -> int:
+    if HEAD_MASKS.version != HeadAttributes.version:
+        HEAD_MASKS.clear()
+        HEAD_MASKS.version = HeadAttributes.version
+    return HEAD_MASKS[head]
+
+# add parenthesis, called with the args and their printed texts
+HeadPrintFormat: Dict[Head, Callable[[Head, list, List[str]], str]] = {
+    "Plus": lambda head, args, texts: '+'.join(str_parenth(head, args, texts)),
+    "Mult": lambda head, args, texts: '*'.join(str_parenth(head, args, texts)),
+    "Power": lambda head, args, texts: '{}^{}'.format(*str_parenth(head, args, texts, right_associative=True)),
+    "Neg": lambda head, args, texts: '-{}'.format(*str_parenth(head, args, texts, prefix=True)),
+    "Less": lambda head, args, texts: '{}<{}'.format(*str_parenth(head, args, texts)),
+    "Greater": lambda head, args, texts: '{}>{}'.format(*str_parenth(head, args, texts))
 }
 
 HeadArgNumber: Dict[Head, int] = {
     "Power":    2,
     "Neg":      1,
     "Less":     2,
-    "Greater":  2
+    "Greater":  2,
+    "D":        2
 }
 
 HeadParenthesisPriority: Dict[Head, int] = {
+    "Less":     0,
+    "Greater":  0,
     "Neg":      1,
     "Plus":     2,
     "Mult":     3,
     "Power":    4
 }
 
-HeadNumericEval: Dict[Head, Callable[[List['Expr']], 'Expr']] = {
-    "Plus": lambda args: sum(args),
-    "Mult": lambda args: product(args),
-    "Power": lambda args: args[0] ** args[1],
-    "Neg": lambda args: -args[0],
-    "Less": lambda args: args[0] < args[1],
-    "Greater": lambda args: args[0] > args[1]
+# called when all args are numbers, returns None if the node has no numeric value and stays as it is
+HeadNumericEval: Dict[Head, Callable[[List['Expr']], Optional['Expr']]] = {
+    "Plus": lambda args: numeric_kernel().fold_plus(args),
+    "Mult": lambda args: numeric_kernel().fold_mult(args),
+    "Power": lambda args: numeric_kernel().fold_power(args[0], args[1]),
+    "Neg": lambda args: numeric_kernel().fold_neg(args[0]),
+    "Less": lambda args: numeric_kernel().fold_compare(args[0], args[1], True),
+    "Greater": lambda args: numeric_kernel().fold_compare(args[0], args[1], False)
 }
 
+
+def numeric_kernel():
+    import nums
+    return nums
+
 HeadIdentity: Dict[Head, 'Expr'] = {
     "Plus": 0, # check if needs to be replaced with expr types
     "Mult": 1
 }
 
+# like terms are combined by adding up their numeric part, a term of Plus is read as a Mult with
+# a numeric factor (2*x -> x, 2) and a term of Mult as a Power with a numeric exponent (x^2 -> x, 2)
+HeadCollect: Dict[Head, Head] = {
+    "Plus": "Mult",
+    "Mult": "Power"
+}
+
 
-def str_parenth(head: Head, args: list) -> List[str]:
+def str_parenth(head: Head, args: list, texts: List[str], right_associative=False, prefix=False) -> List[str]:
+    # a right associative head also parenthesizes a first arg of the same priority, (a^b)^c. A prefix
+    # minus parenthesizes an arg starting with a number, -(2*x) and -(4) as -2*x and -4 are literals
     head_prio = HeadParenthesisPriority[head]
     out_args = []
-    for arg in args:
-        if arg.head not in HeadParenthesisPriority:
-            out_args.append(str(arg))
+    for i, (arg, text) in enumerate(zip(args, texts)):
+        if prefix and arg.head != "Power" and (text[:1].isdigit() or text.startswith('.')):
+            out_args.append('({})'.format(text))
+        elif arg.head not in HeadParenthesisPriority:
+            # a negative number as the base, (-3)^2, -3^2 is -(3^2)
+            out_args.append('({})'.format(text) if right_associative and i == 0 and text.startswith('-') else text)
         else:
             arg_prio = HeadParenthesisPriority[arg.head]
-            out_args.append('({})'.format(str(arg)) if arg_prio < head_prio else str(arg))
+            parenthesize = arg_prio < head_prio or (right_associative and i == 0 and arg_prio == head_prio)
+            out_args.append('({})'.format(text) if parenthesize else text)
     return out_args
@@ -0,0 +1,152 @@
+from typing import Dict, FrozenSet, Optional, Sequence, Set, Tuple
+from expr import Expr
+from atom import Atom, Symbol
+from head import Attribute, HeadAttributes
+from rule import GLOBAL_RULES, eval_expr, substitute
+
+# evaluation of an expression that is edited in small steps. The evaluated result of every node is
+# kept together with the symbols the node contains. Binding a symbol drops the results of the nodes
+# containing it, which are the paths from its occurrences up to the root, and replacing a subtree
+# builds new nodes only along its path. The next evaluate recomputes just those nodes, every other
+# arg is looked up. For a bound symbol a the result is the same as eval_expr(replace(expr, a, value)).
+#   evaluator = IncrementalEvaluator(expr)
+#   evaluator.evaluate()
+#   evaluator.bind(a, Integer(2))
+#   evaluator.evaluate()      # only the nodes above a are evaluated again
+
+NO_SYMBOLS: FrozenSet[Symbol] = frozenset()
+
+
+class IncrementalEvaluator:
+    def __init__(self, expr: Expr, bindings: Optional[Dict[Symbol, Expr]] = None):
+        self.expr = expr
+        self.bindings: Dict[Symbol, Expr] = dict(bindings or {})
+        self.results: Dict[Expr, Expr] = {}
+        self.symbols: Dict[Expr, FrozenSet[Symbol]] = {}
+        self.dependents: Dict[Symbol, Set[Expr]] = {}     # nodes with a result that contain the symbol
+        self.versions = (GLOBAL_RULES.version, HeadAttributes.version)
+        self.recomputed = 0     # nodes evaluated by the last evaluate
+
+    def invalidate(self, symbol: Symbol):
+        for node in self.dependents.pop(symbol, ()):
+            self.results.pop(node, None)
+
+    def bind(self, symbol: Symbol, value: Expr):
+        if self.bindings.get(symbol) is not value:
+            self.bindings[symbol] = value
+            self.invalidate(symbol)
+
+    def unbind(self, symbol: Symbol):
+        if self.bindings.pop(symbol, None) is not None:
+            self.invalidate(symbol)
+
+    def replace_at(self, path: Sequence[int], new: Expr) -> Expr:
+        # replaces the subtree reached by following the arg indices in path, only the nodes on the
+        # path are rebuilt and the unchanged args keep their results
+        spine = [self.expr]
+        for i in path:
+            spine.append(spine[-1].args[i])
+
+        node = new
+        for parent, i in zip(reversed(spine[:-1]), reversed(path)):
+            args = list(parent.args)
+            args[i] = node
+            node = parent.copy(args)
+
+        self.expr = node
+        return node
+
+    def evaluate(self) -> Tuple[bool, Expr]:
+        versions = (GLOBAL_RULES.version, HeadAttributes.version)
+        if versions != self.versions:
+            self.clear()
+            self.versions = versions
+
+        results = self.results
+        self.recomputed = 0
+        stack = [self.expr]
+        while len(stack) > 0:
+            node = stack[-1]
+            if node in results:
+                stack.pop()
+                continue
+
+            if isinstance(node, Atom):
+                value = self.bindings.get(node)
+                result = eval_expr(node if value is None else value)[1]
+            elif node.attr & Attribute.UNEVALUATED:
+                result = substitute(node, self.bindings)[1] if len(self.bindings) > 0 else node
+            else:
+                pending = [arg for arg in node.args if arg not in results]
+                if len(pending) > 0:
+                    stack.extend(pending)
+                    continue
+                result = self.evaluate_node(node)
+
+            stack.pop()
+            self.store(node, result)
+
+        result = results[self.expr]
+        return result is not self.expr, result
+
+    def evaluate_node(self, node: Expr) -> Expr:
+        # the args are already evaluated, eval_expr sees them as done through its visited map
+        args = [self.results[arg] for arg in node.args]
+        visited = {arg: (False, arg) for arg in args}
+        if any(new is not old for new, old in zip(args, node.args)):
+            node = node.copy(args)
+        return eval_expr(node, visited)[1]
+
+    def store(self, node: Expr, result: Expr):
+        for symbol in self.symbols_of(node):
+            self.dependents.setdefault(symbol, set()).add(node)
+        self.results[node] = result
+        self.recomputed += 1
+
+    def symbols_of(self, expr: Expr) -> FrozenSet[Symbol]:
+        # a node with a single arg containing symbols shares that arg's set
+        stack = [expr]
+        while len(stack) > 0:
+            node = stack[-1]
+            if node in self.symbols:
+                stack.pop()
+                continue
+            pending = [arg for arg in node.args if arg not in self.symbols]
+            if len(pending) > 0:
+                stack.extend(pending)
+                continue
+            stack.pop()
+
+            if type(node) is Symbol:
+                symbols = frozenset([node])
+            else:
+                arg_symbols = [self.symbols[arg] for arg in node.args if len(self.symbols[arg]) > 0]
+                if len(arg_symbols) == 0:
+                    symbols = NO_SYMBOLS
+                elif len(arg_symbols) == 1:
+                    symbols = arg_symbols[0]
+                else:
+                    symbols = frozenset().union(*arg_symbols)
+            self.symbols[node] = symbols
+        return self.symbols[expr]
+
+    def clear(self):
+        self.results.clear()
+        self.dependents.clear()
+
+    def collect(self):
+        # forgets the nodes that are no longer part of the expression after edits
+        reachable = set()
+        stack = [self.expr]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node not in reachable:
+                reachable.add(node)
+                stack.extend(node.args)
+
+        self.results = {node: result for node, result in self.results.items() if node in reachable}
+        self.symbols = {node: symbols for node, symbols in self.symbols.items() if node in reachable}
+        for symbol, nodes in list(self.dependents.items()):
+            nodes &= reachable
+            if len(nodes) == 0:
+                del self.dependents[symbol]
@@ -0,0 +1,104 @@
+from typing import Callable, Dict, List, Union
+from expr import Expr
+from atom import Atom, Symbol, Boolean
+from head import Head
+from nums import Integer, Rational, Real, Complex
+from cse import count_uses
+
+# heads evaluated with array operators, every arg is a python expression string
+LambdifyOperators: Dict[Head, Callable[[List[str]], str]] = {
+    "Plus": lambda args: '(' + ' + '.join(args) + ')',
+    "Mult": lambda args: '(' + ' * '.join(args) + ')',
+    "Power": lambda args: '({} ** {})'.format(*args),
+    "Neg": lambda args: '(-{})'.format(*args),
+    "Less": lambda args: '({} < {})'.format(*args),
+    "Greater": lambda args: '({} > {})'.format(*args)
+}
+
+MAX_NESTING = 50
+
+
+def lambdify(expr: Expr, symbols: List[Symbol], functions: Dict[Head, Callable] = {}, batched=False) -> Callable:
+    # compiles expr into a numpy function of the given symbols. Args broadcast against each other,
+    # with batched=True the function takes one array with the symbols along the last axis instead.
+    # Other heads can be mapped to numpy functions (e.g. {"Sin": numpy.sin}), subexpressions
+    # that occur more than once are computed once.
+    import numpy
+
+    names: Dict[Expr, str] = {symbol: 'x{}'.format(i) for i, symbol in enumerate(symbols)}
+    namespace = {'numpy': numpy}
+    for i, (head, function) in enumerate(functions.items()):
+        namespace['f{}'.format(i)] = function
+
+    function_names = {head: 'f{}'.format(i) for i, head in enumerate(functions)}
+    lines = []
+    code: Dict[Expr, str] = {}
+    nesting: Dict[Expr, int] = {}   # brackets in the source of a node
+    uses = count_uses(expr)
+
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack[-1]
+        if node in code:
+            stack.pop()
+            continue
+
+        pending = [arg for arg in node.args if arg not in code]
+        if len(pending) > 0 and not isinstance(node, Atom):
+            stack.extend(pending)
+            continue
+
+        stack.pop()
+        source = node_source(node, [code[arg] for arg in node.args], names, function_names)
+        level = 1 + max((nesting[arg] for arg in node.args), default=0) if not isinstance(node, Atom) else 0
+        # shared nodes are computed once, deep nodes are split so python's parser doesn't hit its nesting limit
+        if (uses[node] > 1 or level >= MAX_NESTING) and not isinstance(node, Atom):
+            temp = 't{}'.format(len(lines))
+            lines.append('    {} = {}'.format(temp, source))
+            source = temp
+            level = 0
+        code[node] = source
+        nesting[node] = level
+
+    args = ', '.join(names[symbol] for symbol in symbols)
+    if batched:
+        header = ['def compiled(points):', '    points = numpy.asarray(points)',
+                  '    points = points.astype(numpy.result_type(points, float))']
+        header += ['    {} = points[..., {}]'.format(names[symbol], i) for i, symbol in enumerate(symbols)]
+    else:
+        header = ['def compiled({}):'.format(args)]
+        header += ['    {0} = numpy.asarray({0})'.format(names[symbol]) for symbol in symbols]
+        header += ['    {0} = {0}.astype(numpy.result_type({0}, float))'.format(names[symbol]) for symbol in symbols]
+
+    source = '\n'.join(header + lines + ['    return ' + code[expr]])
+    exec(compile(source, '<lambdify>', 'exec'), namespace)
+
+    compiled = namespace['compiled']
+    compiled.source = source
+    return compiled
+
+
+def node_source(node: Expr, args: List[str], names: Dict[Expr, str], function_names: Dict[Head, str]) -> str:
+    if node in names:
+        return names[node]
+    if type(node) is Integer or type(node) is Real:
+        return number_source(node.value)
+    if type(node) is Rational:
+        return '({}/{})'.format(node.num.value, node.den.value)
+    if type(node) is Boolean:
+        return repr(node.value)
+    if type(node) is Complex:
+        return 'complex({}, {})'.format(node_source(node.real, [], names, function_names), node_source(node.imag, [], names, function_names))
+    if node.head in function_names:
+        return '{}({})'.format(function_names[node.head], ', '.join(args))
+    if node.head in LambdifyOperators:
+        return LambdifyOperators[node.head](args)
+    raise ValueError("Can't lambdify {}, not a symbol and no function given for head {}".format(node, node.head))
+
+
+def number_source(value: Union[int, float]) -> str:
+    # negative literals are parenthesized (-3 ** x is -(3 ** x)), inf and nan have no literal
+    if value != value or value in (float('inf'), float('-inf')):
+        return "float('{}')".format(value)
+    text = repr(value)
+    return '(' + text + ')' if text.startswith('-') else text
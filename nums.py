@@ -1,20 +1,72 @@
-from typing import Union
-from atom import Atom
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from fractions import Fraction
+from expr import ExprMeta, bloom_bit
+from atom import Atom, NUMBER_TYPES, atomize
+from head import Head, head_mask
 from math import gcd
+from struct import Struct
+
+SMALL_INTEGER_LIMIT = 1024
+REAL_BITS = Struct("<d")
+
+# flyweights are kept alive for the whole run, building one of them is a dict lookup
+SMALL_INTEGERS: Dict[int, 'Integer'] = {}
+COMMON_RATIONALS: Dict[Tuple[int, int], 'Rational'] = {}
+
+
+class NumberMeta(ExprMeta):
+    def __call__(cls, *args):
+        number = cls.flyweight(*args)
+        if number is None:
+            number = super().__call__(*args)
+        return number
+
+
+# numbers are shared, once a number is interned none of its fields can change (the cached
+# sort key is derived from them and may still be filled in)
+class Number(Atom, metaclass=NumberMeta):
+    __slots__ = ()
+
+    def __init__(self, head: Head):
+        # the common fields skip the immutability check, hash stays None until the node is interned
+        set_field = object.__setattr__
+        set_field(self, "hash", None)
+        set_field(self, "head", head)
+        set_field(self, "args", ())
+        set_field(self, "attr", head_mask(head))
+        set_field(self, "order", None)
+        set_field(self, "symbol_bloom", 0)
+        set_field(self, "head_bloom", bloom_bit(head))
+        set_field(self, "depth", 0)
+
+    @staticmethod
+    def flyweight(*args) -> Optional['Number']:
+        return None
+
+    def __setattr__(self, name, value):
+        if self.hash is not None and name != "order":
+            raise AttributeError("{} is immutable".format(type(self).__name__))
+        object.__setattr__(self, name, value)
 
 
 # to int add arithmetic when other is int
-class Integer(Atom):
+class Integer(Number):
+    __slots__ = ('value',)
+
     def __init__(self, n: int):
         super().__init__("Integer")
         assert type(n) is int
         self.value = n
 
-    def __eq__(self, other):
-        return type(other) is Integer and self.value == other.value
+    @staticmethod
+    def flyweight(n: int) -> Optional['Integer']:
+        return SMALL_INTEGERS.get(n) if type(n) is int else None
+
+    def intern_key(self) -> tuple:
+        return type(self), self.value
 
-    def __hash__(self):
-        return hash((self.head, self.value))
+    def order_key(self) -> tuple:
+        return 0, self.value, 0
 
     def __str__(self):
         return str(self.value)
@@ -90,26 +142,36 @@ class Integer(Atom):
         return NotImplemented
 
 
-class Rational(Atom):
+class Rational(Number):
+    __slots__ = ('num', 'den')
+
     def __init__(self, num: Union[int, Integer], den: Union[int, Integer]):
         super().__init__("Rational")
-        self.num = num if type(num) is Integer else Integer(num)
-        self.den = den if type(den) is Integer else Integer(den)
+        # reduce on plain ints, Integer atoms are shared and can't be modified in place
+        num = num.value if type(num) is Integer else num
+        den = den.value if type(den) is Integer else den
 
-        comm_factor = gcd(self.num.value, self.den.value)
+        comm_factor = gcd(num, den)
         if comm_factor != 1:
-            self.num.value //= comm_factor
-            self.den.value //= comm_factor
+            num //= comm_factor
+            den //= comm_factor
+
+        if den < 0:
+            num = -num
+            den = -den
 
-        if self.den < 0:
-            self.num *= -1
-            self.den *= -1
+        self.num = Integer(num)
+        self.den = Integer(den)
 
-    def __eq__(self, other):
-        return type(other) is Rational and (self.num * other.den == self.den * other.num)
+    @staticmethod
+    def flyweight(num: Union[int, Integer], den: Union[int, Integer]) -> Optional['Rational']:
+        return COMMON_RATIONALS.get((num, den)) if type(num) is int and type(den) is int else None
 
-    def __hash__(self):
-        return hash((self.head, self.num, self.den))
+    def intern_key(self) -> tuple:
+        return type(self), self.num, self.den
+
+    def order_key(self) -> tuple:
+        return 0, Fraction(self.num.value, self.den.value), 1
 
     def __str__(self):
         return str(self.num) + '/' + str(self.den)
@@ -176,17 +238,23 @@ class Rational(Atom):
         return NotImplemented
 
 
-class Real(Atom):
+class Real(Number):
+    __slots__ = ('value',)
+
     def __init__(self, r: float):
         super().__init__("Real")
         assert type(r) is float
         self.value = r
 
-    def __eq__(self, other):
-        return type(other) is Real and self.value == other.value
+    def intern_key(self) -> tuple:
+        # keyed on the bits, 0.0 == -0.0 would share one node and a nan would never be found again
+        return type(self), REAL_BITS.pack(self.value)
 
-    def __hash__(self):
-        return hash((self.head, self.value))
+    def __reduce__(self):
+        return type(self), (self.value,)
+
+    def order_key(self) -> tuple:
+        return 0, self.value, 2
 
     def __str__(self):
         return str(self.value)
@@ -264,17 +332,161 @@ class Real(Atom):
         return NotImplemented
 
 
-class Complex(Atom):
+class Complex(Number):
+    __slots__ = ('real', 'imag')
+
     def __init__(self, real: Union[Integer, Rational, Real], imag: Union[Integer, Rational, Real]):
         super().__init__("Complex")
         self.real = real
         self.imag = imag
 
-    def __eq__(self, other):
-        return type(other) is Real and self.real == other.real and self.imag == other.imag
+    def intern_key(self) -> tuple:
+        return type(self), self.real, self.imag
 
-    def __hash__(self):
-        return hash((self.head, self.real, self.imag))
+    def order_key(self) -> tuple:
+        return 1, str(self.real), str(self.imag)
 
     def __str__(self):
         return '{}+i{}'.format(self.real, self.imag)
+
+
+NUMBER_TYPES.update((Integer, Rational, Real, Complex))
+
+
+def to_number(number: Atom) -> Union[int, Fraction, float, complex]:
+    if type(number) is Integer or type(number) is Real:
+        return number.value
+    if type(number) is Rational:
+        return Fraction(number.num.value, number.den.value)
+    if type(number) is Complex:
+        return complex(to_number(atomize(number.real)), to_number(atomize(number.imag)))
+    raise TypeError("not a number: {}".format(number))
+
+
+
+NativeNumber = Union[int, Fraction, float, complex]
+
+
+def from_number(value: NativeNumber) -> Number:
+    if type(value) is int:
+        return Integer(value)
+    if type(value) is Fraction:
+        return Integer(value.numerator) if value.denominator == 1 else Rational(value.numerator, value.denominator)
+    if type(value) is float:
+        return Real(value)
+    if type(value) is complex:
+        return Complex(Real(value.real), Real(value.imag))
+    raise TypeError("not a number: {}".format(value))
+
+
+# an exact zero imaginary part drops the Complex, a float one is kept like python does
+def from_parts(real: NativeNumber, imag: NativeNumber) -> Number:
+    if imag == 0 and type(imag) is not float:
+        return from_number(real)
+    return Complex(from_number(real), from_number(imag))
+
+
+def complex_parts(number: Complex) -> Tuple[NativeNumber, NativeNumber]:
+    return to_number(atomize(number.real)), to_number(atomize(number.imag))
+
+
+# numeric folding for the NUMERIC heads. Arguments are unpacked to native values once and
+# accumulated per kind (int, num/den pair, float, imaginary part), the kinds are promoted into
+# each other only when the fold is done so a long sum of Integers is a single int loop.
+def sum_value(args: Iterable[Number]) -> Tuple[NativeNumber, NativeNumber]:
+    total, num, den = 0, 0, 1
+    real: Optional[float] = None
+    imag: List[Number] = []
+    for arg in args:
+        kind = type(arg)
+        if kind is Complex:
+            imag.append(atomize(arg.imag))
+            arg = atomize(arg.real)
+            kind = type(arg)
+
+        if kind is Integer:
+            total += arg.value
+        elif kind is Rational:
+            n, d = arg.num.value, arg.den.value
+            if d == den:
+                num += n
+            else:
+                # keep den the lcm of the denominators seen so far, the fraction is reduced at the end
+                g = gcd(den, d)
+                num, den = num * (d // g) + n * (den // g), den // g * d
+        elif kind is Real:
+            real = arg.value if real is None else real + arg.value
+        else:
+            raise TypeError("not a number: {}".format(arg))
+
+    value = total if num == 0 else Fraction(total * den + num, den)
+    if real is not None:
+        value = real + value
+    return value, sum_value(imag)[0] if len(imag) > 0 else 0
+
+
+def fold_plus(args: Iterable[Number]) -> Number:
+    return from_parts(*sum_value(args))
+
+
+def fold_mult(args: Iterable[Number]) -> Number:
+    num, den = 1, 1
+    real: Optional[float] = None
+    parts: Optional[Tuple[NativeNumber, NativeNumber]] = None
+    for arg in args:
+        kind = type(arg)
+        if kind is Integer:
+            num *= arg.value
+        elif kind is Rational:
+            num *= arg.num.value
+            den *= arg.den.value
+        elif kind is Real:
+            real = arg.value if real is None else real * arg.value
+        elif kind is Complex:
+            re, im = complex_parts(arg)
+            parts = (re, im) if parts is None else (parts[0] * re - parts[1] * im, parts[0] * im + parts[1] * re)
+        else:
+            raise TypeError("not a number: {}".format(arg))
+
+    value = num if den == 1 else Fraction(num, den)
+    if real is not None:
+        value = real * value
+    if parts is not None:
+        return from_parts(value * parts[0], value * parts[1])
+    return from_number(value)
+
+
+def fold_neg(arg: Number) -> Number:
+    if type(arg) is Complex:
+        re, im = complex_parts(arg)
+        return from_parts(-re, -im)
+    return from_number(-to_number(arg))
+
+
+# None when the power has no number value (division by zero) or isn't exact (2^(1/2)), the node
+# is left as it is then
+def fold_power(base: Number, exponent: Number) -> Optional[Number]:
+    b, e = to_number(base), to_number(exponent)
+    if type(e) is Fraction and type(b) is not float and type(b) is not complex:
+        return None
+    if type(b) is int and type(e) is int and e < 0:
+        b = Fraction(b)
+    try:
+        value = b ** e
+    except ZeroDivisionError:
+        return None
+    if type(value) is Fraction and value.denominator == 1:
+        value = value.numerator
+    return from_number(value)
+
+
+# complex numbers have no order, comparisons with them stay unevaluated
+def fold_compare(left: Number, right: Number, less: bool) -> Optional[bool]:
+    if type(left) is Complex or type(right) is Complex:
+        return None
+    a, b = to_number(left), to_number(right)
+    return a < b if less else a > b
+
+SMALL_INTEGERS.update((n, Integer(n)) for n in range(-SMALL_INTEGER_LIMIT, SMALL_INTEGER_LIMIT + 1))
+COMMON_RATIONALS.update(((num, den), Rational(num, den)) for den in range(2, 13) for num in range(-den, den + 1)
+                        if gcd(num, den) == 1)
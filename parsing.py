@@ -0,0 +1,255 @@
+import json
+import re
+import sys
+from fractions import Fraction
+from typing import Dict, Iterator, List, Tuple, Union
+from expr import Expr
+from atom import String, Symbol, TRUE, FALSE
+from nums import Integer, Real, from_number
+from rule import Blank, BlankTyped
+from head import Head
+
+# parser for the infix syntax expressions print in (x+2*y^2, f(a,-b), x<1/2) and for the full form
+# (Plus(x,Mult(2,Power(y,2)))), a call head(args) is valid in both. Operators from loosest to tightest:
+#   < >     comparison
+#   -       prefix minus, takes everything up to the next comparison: -a+b is Neg(a+b)
+#   + -     a-b is Plus(a,Neg(b))
+#   * /     a/b is Mult(a,Power(b,-1))
+#   ^       right associative
+# A minus directly in front of a number is part of the literal unless a ^ follows, so x^-1 is
+# Power(x,-1) and -3^2 is Neg(Power(3,2)), and n/m with integers n, m is a Rational literal.
+# Strings are written in double quotes. Several expressions can be separated by ; or new lines.
+# Parsing is iterative over a token stream, nesting depth and input size are only limited by memory.
+# Chains of + and * are collected into one arg list and each node is built once.
+
+TOKEN = re.compile(r'''
+    (?P<space>[ \t\r]+)
+  | (?P<newline>\n)
+  | (?P<real>(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+)
+  | (?P<rational>\d+/\d+(?![\w.]))
+  | (?P<integer>\d+)
+  | (?P<blank>_[^\W_]*(?:_[^\W\d_]\w*)?)
+  | (?P<name>[^\W\d_]\w*)
+  | (?P<string>"(?:[^"\\\n]|\\.)*")
+  | (?P<operator>[-+*/^<>(),;])
+  | (?P<error>.)
+''', re.VERBOSE)
+
+# operator: (precedence, head)
+BINARY = {
+    "<": (1, "Less"),
+    ">": (1, "Greater"),
+    "+": (3, "Plus"),
+    "-": (3, "Plus"),
+    "*": (4, "Mult"),
+    "/": (4, "Mult"),
+    "^": (5, "Power")
+}
+NEG_PRECEDENCE = 2
+
+# entries of the operator stack
+OPERATOR = 0
+NEG = 1
+CALL = 2
+GROUP = 3
+
+
+class ParseError(ValueError):
+    def __init__(self, message: str, text: str, position: int):
+        line = text.count("\n", 0, position) + 1
+        column = position - text.rfind("\n", 0, position)
+        super().__init__("{} at line {}, column {}".format(message, line, column))
+        self.position = position
+
+
+class Chain:
+    # args of a + or * chain that is still being parsed
+    __slots__ = ('head', 'args')
+
+    def __init__(self, head: Head, args: List[Expr]):
+        self.head = head
+        self.args = args
+
+
+Value = Union[Expr, Chain]
+
+
+def value(item: Value) -> Expr:
+    return Expr(item.head, item.args) if type(item) is Chain else item
+
+
+def reduce(values: List[Value], ops: List[Tuple[int, int, object]]):
+    kind, _, operator = ops.pop()
+    if kind == NEG:
+        values.append(Expr("Neg", [value(values.pop())]))
+        return
+
+    right = value(values.pop())
+    left = values.pop()
+    head = BINARY[operator][1]
+    if operator == "-":
+        right = Expr("Neg", [right])
+    elif operator == "/":
+        right = Expr("Power", [right, Integer(-1)])
+
+    if head == "Plus" or head == "Mult":
+        if type(left) is Chain and left.head == head:
+            left.args.append(right)
+            values.append(left)
+        else:
+            values.append(Chain(head, [value(left), right]))
+    else:
+        values.append(Expr(head, [value(left), right]))
+
+
+def reduce_to_bracket(values: List[Value], ops: List[Tuple[int, int, object]]) -> bool:
+    # reduces up to the innermost open call or group, False if there is none
+    while len(ops) > 0 and ops[-1][0] < CALL:
+        reduce(values, ops)
+    return len(ops) > 0
+
+
+def literal(kind: str, token: str, negative: bool) -> Expr:
+    sign = -1 if negative else 1
+    if kind == "integer":
+        return Integer(sign * int(token))
+    if kind == "real":
+        return Real(sign * float(token))
+    num, den = token.split("/")
+    return from_number(Fraction(sign * int(num), int(den)))
+
+
+def atom(kind: str, token: str) -> Expr:
+    if kind == "name":
+        return TRUE if token == "True" else FALSE if token == "False" else Symbol(token)
+    if kind == "string":
+        return String(json.loads(token))
+    name, _, head_type = token[1:].partition("_")
+    return BlankTyped(name, sys.intern(head_type)) if head_type else Blank(name)
+
+
+def parse_all(text: str) -> Iterator[Expr]:
+    values: List[Value] = []
+    ops: List[Tuple[int, int, object]] = []   # (entry kind, precedence, operator or (head, first arg))
+    depth = 0               # open calls and groups
+    expect_operand = True
+    after_minus = False     # previous token was a prefix minus
+    name = None             # previous token if it was a name, an opening bracket makes it a call head
+    unsigned = None         # (kind, token) if the previous token was a number with the minus folded in
+    atoms: Dict[Tuple[str, bool], Expr] = {}   # atoms by token and sign, repeated names and numbers are built once
+
+    for match in TOKEN.finditer(text):
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        token = match.group()
+        position = match.start()
+
+        if kind == "error":
+            raise ParseError("unexpected character {!r}".format(token), text, position)
+
+        if kind == "newline" or token == ";":
+            # a line break inside brackets or after an operator continues the expression
+            if not expect_operand and depth == 0:
+                reduce_to_bracket(values, ops)
+                yield value(values.pop())
+                expect_operand = True
+            elif token == ";" and len(ops) > 0:
+                raise ParseError("unexpected ';'", text, position)
+            after_minus = False
+            name = None
+            continue
+
+        if expect_operand:
+            if kind != "operator":
+                negative = after_minus and kind in ("integer", "real", "rational")
+                parsed = atoms.get((token, negative))
+                if parsed is None:
+                    try:
+                        parsed = literal(kind, token, negative) if kind in ("integer", "real", "rational") else atom(kind, token)
+                    except ZeroDivisionError:
+                        raise ParseError("zero denominator", text, position)
+                    atoms[token, negative] = parsed
+                if negative:
+                    ops.pop()
+                unsigned = (kind, token) if negative else None
+                values.append(parsed)
+                expect_operand = False
+            elif token == "-":
+                ops.append((NEG, NEG_PRECEDENCE, None))
+            elif token == "(":
+                ops.append((GROUP, 0, len(values)))
+                depth += 1
+            elif token == ")" and len(ops) > 0 and ops[-1][0] == CALL and ops[-1][2][1] == len(values):
+                head = ops.pop()[2][0]
+                values.append(Expr(head, []))
+                depth -= 1
+                expect_operand = False
+            elif token != "+":
+                raise ParseError("unexpected {!r}".format(token), text, position)
+            after_minus = token == "-"
+            name = token if kind == "name" else None
+            continue
+
+        if token == "(" and name is not None:
+            values.pop()
+            # heads are compared by identity, a name sliced out of the text isn't the interned string
+            ops.append((CALL, 0, (sys.intern(name), len(values))))
+            depth += 1
+            expect_operand = True
+        elif token in BINARY:
+            if token == "^" and unsigned is not None:
+                # -3^2 is -(3^2), the minus goes back to being an operator
+                values[-1] = literal(*unsigned, False)
+                ops.append((NEG, NEG_PRECEDENCE, None))
+            precedence = BINARY[token][0]
+            # ^ is right associative
+            while len(ops) > 0 and ops[-1][0] < CALL and (ops[-1][1] > precedence or ops[-1][1] == precedence != 5):
+                reduce(values, ops)
+            ops.append((OPERATOR, precedence, token))
+            expect_operand = True
+        elif token == "," or token == ")":
+            if not reduce_to_bracket(values, ops):
+                raise ParseError("unexpected {!r}".format(token), text, position)
+            if ops[-1][0] == GROUP:
+                if token == ",":
+                    raise ParseError("unexpected ','", text, position)
+                # the value stays a chain, so (a+b)+c extends it like a+b+c instead of copying its args
+                ops.pop()
+                depth -= 1
+            elif token == ",":
+                values.append(value(values.pop()))
+                expect_operand = True
+            else:
+                head, first = ops.pop()[2]
+                args = [value(arg) for arg in values[first:]]
+                del values[first:]
+                values.append(Expr(head, args))
+                depth -= 1
+        else:
+            raise ParseError("unexpected {!r}".format(token), text, position)
+        after_minus = False
+        name = None
+        unsigned = None
+
+    if depth > 0:
+        raise ParseError("unclosed bracket", text, len(text))
+    if expect_operand:
+        if len(ops) > 0:
+            raise ParseError("unexpected end of input", text, len(text))
+        return
+    reduce_to_bracket(values, ops)
+    yield value(values.pop())
+
+
+def parse(text: str) -> Expr:
+    exprs = list(parse_all(text))
+    if len(exprs) != 1:
+        raise ValueError("expected one expression, found {}".format(len(exprs)))
+    return exprs[0]
+
+
+def parse_file(path: str) -> Iterator[Expr]:
+    with open(path, encoding="utf-8") as file:
+        text = file.read()
+    return parse_all(text)
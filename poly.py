@@ -0,0 +1,194 @@
+from typing import Dict, List, Tuple, Union
+from fractions import Fraction
+from expr import Expr
+from atom import Atom
+from nums import Integer, Rational
+
+Coefficient = Union[int, Fraction]
+Monomial = Tuple[int, ...]
+
+
+# sparse multivariate polynomial, {exponent tuple: coefficient} over the generators in gens.
+# Coefficients are kept as python ints and Fractions (the values of Integer and Rational atoms)
+# so arithmetic doesn't allocate atoms, to_expr converts them back.
+class Poly:
+    def __init__(self, terms: Dict[Monomial, Coefficient], gens: Tuple[Expr, ...]):
+        self.terms = {monomial: normal(c) for monomial, c in terms.items() if c != 0}
+        self.gens = gens
+
+    @staticmethod
+    def constant(c: Coefficient, gens: Tuple[Expr, ...] = ()) -> 'Poly':
+        return Poly({(0,) * len(gens): c}, gens)
+
+    @staticmethod
+    def generator(gen: Expr) -> 'Poly':
+        return Poly({(1,): 1}, (gen,))
+
+    @staticmethod
+    def from_expr(expr: Expr) -> 'Poly':
+        # Plus, Mult, Neg and Power with a non negative Integer exponent are polynomial operations,
+        # any other subexpression (symbols, reals, functions, ...) becomes a generator
+        converted: Dict[Expr, Poly] = {}
+
+        stack = [expr]
+        while len(stack) > 0:
+            node = stack[-1]
+            if node in converted:
+                stack.pop()
+                continue
+
+            if polynomial_head(node):
+                pending = [arg for arg in node.args if arg not in converted]
+                if len(pending) > 0:
+                    stack.extend(pending)
+                    continue
+
+            stack.pop()
+            converted[node] = convert(node, converted)
+
+        return converted[expr]
+
+    def to_expr(self) -> Expr:
+        terms = []
+        for monomial, c in self.terms.items():
+            factors = [gen if e == 1 else Expr("Power", [gen, Integer(e)]) for gen, e in zip(self.gens, monomial) if e > 0]
+            if c != 1 or len(factors) == 0:
+                factors.insert(0, coefficient_atom(c))
+            terms.append(factors[0] if len(factors) == 1 else Expr("Mult", factors))
+
+        if len(terms) == 0:
+            return Integer(0)
+        return terms[0] if len(terms) == 1 else Expr("Plus", terms)
+
+    def unify(self, other: 'Poly') -> Tuple['Poly', 'Poly']:
+        if self.gens == other.gens:
+            return self, other
+        gens = tuple(sorted(set(self.gens) | set(other.gens), key=Expr.sort_key))
+        return self.reorder(gens), other.reorder(gens)
+
+    def reorder(self, gens: Tuple[Expr, ...]) -> 'Poly':
+        positions = [gens.index(gen) for gen in self.gens]
+        terms = {}
+        for monomial, c in self.terms.items():
+            exponents = [0] * len(gens)
+            for position, e in zip(positions, monomial):
+                exponents[position] = e
+            terms[tuple(exponents)] = c
+        return Poly(terms, gens)
+
+    def degree(self) -> int:
+        return max((sum(monomial) for monomial in self.terms), default=0)
+
+    def __add__(self, other: 'Poly') -> 'Poly':
+        a, b = self.unify(other)
+        terms = dict(a.terms)
+        for monomial, c in b.terms.items():
+            terms[monomial] = terms.get(monomial, 0) + c
+        return Poly(terms, a.gens)
+
+    def __neg__(self) -> 'Poly':
+        return Poly({monomial: -c for monomial, c in self.terms.items()}, self.gens)
+
+    def __sub__(self, other: 'Poly') -> 'Poly':
+        return self + (-other)
+
+    def __mul__(self, other: 'Poly') -> 'Poly':
+        a, b = self.unify(other)
+        if len(a.terms) == 0 or len(b.terms) == 0:
+            return Poly({}, a.gens)
+        if len(a.gens) == 0:
+            return Poly.constant(a.terms[()] * b.terms[()])
+
+        # kronecker substitution: exponents are packed into one int with enough bits per generator
+        # for the product degrees, so multiplying monomials is a single int addition
+        shifts = []
+        shift = 0
+        for i in range(len(a.gens)):
+            shifts.append(shift)
+            shift += (max(m[i] for m in a.terms) + max(m[i] for m in b.terms)).bit_length()
+
+        b_packed = [(pack(monomial, shifts), c) for monomial, c in b.terms.items()]
+        product: Dict[int, Coefficient] = {}
+        get = product.get
+        for monomial, c in a.terms.items():
+            key = pack(monomial, shifts)
+            for other_key, other_c in b_packed:
+                k = key + other_key
+                product[k] = get(k, 0) + c * other_c
+
+        bits = [shifts[i + 1] - shifts[i] for i in range(len(shifts) - 1)] + [shift - shifts[-1]]
+        return Poly({unpack(key, shifts, bits): c for key, c in product.items()}, a.gens)
+
+    def __pow__(self, n: int) -> 'Poly':
+        assert type(n) is int and n >= 0
+        result = Poly.constant(1, self.gens)
+        base = self
+        while n > 0:
+            if n & 1:
+                result = result * base
+            n >>= 1
+            if n > 0:
+                base = base * base
+        return result
+
+    def __eq__(self, other):
+        if type(other) is not Poly:
+            return False
+        a, b = self.unify(other)
+        return a.terms == b.terms
+
+    def __str__(self):
+        return str(self.to_expr())
+
+
+def normal(c: Coefficient) -> Coefficient:
+    return c.numerator if type(c) is Fraction and c.denominator == 1 else c
+
+
+def pack(monomial: Monomial, shifts: List[int]) -> int:
+    key = 0
+    for e, shift in zip(monomial, shifts):
+        key |= e << shift
+    return key
+
+
+def unpack(key: int, shifts: List[int], bits: List[int]) -> Monomial:
+    return tuple((key >> shift) & ((1 << n) - 1) for shift, n in zip(shifts, bits))
+
+
+def coefficient_atom(c: Coefficient) -> Expr:
+    if type(c) is Fraction:
+        return Rational(c.numerator, c.denominator)
+    return Integer(c)
+
+
+def polynomial_head(expr: Expr) -> bool:
+    if isinstance(expr, Atom):
+        return False
+    if expr.head in ("Plus", "Mult", "Neg"):
+        return True
+    return expr.head == "Power" and type(expr.args[1]) is Integer and expr.args[1].value >= 0
+
+
+def convert(expr: Expr, converted: Dict[Expr, Poly]) -> Poly:
+    if type(expr) is Integer:
+        return Poly.constant(expr.value)
+    if type(expr) is Rational:
+        return Poly.constant(Fraction(expr.num.value, expr.den.value))
+    if not polynomial_head(expr):
+        return Poly.generator(expr)
+
+    args = [converted[arg] for arg in expr.args]
+    if expr.head == "Neg":
+        return -args[0]
+    if expr.head == "Power":
+        return args[0] ** expr.args[1].value
+
+    result = args[0]
+    for arg in args[1:]:
+        result = result + arg if expr.head == "Plus" else result * arg
+    return result
+
+
+def expand(expr: Expr) -> Expr:
+    return Poly.from_expr(expr).to_expr()
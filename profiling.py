@@ -0,0 +1,111 @@
+from typing import Callable, Dict, List, Optional
+from expr import Expr
+
+# per rule instrumentation of rule application. apply_rule (and everything built on apply_rule_root)
+# and the GLOBAL_RULES loop of eval_expr report to PROFILER, when it is None the hooks are a single check.
+#   profiler = enable_profiling()
+#   ...
+#   print(disable_profiling().report())
+
+# called with (rule, expr, result) after every successful rewrite
+TraceCallback = Callable[[object, Expr, Expr], None]
+
+
+def count_nodes(expr: Expr) -> int:
+    # distinct nodes of the expression dag
+    seen = set()
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node not in seen:
+            seen.add(node)
+            stack.extend(node.args)
+    return len(seen)
+
+
+class RuleStats:
+    __slots__ = ('label', 'attempts', 'matches', 'match_time', 'rewrite_time', 'nodes_in', 'nodes_out')
+
+    def __init__(self, label: str):
+        self.label = label
+        self.attempts = 0
+        self.matches = 0
+        self.match_time = 0.0       # seconds spent in the matcher, successful or not
+        self.rewrite_time = 0.0     # seconds spent building and evaluating the right hand side
+        self.nodes_in = 0           # summed size of the subtrees that were rewritten
+        self.nodes_out = 0          # summed size of what they were rewritten into
+
+    def total_time(self) -> float:
+        return self.match_time + self.rewrite_time
+
+    def export(self) -> dict:
+        return {
+            "rule": self.label,
+            "attempts": self.attempts,
+            "matches": self.matches,
+            "match_time": self.match_time,
+            "rewrite_time": self.rewrite_time,
+            "nodes_in": self.nodes_in,
+            "nodes_out": self.nodes_out
+        }
+
+
+class Profiler:
+    # stats are keyed by the Rule object, or by the pattern for GLOBAL_RULES entries
+    def __init__(self, trace: Optional[TraceCallback] = None):
+        self.rules: Dict[object, RuleStats] = {}
+        self.trace = trace
+
+    def stats(self, rule: object) -> RuleStats:
+        stats = self.rules.get(rule)
+        if stats is None:
+            stats = self.rules[rule] = RuleStats(str(rule) if not isinstance(rule, Expr) else "global " + str(rule))
+        return stats
+
+    def record_attempt(self, rule: object, match_time: float):
+        stats = self.stats(rule)
+        stats.attempts += 1
+        stats.match_time += match_time
+
+    def record_rewrite(self, rule: object, expr: Expr, result: Expr, match_time: float, rewrite_time: float):
+        stats = self.stats(rule)
+        stats.attempts += 1
+        stats.matches += 1
+        stats.match_time += match_time
+        stats.rewrite_time += rewrite_time
+        stats.nodes_in += count_nodes(expr)
+        stats.nodes_out += count_nodes(result)
+        if self.trace is not None:
+            self.trace(rule, expr, result)
+
+    def reset(self):
+        self.rules.clear()
+
+    def export(self) -> List[dict]:
+        # slowest rules first
+        return [stats.export() for stats in sorted(self.rules.values(), key=RuleStats.total_time, reverse=True)]
+
+    def report(self, limit: Optional[int] = None) -> str:
+        lines = ["{:>9}{:>9}{:>14}{:>14}{:>10}{:>10}  {}".format(
+            "attempts", "matches", "match [ms]", "rewrite [ms]", "avg in", "avg out", "rule")]
+        for stats in sorted(self.rules.values(), key=RuleStats.total_time, reverse=True)[:limit]:
+            matches = max(stats.matches, 1)
+            lines.append("{:>9}{:>9}{:>14.3f}{:>14.3f}{:>10.1f}{:>10.1f}  {}".format(
+                stats.attempts, stats.matches, stats.match_time * 1e3, stats.rewrite_time * 1e3,
+                stats.nodes_in / matches, stats.nodes_out / matches, stats.label))
+        return "\n".join(lines)
+
+
+PROFILER: Optional[Profiler] = None
+
+
+def enable_profiling(trace: Optional[TraceCallback] = None) -> Profiler:
+    global PROFILER
+    PROFILER = Profiler(trace)
+    return PROFILER
+
+
+def disable_profiling() -> Optional[Profiler]:
+    global PROFILER
+    profiler, PROFILER = PROFILER, None
+    return profiler
@@ -0,0 +1,142 @@
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+from expr import Expr
+from head import Head
+from rule import Rule, apply_rule_root
+
+
+class Strategy(Enum):
+    INNERMOST = 0       # normalize args first, then rewrite the node until no rule applies
+    OUTERMOST = 1       # rewrite the node before its args, and again whenever its args changed
+    BOTTOM_UP_ONCE = 2  # single pass, at most one rule application per node
+
+
+class RuleSet:
+    # rules grouped by the head of their left hand side, counts applications against max_steps
+    def __init__(self, rules: List[Rule], max_steps: int):
+        self.rules: Dict[Head, List[Rule]] = defaultdict(list)
+        for rule in rules:
+            self.rules[rule.lhs.head].append(rule)
+        self.max_steps = max_steps
+        self.steps = 0
+
+    def apply(self, expr: Expr) -> Optional[Expr]:
+        if self.steps >= self.max_steps:
+            return None
+
+        for rule in self.rules.get(expr.head, []):
+            applied, result = apply_rule_root(expr, rule)
+            if applied and result is not expr:
+                self.steps += 1
+                return result
+        return None
+
+
+def rewrite(expr: Expr, rules: List[Rule], strategy: Strategy = Strategy.INNERMOST, max_steps: int = 10000) -> Tuple[bool, Expr]:
+    # rewrites expr with rules until a fixpoint or until max_steps rules were applied, in which case
+    # the partially rewritten expression is returned
+    rule_set = RuleSet(rules, max_steps)
+
+    if strategy is Strategy.BOTTOM_UP_ONCE:
+        result = rewrite_once(expr, rule_set)
+    else:
+        result = normalize(expr, rule_set, outermost=strategy is Strategy.OUTERMOST)
+
+    return result is not expr, result
+
+
+def rebuild(node: Expr, done: Dict[Expr, Expr]) -> Expr:
+    args = [done.get(arg, arg) for arg in node.args]
+    if all(new is old for new, old in zip(args, node.args)):
+        return node
+    return node.copy(args)
+
+
+def normalize(expr: Expr, rule_set: RuleSet, outermost: bool) -> Expr:
+    # depth first worklist over the (interned) expression dag. Normal forms are remembered per node,
+    # so after a rewrite only the new nodes of the result are visited, unchanged subtrees are looked up.
+    normal: Dict[Expr, Expr] = {}
+    rewritten: Dict[Expr, Expr] = {}    # node -> what a rule rewrote it into
+    root_tried = set()
+    cursor: Dict[Expr, int] = {}       # node on the stack -> its args before this one are done
+
+    stack = [expr]
+    active = {expr}     # the nodes on the stack, meeting one again means the rules cycle
+
+    def push(node: Expr):
+        stack.append(node)
+        active.add(node)
+
+    def finish(node: Expr, result: Expr):
+        normal[node] = result
+        normal.setdefault(result, result)
+        cursor.pop(node, None)
+        active.discard(stack.pop())
+
+    while len(stack) > 0:
+        node = stack[-1]
+
+        if node in rewritten:
+            result = rewritten[node]
+            if result in normal:
+                finish(node, normal[result])
+            elif result in active:
+                finish(node, result)
+            else:
+                push(result)
+            continue
+
+        if outermost and node not in root_tried:
+            root_tried.add(node)
+            result = rule_set.apply(node)
+            if result is not None:
+                rewritten[node] = result
+                continue
+
+        # a node on the stack isn't pushed twice, so the args done never change and the scan goes on
+        # where it stopped when the node is back on top
+        args = node.args
+        i = cursor.get(node, 0)
+        while i < len(args) and (args[i] in normal or args[i] in active):
+            i += 1
+        if i < len(args):
+            cursor[node] = i + 1
+            push(args[i])
+            continue
+
+        current = rebuild(node, normal)
+        if current is not node and current in normal:
+            finish(node, normal[current])
+            continue
+
+        result = None if outermost and current is node else rule_set.apply(current)
+        if result is None:
+            finish(node, current)
+        else:
+            rewritten[node] = result
+
+    return normal[expr]
+
+
+def rewrite_once(expr: Expr, rule_set: RuleSet) -> Expr:
+    done: Dict[Expr, Expr] = {}
+
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack[-1]
+        if node in done:
+            stack.pop()
+            continue
+
+        pending = [arg for arg in node.args if arg not in done]
+        if len(pending) > 0:
+            stack.extend(pending)
+            continue
+
+        stack.pop()
+        current = rebuild(node, done)
+        result = rule_set.apply(current)
+        done[node] = current if result is None else result
+
+    return done[expr]
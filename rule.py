@@ -1,12 +1,14 @@
-from typing import Tuple, Dict, List, Callable
-from expr import Expr
+from typing import Tuple, Dict, List, Callable, Iterator, Optional, Set
+from expr import Expr, bloom_bit
 from atom import Atom, Symbol, TRUE, atomize, is_numeric
-from head import Attribute, Head, HeadNumericEval, HeadIdentity
-from collections import defaultdict
+from head import Attribute, Head, HeadAttributes, HeadNumericEval, HeadIdentity, HeadCollect, TrackedDict, TrackedList, head_mask
+from collections import defaultdict, Counter, OrderedDict
+from time import perf_counter
+import profiling
 
 # assert rule sortedness
 # rule base is {head: [(pattern, lambda expr: return expr)]}
-GLOBAL_RULES: Dict[Head, List[Tuple[Expr, Callable[[Expr], Expr]]]] = defaultdict(list)
+GLOBAL_RULES: Dict[Head, List[Tuple[Expr, Callable[[Expr], Expr]]]] = TrackedDict()
 # GLOBAL_ASSUMPTIONS: Dict[Head, List[Expr]] = defaultdict(list)
 
 
@@ -15,12 +17,32 @@ class Rule: # todo: Change to Expr type
         self.lhs = lhs
         self.rhs = rhs
         self.conditions = conditions
+        self.matcher: Optional[Callable[[Expr], Optional[Dict[str, Expr]]]] = None
+        self.requirements: Optional[Tuple[int, int, int]] = None
+
+    def compile(self) -> Callable[[Expr], Optional[Dict[str, Expr]]]:
+        if self.matcher is None:
+            self.matcher = compile_rule(self.lhs, list(self.conditions))
+        return self.matcher
+
+    def summary(self) -> Tuple[int, int, int]:
+        if self.requirements is None:
+            self.requirements = pattern_summary(self.lhs)
+        return self.requirements
+
+    def __getstate__(self):
+        # the compiled matcher is made of closures, it is compiled again where the rule is used
+        state = self.__dict__.copy()
+        state["matcher"] = None
+        return state
 
     def __str__(self):
         return str(self.lhs) + '->' + str(self.rhs)
 
 
 class Blank(Atom):
+    __slots__ = ('text',)
+
     def __init__(self, text: str):
         super().__init__("Blank")
         assert " " not in text
@@ -29,14 +51,13 @@ class Blank(Atom):
     def __str__(self):
         return '_' + self.text
 
-    def __eq__(self, other):
-        return type(other) is type(self) and self.text == other.text
-
-    def __hash__(self):
-        return hash((self.head, self.text))
+    def intern_key(self) -> tuple:
+        return type(self), self.text
 
 
 class BlankTyped(Atom):
+    __slots__ = ('text', 'head_type')
+
     def __init__(self, text: str, head_type: Head):
         super().__init__("BlankTyped")
         assert " " not in text
@@ -46,11 +67,8 @@ class BlankTyped(Atom):
     def __str__(self):
         return '_' + self.text + '_' + str(self.head_type)
 
-    def __eq__(self, other):
-        return type(other) is type(self) and self.text == other.text and self.head_type == other.head_type
-
-    def __hash__(self):
-        return hash((self.head, self.text, self.head_type))
+    def intern_key(self) -> tuple:
+        return type(self), self.text, self.head_type
 
     # ADD TYPED BLANKS AND THEN ADD GLOBAL RULE FOR TESTING Less[_Integer, _Integer] -> lambda return _I1 < _I2
 
@@ -68,12 +86,9 @@ def check_conditions(conditions: List[Expr], blank_map: Dict[str, Expr]) -> bool
     if len(conditions) == 0:
         return True
 
+    substitutions = blank_substitutions(blank_map)
     for cond in conditions:
-        repl_cond = cond
-        for blank in blank_map:
-            if blank is "UNMATCHED":
-                continue
-            repl_cond = replace(repl_cond, Symbol(blank), blank_map[blank])[1]
+        repl_cond = substitute(cond, substitutions)[1]
         eval_cond = eval_expr(repl_cond)
         if eval_cond[1] != TRUE:
             return False
@@ -81,7 +96,40 @@ def check_conditions(conditions: List[Expr], blank_map: Dict[str, Expr]) -> bool
     return True
 
 
-def match_expr(expr: Expr, pattern: Expr, conditions: List[Expr], blank_map: Dict[str, Expr] = {}) -> Tuple[bool, dict]:
+def condition_blanks(cond: Expr) -> Set[str]:
+    names = set()
+    stack = [cond]
+    while len(stack) > 0:
+        node = stack.pop()
+        if type(node) in (Blank, BlankTyped):
+            names.add(node.text)
+        stack.extend(node.args)
+    return names
+
+
+def pattern_summary(pattern: Expr) -> Tuple[int, int, int]:
+    # (symbol bloom, head bloom, depth) every expression containing a match of pattern has, for
+    # Expr.may_contain. Blanks require nothing, a typed blank in an arg requires its head.
+    if type(pattern) in (Blank, BlankTyped):
+        return 0, 0, 0
+
+    symbol_bloom = head_bloom = 0
+    stack = [pattern]
+    while len(stack) > 0:
+        node = stack.pop()
+        if type(node) is Blank:
+            continue
+        if type(node) is BlankTyped:
+            head_bloom |= bloom_bit(node.head_type)
+            continue
+        symbol_bloom |= node.symbol_bloom
+        head_bloom |= bloom_bit(node.head)
+        stack.extend(node.args)
+    return symbol_bloom, head_bloom, pattern.depth
+
+
+def match_expr(expr: Expr, pattern: Expr, conditions: List[Expr], blank_map: Dict[str, Expr] = {}, is_arg=False) -> Tuple[bool, dict]:
+    # args left over by an ac pattern go to UNMATCHED at the top level, nested patterns match exactly
     assert isinstance(expr, Expr) and isinstance(pattern, Expr)
 
     if isinstance(pattern, Atom):
@@ -93,7 +141,7 @@ def match_expr(expr: Expr, pattern: Expr, conditions: List[Expr], blank_map: Dic
     if len(pattern.args) > len(expr.args):
         return False, blank_map
 
-    if Attribute.COMMUTATIVE not in expr.attr:
+    if not expr.attr & Attribute.COMMUTATIVE:
         expr_index = 0
         pattern_index = 0
 
@@ -106,7 +154,7 @@ def match_expr(expr: Expr, pattern: Expr, conditions: List[Expr], blank_map: Dic
             if type(pattern_arg) in (Blank, BlankTyped) and pattern_arg.text in blank_map:
                 matched_value = blank_map[pattern_arg.text]
 
-                recursive_match = match_expr(expr.args[expr_index], matched_value, conditions, blank_map)
+                recursive_match = match_expr(expr.args[expr_index], matched_value, conditions, blank_map, True)
                 if not recursive_match[0]:
                     return False, blank_map
             elif type(pattern_arg) is Blank:
@@ -117,17 +165,13 @@ def match_expr(expr: Expr, pattern: Expr, conditions: List[Expr], blank_map: Dic
                 else:
                     return False, blank_map
             else:
-                recursive_match = match_expr(expr.args[expr_index], pattern_arg, conditions, blank_map)
+                recursive_match = match_expr(expr.args[expr_index], pattern_arg, conditions, blank_map, True)
                 if not recursive_match[0]:
                     prev_pattern_arg = pattern.args[pattern_index - 1]
-                    if Attribute.ASSOCIATIVE in expr.attr and type(prev_pattern_arg) is Blank:
+                    if expr.attr & Attribute.ASSOCIATIVE and type(prev_pattern_arg) is Blank:
+                        # bound values are shared nodes, extend by building a new one (flattened on copy)
                         matched_value = blank_map[prev_pattern_arg.text]
-                        if matched_value != expr.head:
-                            match_multiple = expr.copy([matched_value, expr.args[expr_index]])
-                            blank_map[prev_pattern_arg.text] = match_multiple  # check for coherence problems
-                        else:
-                            assert matched_value.args[-1] == expr.args[expr_index - 1]
-                            matched_value.args.append(expr.args[expr_index])
+                        blank_map[prev_pattern_arg.text] = expr.copy([matched_value, expr.args[expr_index]])
                         expr_index += 1
                         continue
                     else:
@@ -136,123 +180,910 @@ def match_expr(expr: Expr, pattern: Expr, conditions: List[Expr], blank_map: Dic
             expr_index += 1
             pattern_index += 1
     else:
-        pattern_blanks = [x for x in pattern.args if type(x) in (Blank, BlankTyped)]
-        pattern_args = [x for x in pattern.args if type(x) not in (Blank, BlankTyped)]
-
-        expr_unmatched = expr.args[:]
-
-        # match every non-blank pattern arg first, then fill with blanks
-        for pattern_arg in pattern_args:
-            matched = False
-            for expr_index in range(len(expr_unmatched)):
-                matched = match_expr(expr_unmatched[expr_index], pattern_arg, conditions, blank_map)[0]
-                if matched:
-                    del expr_unmatched[expr_index]
-                    break
-            if not matched:
-                return False, blank_map
+        # first match of the ac engine that satisfies the conditions
+        for arg_map in CommutativeMatcher(pattern, conditions, is_arg)(expr, dict(blank_map)):
+            if check_conditions(conditions, arg_map):
+                blank_map.update(arg_map)
+                return True, blank_map
+        return False, blank_map
 
-        if len(expr_unmatched) == 0:
-            assert len(pattern_blanks) == 0
-            return check_conditions(conditions, blank_map), blank_map
-
-        # match and remove all non-empty blanks
-        for pb in pattern_blanks:
-            if pb.text in blank_map:
-                matched = False
-                for expr_index in range(len(expr_unmatched)):
-                    matched = match_expr(expr_unmatched[expr_index], blank_map[pb.text], conditions, blank_map)[0]
-                    if matched:
-                        del expr_unmatched[expr_index]
-                        break
-                if not matched:
-                    return False, blank_map
-            elif type(pb) is BlankTyped:
-                matched = False
-                for expr_index in range(len(expr_unmatched)):
-                    if expr_unmatched[expr_index].head == pb.head_type:
-                        blank_map[pb.text] = expr_unmatched[expr_index]
-                        del expr_unmatched[expr_index]
-                        matched = True
-                        break
-                if not matched:
-                    return False, blank_map
-        pattern_blanks = [x for x in pattern_blanks if x.text not in blank_map]
+    return check_conditions(conditions, blank_map), blank_map
 
-        if len(pattern_blanks) == 0:
-            blank_map["UNMATCHED"] = expr.copy(expr_unmatched)
-            return Attribute.ASSOCIATIVE in expr.attr, blank_map
 
-        if len(expr_unmatched) > len(pattern_blanks) and Attribute.ASSOCIATIVE not in expr.attr:
-            return False, blank_map
+# compiled patterns are closure trees. Patterns without commutative or associative parts have at
+# most one match and compile to checks that bind into a single blank map, the rest compile to
+# generators yielding every blank map under which the expression matches, backtracking into
+# sibling args when a later one fails.
+Check = Callable[[Expr, Dict[str, Expr]], bool]
+Matcher = Callable[[Expr, Dict[str, Expr]], Iterator[Dict[str, Expr]]]
 
-        for i in range(len(pattern_blanks)):
-            blank_map[pattern_blanks[i].text] = expr_unmatched[i]
-        if len(pattern_blanks) < len(expr_unmatched):
-            blank_map[pattern_blanks[-1].text] = expr.copy(expr_unmatched[len(pattern_blanks)-1:])
 
-    return check_conditions(conditions, blank_map), blank_map
+def compile_rule(lhs: Expr, conditions: List[Expr]) -> Callable[[Expr], Optional[Dict[str, Expr]]]:
+    check = compile_check(lhs)
+    if check is not None:
+        def rule_check(expr: Expr) -> Optional[Dict[str, Expr]]:
+            blank_map = {}
+            if check(expr, blank_map) and check_conditions(conditions, blank_map):
+                return blank_map
+            return None
+        return rule_check
+
+    match = compile_pattern(lhs, conditions=conditions)
+    head = lhs.head
+    min_arity = len(lhs.args)
+
+    def rule_matcher(expr: Expr) -> Optional[Dict[str, Expr]]:
+        if expr.head != head or len(expr.args) < min_arity:
+            return None
+        for blank_map in match(expr, {}):
+            if check_conditions(conditions, blank_map):
+                return blank_map
+        return None
+
+    return rule_matcher
+
+
+def compile_check(pattern: Expr, is_arg=False) -> Optional[Check]:
+    # like match_expr, blanks are only wildcards as arguments, a top level atom matches itself
+    if is_arg and type(pattern) in (Blank, BlankTyped):
+        name = pattern.text
+        head_type = pattern.head_type if type(pattern) is BlankTyped else None
+
+        def check_blank(expr: Expr, blank_map: Dict[str, Expr]) -> bool:
+            bound = blank_map.get(name)
+            if bound is not None:
+                return bound is expr
+            if head_type is not None and expr.head != head_type:
+                return False
+            blank_map[name] = expr
+            return True
+        return check_blank
+
+    if isinstance(pattern, Atom):
+        def check_atom(expr: Expr, blank_map: Dict[str, Expr]) -> bool:
+            return expr is pattern
+        return check_atom
+
+    if pattern.attr & Attribute.COMMUTATIVE or pattern.attr & Attribute.ASSOCIATIVE:
+        return None
+
+    # identity and head tests run before any binding or recursion
+    atoms, heads, steps = [], [], []
+    for i, arg in enumerate(pattern.args):
+        step = compile_check(arg, is_arg=True)
+        if step is None:
+            return None
+        if type(arg) is Blank:
+            steps.append((i, step))
+        elif type(arg) is BlankTyped:
+            heads.append((i, arg.head_type))
+            steps.append((i, step))
+        elif isinstance(arg, Atom):
+            atoms.append((i, arg))
+        else:
+            heads.append((i, arg.head))
+            steps.append((i, step))
+
+    head = pattern.head
+    min_arity = len(pattern.args)
+
+    def check_sequence(expr: Expr, blank_map: Dict[str, Expr]) -> bool:
+        args = expr.args
+        if expr.head != head or len(args) < min_arity:
+            return False
+        for i, atom in atoms:
+            if args[i] is not atom:
+                return False
+        for i, arg_head in heads:
+            if args[i].head != arg_head:
+                return False
+        for i, step in steps:
+            if not step(args[i], blank_map):
+                return False
+        return True
+
+    return check_sequence
+
+
+def compile_pattern(pattern: Expr, is_arg=False, conditions: List[Expr] = []) -> Matcher:
+    # ac matchers check the conditions as soon as their blanks are bound, the caller still checks them on the result
+    check = compile_check(pattern, is_arg)
+    if check is not None:
+        def match_checked(expr: Expr, blank_map: Dict[str, Expr]) -> Iterator[Dict[str, Expr]]:
+            arg_map = dict(blank_map)
+            if check(expr, arg_map):
+                yield arg_map
+        return match_checked
+
+    if pattern.attr & Attribute.COMMUTATIVE:
+        return compile_commutative(pattern, conditions, is_arg)
+    if pattern.attr & Attribute.ASSOCIATIVE:
+        return compile_associative(pattern)
+    return compile_sequence(pattern)
+
+
+def match_args(matchers: List[Matcher], expr_args: List[Expr], blank_map: Dict[str, Expr]) -> Iterator[Dict[str, Expr]]:
+    # matches expr_args[i] against matchers[i] for every i, backtracking with a stack of generators
+    if len(matchers) == 0:
+        yield blank_map
+        return
+
+    stack = [matchers[0](expr_args[0], blank_map)]
+    while len(stack) > 0:
+        for arg_map in stack[-1]:
+            if len(stack) == len(matchers):
+                yield arg_map
+            else:
+                stack.append(matchers[len(stack)](expr_args[len(stack)], arg_map))
+            break
+        else:
+            stack.pop()
+
+
+def compile_sequence(pattern: Expr) -> Matcher:
+    head = pattern.head
+    min_arity = len(pattern.args)
+    matchers = [compile_pattern(arg, is_arg=True) for arg in pattern.args]
+
+    def match_sequence(expr: Expr, blank_map: Dict[str, Expr]) -> Iterator[Dict[str, Expr]]:
+        if expr.head != head or len(expr.args) < min_arity:
+            return
+        yield from match_args(matchers, expr.args, blank_map)
+
+    return match_sequence
+
+
+def compile_associative(pattern: Expr) -> Matcher:
+    # an unbound blank can absorb a run of args, shortest runs are tried first
+    head = pattern.head
+    min_arity = len(pattern.args)
+    matchers = [compile_pattern(arg, is_arg=True) for arg in pattern.args]
+    absorbing = [arg.text if type(arg) is Blank else None for arg in pattern.args]
+
+    def match_from(expr: Expr, pattern_index: int, expr_index: int, blank_map: Dict[str, Expr]) -> Iterator[Dict[str, Expr]]:
+        if pattern_index == len(matchers):
+            yield blank_map
+            return
+
+        name = absorbing[pattern_index]
+        if name is None or name in blank_map:
+            for arg_map in matchers[pattern_index](expr.args[expr_index], blank_map):
+                yield from match_from(expr, pattern_index + 1, expr_index + 1, arg_map)
+            return
+
+        last_end = len(expr.args) - (len(matchers) - pattern_index - 1)
+        for end in range(expr_index + 1, last_end + 1):
+            run = expr.args[expr_index] if end == expr_index + 1 else expr.copy(expr.args[expr_index:end])
+            yield from match_from(expr, pattern_index + 1, end, {**blank_map, name: run})
+
+    def match_associative(expr: Expr, blank_map: Dict[str, Expr]) -> Iterator[Dict[str, Expr]]:
+        if expr.head != head or len(expr.args) < min_arity:
+            return
+        yield from match_from(expr, 0, 0, blank_map)
+
+    return match_associative
+
+
+def compile_commutative(pattern: Expr, conditions: List[Expr] = [], is_arg=False) -> Matcher:
+    return CommutativeMatcher(pattern, conditions, is_arg)
+
+
+class CommutativeMatcher:
+    # associative-commutative matching, yields every blank map lazily. Non blank pattern args are
+    # matched first, each against the expression args in its head (or atom) bucket, then typed
+    # blanks, then plain blanks. Under an associative head a plain blank takes a non empty
+    # sub-multiset of the remaining args (smallest first, the last free blank takes the rest)
+    # and remaining args of a top level pattern go to "UNMATCHED" when there is no free blank left to
+    # take them, a pattern nested in an arg matches all args of its expression.
+    # Args that are the same node are only tried once per pattern arg, so equal matches aren't repeated.
+    # A condition is checked as soon as all its blanks are bound, so a failing partial binding isn't extended.
+    def __init__(self, pattern: Expr, conditions: List[Expr] = [], is_arg=False):
+        self.head = pattern.head
+        self.is_arg = is_arg
+        self.min_arity = len(pattern.args)
+        self.associative = bool(pattern.attr & Attribute.ASSOCIATIVE)
+
+        fixed = [arg for arg in pattern.args if type(arg) not in (Blank, BlankTyped)]
+        self.fixed = [(index_key(arg), compile_pattern(arg, is_arg=True)) for arg in fixed]
+        self.typed = [(arg.text, arg.head_type) for arg in pattern.args if type(arg) is BlankTyped]
+        self.plain = list(Counter(arg.text for arg in pattern.args if type(arg) is Blank).items())
+        self.conditions = [(cond, condition_blanks(cond)) for cond in conditions]
+
+    def __call__(self, expr: Expr, blank_map: Dict[str, Expr]) -> Iterator[Dict[str, Expr]]:
+        if expr.head != self.head or len(expr.args) < self.min_arity:
+            return
+
+        buckets: Dict[object, List[int]] = defaultdict(list)
+        for i, arg in enumerate(expr.args):
+            buckets[arg.head].append(i)
+            if isinstance(arg, Atom):
+                buckets[arg].append(i)
+
+        used = [False] * len(expr.args)
+        yield from self.match_fixed(expr, buckets, used, 0, blank_map)
+
+    def admissible(self, before: Dict[str, Expr], after: Dict[str, Expr]) -> bool:
+        # False if a condition whose blanks got bound going from before to after doesn't hold
+        for cond, names in self.conditions:
+            if all(name in after for name in names) and not all(name in before for name in names):
+                if not check_conditions([cond], after):
+                    return False
+        return True
+
+    def match_fixed(self, expr, buckets, used, k, blank_map):
+        if k == len(self.fixed):
+            yield from self.match_typed(expr, buckets, used, 0, blank_map)
+            return
+
+        key, matcher = self.fixed[k]
+        tried = set()
+        for i in buckets.get(key, []):
+            arg = expr.args[i]
+            if used[i] or arg in tried:
+                continue
+            tried.add(arg)
+            used[i] = True
+            for arg_map in matcher(arg, blank_map):
+                if not self.conditions or self.admissible(blank_map, arg_map):
+                    yield from self.match_fixed(expr, buckets, used, k + 1, arg_map)
+            used[i] = False
+
+    def match_typed(self, expr, buckets, used, k, blank_map):
+        if k == len(self.typed):
+            unused = [i for i in range(len(expr.args)) if not used[i]]
+            # bound blanks only remove copies of their value, do them first so free ones see what's left
+            plain = sorted(self.plain, key=lambda blank: blank[0] not in blank_map)
+            free = any(name not in blank_map for name, _ in plain)
+            yield from self.match_plain(expr, plain, free, 0, unused, blank_map)
+            return
+
+        name, head_type = self.typed[k]
+        bound = blank_map.get(name)
+        tried = set()
+        for i in buckets.get(head_type, []):
+            arg = expr.args[i]
+            if used[i] or arg in tried or (bound is not None and arg is not bound):
+                continue
+            tried.add(arg)
+            if bound is not None:
+                arg_map = blank_map
+            else:
+                arg_map = {**blank_map, name: arg}
+                if self.conditions and not self.admissible(blank_map, arg_map):
+                    continue
+            used[i] = True
+            yield from self.match_typed(expr, buckets, used, k + 1, arg_map)
+            used[i] = False
+
+    def match_plain(self, expr, plain, free, k, unused, blank_map):
+        if k == len(plain):
+            if len(unused) == 0:
+                yield blank_map
+            elif self.associative and not free and not self.is_arg:
+                yield {**blank_map, "UNMATCHED": expr.copy([expr.args[i] for i in unused])}
+            return
+
+        name, count = plain[k]
+        bound = blank_map.get(name)
+        if bound is not None:
+            parts = bound.args if self.associative and bound.head == self.head else [bound]
+            rest = take(expr.args, unused, parts * count)
+            if rest is not None:
+                yield from self.match_plain(expr, plain, free, k + 1, rest, blank_map)
+            return
+
+        groups: Dict[Expr, List[int]] = {}
+        for i in unused:
+            groups.setdefault(expr.args[i], []).append(i)
+
+        if not self.associative:
+            for arg, indices in groups.items():
+                arg_map = {**blank_map, name: arg}
+                if len(indices) >= count and (not self.conditions or self.admissible(blank_map, arg_map)):
+                    yield from self.match_plain(expr, plain, free, k + 1, take(expr.args, unused, [arg] * count), arg_map)
+            return
+
+        if k == len(plain) - 1:
+            # the last free blank takes everything that is left, split evenly between its occurrences
+            if len(unused) == 0 or any(len(indices) % count != 0 for indices in groups.values()):
+                return
+            parts = [arg for arg, indices in groups.items() for _ in range(len(indices) // count)]
+            value = parts[0] if len(parts) == 1 else expr.copy(parts)
+            arg_map = {**blank_map, name: value}
+            if not self.conditions or self.admissible(blank_map, arg_map):
+                yield from self.match_plain(expr, plain, free, k + 1, [], arg_map)
+            return
+
+        # a blank occurring count times takes count copies of every arg of its value, args with fewer
+        # copies left can't be part of it. At least one arg is left for every following free blank.
+        capacities = [(arg, len(indices) // count) for arg, indices in groups.items() if len(indices) >= count]
+        largest = min((len(unused) - (len(plain) - k - 1)) // count, sum(n for _, n in capacities))
+        for size in range(1, largest + 1):
+            for parts in sub_multisets(capacities, size):
+                value = parts[0] if len(parts) == 1 else expr.copy(parts)
+                arg_map = {**blank_map, name: value}
+                # the rest is only worked out for a binding the conditions allow
+                if not self.conditions or self.admissible(blank_map, arg_map):
+                    yield from self.match_plain(expr, plain, free, k + 1, take(expr.args, unused, parts * count), arg_map)
+
+
+def take(args: List[Expr], unused: List[int], parts: List[Expr]) -> Optional[List[int]]:
+    # removes one unused index per part (matched by identity), None if some part isn't there
+    needed = Counter(parts)
+    rest = []
+    for i in unused:
+        if needed[args[i]] > 0:
+            needed[args[i]] -= 1
+        else:
+            rest.append(i)
+    if len(unused) - len(rest) != len(parts):
+        return None
+    return rest
+
+
+def sub_multisets(groups: List[Tuple[Expr, int]], size: int) -> Iterator[List[Expr]]:
+    # multisets of size args taking at most n copies of every (arg, n) group. Iterative, the first
+    # group takes as many as it can first, then the next one, ...
+    after = [0] * (len(groups) + 1)
+    for i in range(len(groups) - 1, -1, -1):
+        after[i] = after[i + 1] + groups[i][1]
+    if after[0] < size:
+        return
+
+    counts = [0] * len(groups)
+    start, left = 0, size
+    while True:
+        # the groups from start on take what is left greedily
+        for j in range(start, len(groups)):
+            counts[j] = min(groups[j][1], left)
+            left -= counts[j]
+        yield [arg for (arg, _), n in zip(groups, counts) if n > 0 for _ in range(n)]
+
+        # the last group that can pass one copy on to the groups after it gives it up
+        tail = 0
+        for j in range(len(groups) - 1, -1, -1):
+            if counts[j] > 0 and after[j + 1] > tail:
+                counts[j] -= 1
+                start, left = j + 1, tail + 1
+                break
+            tail += counts[j]
+        else:
+            return
+
+
+def match_all(expr: Expr, pattern: Expr, conditions: List[Expr] = []) -> Iterator[Dict[str, Expr]]:
+    # every blank map under which expr matches pattern and the conditions hold, lazily
+    for blank_map in compile_pattern(pattern)(expr, {}):
+        if check_conditions(conditions, blank_map):
+            yield blank_map
 
 
 def replace(expr: Expr, to_replace: Expr, replace_with: Expr) -> Tuple[bool, Expr]:
-    if expr == to_replace:
-        return True, replace_with
+    return substitute(expr, {to_replace: replace_with})
 
-    replace_args = [replace(arg, to_replace, replace_with) for arg in expr.args]
-    modified = any(x[0] for x in replace_args)
 
-    new_expr = expr if not modified else expr.copy(list(x[1] for x in replace_args))
-    if new_expr == to_replace:
-        return True, replace_with
+def substitute(expr: Expr, substitutions: Dict[Expr, Expr]) -> Tuple[bool, Expr]:
+    # replaces all keys at once in a single traversal, a rebuilt node that equals a key is replaced
+    # as well. Nodes are interned, so shared subtrees are only visited once, and subtrees whose
+    # summary rules out every key are not entered.
+    visited: Dict[Expr, Expr] = {}
+    summaries = [(key.symbol_bloom, key.head_bloom, key.depth) for key in substitutions]
 
-    return modified, new_expr
+    # a None on the stack marks that the args of the node below it are done
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node is None:
+            node = stack.pop()
+            args = [visited[arg] for arg in node.args]
+            result = node
+            if any(new is not old for new, old in zip(args, node.args)):
+                result = node.copy(args)
+                result = substitutions.get(result, result)
+            visited[node] = result
+            continue
 
+        if node in visited:
+            continue
+        result = substitutions.get(node)
+        if result is not None or not any(node.may_contain(*summary) for summary in summaries):
+            visited[node] = node if result is None else result
+            continue
+        stack.append(node)
+        stack.append(None)
+        stack.extend(node.args)
 
-def apply_rule(expr: Expr, rule: Rule) -> Tuple[bool, Expr]:
-    match = match_expr(expr, rule.lhs, list(*rule.conditions), blank_map={})
-    if match[0]:
-        rhs = rule.rhs
-        for s in match[1]:
-            rhs = replace(rhs, Symbol(s), match[1][s])[1]
-        if "UNMATCHED" in match[1]:
-            unmatched = match[1]["UNMATCHED"]
-            assert unmatched.head is expr.head
-            rhs = expr.copy(match[1]["UNMATCHED"].args + [rhs])
-        return True, eval_expr(rhs)[1]
-
-    if isinstance(expr, Atom):
+    result = visited[expr]
+    return result is not expr, result
+
+
+def blank_substitutions(blank_map: Dict[str, Expr]) -> Dict[Expr, Expr]:
+    # rule right hand sides and conditions refer to blanks by symbols of the same name
+    return {Symbol(blank): value for blank, value in blank_map.items() if blank != "UNMATCHED"}
+
+
+def apply_rule_root(expr: Expr, rule: Rule) -> Tuple[bool, Expr]:
+    profiler = profiling.PROFILER
+    if profiler is not None:
+        start = perf_counter()
+
+    blank_map = rule.compile()(expr)
+    if blank_map is None:
+        if profiler is not None:
+            profiler.record_attempt(rule, perf_counter() - start)
         return False, expr
 
-    apply_to_args = [apply_rule(arg, rule) for arg in expr.args]
-    modified = any(x[0] for x in apply_to_args)
+    if profiler is not None:
+        matched = perf_counter()
 
-    if modified:
-        return True, eval_expr(expr.copy(list(x[1] for x in apply_to_args)))[1]
-    return False, expr
+    rhs = substitute(rule.rhs, blank_substitutions(blank_map))[1]
+    if "UNMATCHED" in blank_map:
+        unmatched = blank_map["UNMATCHED"]
+        assert unmatched.head is expr.head
+        rhs = expr.copy([*unmatched.args, rhs])
+    result = eval_expr(rhs)[1]
+
+    if profiler is not None:
+        profiler.record_rewrite(rule, expr, result, matched - start, perf_counter() - matched)
+    return True, result
+
+
+def apply_rule(expr: Expr, rule: Rule) -> Tuple[bool, Expr]:
+    # the rule is applied at the outermost positions it matches. A node is tried before its args,
+    # which are only visited if it doesn't match, and rebuilt after them.
+    # a None on the stack marks that the args of the node below it are done
+    results: Dict[Expr, Tuple[bool, Expr]] = {}
+    summary = rule.summary()
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node is None:
+            node = stack.pop()
+            apply_to_args = [results[arg] for arg in node.args]
+            if any(x[0] for x in apply_to_args):
+                results[node] = True, eval_expr(node.copy(list(x[1] for x in apply_to_args)))[1]
+            else:
+                results[node] = False, node
+            continue
+
+        if node in results:
+            continue
+        if not node.may_contain(*summary):
+            results[node] = False, node
+            continue
+        applied, result = apply_rule_root(node, rule)
+        if applied or isinstance(node, Atom):
+            results[node] = applied, result
+            continue
+        stack.append(node)
+        stack.append(None)
+        stack.extend(node.args)
+
+    return results[expr]
+
+
+class IndexNode:
+    def __init__(self):
+        self.children: Dict[object, IndexNode] = {}
+        self.rules: List[Tuple[int, int]] = []  # (rule position, min arity)
+
+
+def index_key(pattern_arg: Expr):
+    # None is the wildcard, heads and atoms are looked up by the head and the atom itself
+    if type(pattern_arg) is Blank:
+        return None
+    if type(pattern_arg) is BlankTyped:
+        return pattern_arg.head_type
+    if isinstance(pattern_arg, Atom):
+        return pattern_arg
+    return pattern_arg.head
+
+
+class RuleIndex:
+    # discrimination net over the patterns in GLOBAL_RULES[head], built from the attributes the head
+    # had when indexing. Non commutative patterns go into a trie over argument positions, commutative
+    # ones are filtered by the heads and atoms their arguments need. Lookups only narrow the rule list,
+    # every candidate still goes through its compiled pattern.
+    def __init__(self, head: Head, rules: TrackedList):
+        self.rules = rules
+        self.version = rules.version
+        self.attr = head_mask(head)
+
+        self.matchers = [compile_rule(pattern, []) for pattern, _ in rules]
+        self.atoms: Dict[Expr, List[int]] = defaultdict(list)
+        self.trie = IndexNode()
+        self.anchored: Dict[object, List[int]] = defaultdict(list)
+        self.required: Dict[int, Tuple[int, Counter]] = {}
+
+        self.lookups = 0
+        self.candidates = 0
+        self.pruned = 0
+        self.last_pruned = 0
+
+        for i, (pattern, _) in enumerate(rules):
+            if pattern.head != head:
+                continue
+            if isinstance(pattern, Atom):
+                self.atoms[pattern].append(i)
+            elif self.attr & Attribute.COMMUTATIVE:
+                required = Counter(index_key(arg) for arg in pattern.args)
+                del required[None]
+                self.required[i] = (len(pattern.args), required)
+                self.anchored[next(iter(required), None)].append(i)
+            else:
+                # associative args can be absorbed by a blank, so positions after the first one aren't fixed
+                signature = pattern.args
+                if self.attr & Attribute.ASSOCIATIVE:
+                    blanks = [j for j in range(len(signature)) if type(signature[j]) is Blank]
+                    if len(blanks) > 0:
+                        signature = signature[:blanks[0] + 1]
+
+                node = self.trie
+                for arg in signature:
+                    node = node.children.setdefault(index_key(arg), IndexNode())
+                node.rules.append((i, len(pattern.args)))
+
+    def lookup(self, expr: Expr) -> List[Tuple[Expr, Callable[[Expr], Optional[Dict[str, Expr]]], Callable[[Expr], Expr]]]:
+        if expr.attr != self.attr:
+            found = list(range(len(self.rules)))
+        else:
+            found = list(self.atoms.get(expr, []))
+            if self.attr & Attribute.COMMUTATIVE:
+                self.lookup_commutative(expr, found)
+            else:
+                self.lookup_positional(expr, found)
+            found.sort()
+
+        self.lookups += 1
+        self.candidates += len(found)
+        self.last_pruned = len(self.rules) - len(found)
+        self.pruned += self.last_pruned
+
+        return [(self.rules[i][0], self.matchers[i], self.rules[i][1]) for i in found]
+
+    def lookup_commutative(self, expr: Expr, found: List[int]):
+        counts = Counter()
+        for arg in expr.args:
+            counts[arg.head] += 1
+            if isinstance(arg, Atom):
+                counts[arg] += 1
+
+        for key in [*counts, None]:
+            for i in self.anchored.get(key, []):
+                min_arity, required = self.required[i]
+                if min_arity <= len(expr.args) and all(counts[k] >= n for k, n in required.items()):
+                    found.append(i)
+
+    def lookup_positional(self, expr: Expr, found: List[int]):
+        level = [self.trie]
+        depth = 0
+        while len(level) > 0:
+            next_level = []
+            for node in level:
+                found.extend(i for i, min_arity in node.rules if min_arity <= len(expr.args))
+                if depth < len(expr.args) and len(node.children) > 0:
+                    arg = expr.args[depth]
+                    keys = (None, arg.head, arg) if isinstance(arg, Atom) else (None, arg.head)
+                    next_level.extend(node.children[key] for key in keys if key in node.children)
+            level = next_level
+            depth += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "rules": len(self.rules),
+            "lookups": self.lookups,
+            "candidates": self.candidates,
+            "pruned": self.pruned,
+            "pruned_per_lookup": self.pruned / self.lookups if self.lookups > 0 else 0.0
+        }
+
+
+RULE_INDEX: Dict[Head, RuleIndex] = {}
+
+
+def rule_candidates(expr: Expr) -> List[Tuple[Expr, Callable[[Expr], Optional[Dict[str, Expr]]], Callable[[Expr], Expr]]]:
+    # (pattern, compiled pattern, transform) of the GLOBAL_RULES entries that can match expr
+    rules = GLOBAL_RULES.get(expr.head)
+    if not rules:
+        RULE_INDEX.pop(expr.head, None)
+        return []
+
+    index = RULE_INDEX.get(expr.head)
+    if index is None or index.rules is not rules or index.version != rules.version:
+        index = RULE_INDEX[expr.head] = RuleIndex(expr.head, rules)
+
+    return index.lookup(expr)
+
+
+def rule_index_stats() -> Dict[Head, Dict[str, float]]:
+    return {head: index.stats() for head, index in RULE_INDEX.items()}
+
+
+class EvalCache:
+    # size bounded LRU of eval_expr results keyed on the (interned) expression, disabled while
+    # maxsize is 0. Entries are dropped as soon as GLOBAL_RULES or HeadAttributes change.
+    def __init__(self, maxsize: int = 0):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[Expr, Tuple[bool, Expr]] = OrderedDict()
+        self.versions = (GLOBAL_RULES.version, HeadAttributes.version)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def resize(self, maxsize: int):
+        self.maxsize = maxsize
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def valid(self) -> bool:
+        versions = (GLOBAL_RULES.version, HeadAttributes.version)
+        if versions != self.versions:
+            self.entries.clear()
+            self.versions = versions
+            self.invalidations += 1
+            return False
+        return True
 
+    def get(self, expr: Expr) -> Optional[Tuple[bool, Expr]]:
+        if not self.valid():
+            self.misses += 1
+            return None
 
-def eval_expr(expr: Expr) -> Tuple[bool, Expr]:
-    if Attribute.UNEVALUATED in expr.attr:
+        result = self.entries.get(expr)
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(expr)
+        self.hits += 1
+        return result
+
+    def put(self, expr: Expr, result: Tuple[bool, Expr]):
+        # the rules changed while evaluating, the result may already be stale
+        if not self.valid():
+            return
+
+        self.entries[expr] = result
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+EVAL_CACHE = EvalCache()
+
+
+def eval_expr(expr: Expr, visited: Dict[Expr, Tuple[bool, Expr]] = None) -> Tuple[bool, Expr]:
+    # visited holds the results of this call, a subterm shared by several parents is evaluated once.
+    # Args are evaluated before their node with an explicit stack, deep expressions don't recurse.
+    if visited is None:
+        visited = {}
+
+    result = visited.get(expr)
+    if result is not None:
+        return result
+
+    # a None on the stack marks that the args of the node below it are evaluated
+    cached = EVAL_CACHE.maxsize > 0
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node is None:
+            node = stack.pop()
+        elif node in visited:
+            continue
+        else:
+            result = EVAL_CACHE.get(node) if cached else None
+            if result is not None:
+                visited[node] = result
+                continue
+            if len(node.args) > 0 and not node.attr & Attribute.UNEVALUATED:
+                stack.append(node)
+                stack.append(None)
+                stack.extend(node.args)
+                continue
+
+        result = eval_uncached(node, visited)
+        if cached:
+            EVAL_CACHE.put(node, result)
+        visited[node] = result
+
+    return visited[expr]
+
+
+PARTIAL_FOLD = Attribute.NUMERIC | Attribute.COMMUTATIVE | Attribute.ASSOCIATIVE
+
+
+def split_term(term: Expr, inner: Head) -> Tuple[Expr, Expr]:
+    # (base, numeric part) of a term, the numeric part of anything else is 1. A term of Plus
+    # under Neg is read as a Mult with -1, -(2*x) -> x, -2
+    negative = False
+    while inner == "Mult" and term.head == "Neg":
+        negative = not negative
+        term = term.args[0]
+    base, coefficient = split_numeric(term, inner)
+    return base, atomize(HeadNumericEval["Neg"]([coefficient])) if negative else coefficient
+
+
+def split_numeric(term: Expr, inner: Head) -> Tuple[Expr, Expr]:
+    from nums import Integer
+
+    if term.head != inner or isinstance(term, Atom):
+        return term, Integer(1)
+
+    if term.attr & Attribute.COMMUTATIVE:
+        numbers = [arg for arg in term.args if is_numeric(arg)]
+        if len(numbers) != 1:
+            return term, Integer(1)
+        rest = [arg for arg in term.args if not is_numeric(arg)]
+        return rest[0] if len(rest) == 1 else term.copy(rest), numbers[0]
+
+    if len(term.args) < 2 or not is_numeric(term.args[-1]):
+        return term, Integer(1)
+    return term.args[0] if len(term.args) == 2 else term.copy(term.args[:-1]), term.args[-1]
+
+
+def has_like_terms(expr: Expr, inner: Head) -> bool:
+    # False if no two args of expr have the same base. Most nodes have none, so bases are compared
+    # without building them: a base that would be a new node is keyed by its args, the args of a
+    # commutative inner node follow its numbers as they are sorted first.
+    commutative = head_mask(inner) & Attribute.COMMUTATIVE
+    seen = set()
+    for arg in expr.args:
+        while inner == "Mult" and arg.head == "Neg":
+            arg = arg.args[0]
+        if is_numeric(arg):
+            continue
+        if arg.head != inner or isinstance(arg, Atom):
+            key = arg
+        elif not commutative:
+            key = arg.args[0] if len(arg.args) == 2 and is_numeric(arg.args[1]) else split_numeric(arg, inner)[0]
+        elif is_numeric(arg.args[0]) and not is_numeric(arg.args[1]):
+            key = arg.args[1] if len(arg.args) == 2 else arg.args[1:]
+        else:
+            key = arg.args
+        if key in seen:
+            return True
+        seen.add(key)
+    return False
+
+
+def collect_terms(expr: Expr) -> Expr:
+    # groups the args of a HeadCollect head by base in one pass and adds up their numeric parts,
+    # x + 2*x -> 3*x, x - x -> 0 and x*x^2 -> x^3. Numbers themselves are left alone.
+    from nums import to_number
+
+    inner = HeadCollect[expr.head]
+    if not has_like_terms(expr, inner):
+        return expr
+
+    numbers = []
+    terms: Dict[Expr, List[Expr]] = {}
+    for arg in expr.args:
+        if is_numeric(arg):
+            numbers.append(arg)
+        else:
+            base, coefficient = split_term(arg, inner)
+            terms.setdefault(base, []).append(coefficient)
+
+    if len(numbers) + len(terms) == len(expr.args):
+        return expr
+
+    args = numbers
+    for base, coefficients in terms.items():
+        coefficient = atomize(HeadNumericEval["Plus"](coefficients)) if len(coefficients) > 1 else coefficients[0]
+        value = to_number(coefficient)
+        if value == 0:
+            continue
+        if value == 1:
+            args.append(base)
+        elif value == -1 and inner == "Mult":
+            args.append(Expr("Neg", [base]))
+        elif head_mask(inner) & Attribute.COMMUTATIVE:
+            args.append(Expr(inner, [coefficient, base]))
+        else:
+            args.append(Expr(inner, [base, coefficient]))
+
+    return args[0] if len(args) == 1 else expr.copy(args)
+
+
+def fold_numbers(expr: Expr) -> Expr:
+    # Plus(2, x, 3, y) -> Plus(5, x, y), the args of a commutative node are sorted with the numbers
+    # first. A number equal to the identity of the head is dropped, a single remaining arg replaces the node.
+    count = 0
+    while count < len(expr.args) and is_numeric(expr.args[count]):
+        count += 1
+    if count == 0:
+        return expr
+
+    folded = HeadNumericEval[expr.head](expr.args[:count]) if count > 1 else expr.args[0]
+    if folded is None:
+        return expr
+    folded = atomize(folded)
+
+    args = list(expr.args[count:])
+    if not (expr.attr & Attribute.HAS_IDENTITY and folded is atomize(HeadIdentity[expr.head])):
+        if count == 1:
+            return expr
+        args.insert(0, folded)
+    return args[0] if len(args) == 1 else expr.copy(args)
+
+
+def eval_uncached(expr: Expr, visited: Dict[Expr, Tuple[bool, Expr]]) -> Tuple[bool, Expr]:
+    if expr.attr & Attribute.UNEVALUATED:
         return False, expr
 
-    eval_args = [eval_expr(arg) for arg in expr.args]
+    # the args are in visited, eval_expr evaluates them first
+    eval_args = [visited[arg] for arg in expr.args]
     modified = any(x[0] for x in eval_args)
 
     if modified:
-        expr = expr.copy(eval_args)
+        expr = expr.copy([x[1] for x in eval_args])
+
+    if expr.attr & Attribute.NUMERIC and all(is_numeric(arg) for arg in expr.args):
+        folded = HeadNumericEval[expr.head](expr.args)
+        if folded is not None:
+            modified = True
+            expr = atomize(folded)
+    elif expr.attr & PARTIAL_FOLD == PARTIAL_FOLD:
+        folded = fold_numbers(expr)
+        if folded is not expr:
+            modified = True
+            expr = folded
 
-    if Attribute.NUMERIC in expr.attr and all(is_numeric(arg) for arg in expr.args):
-        expr = atomize(HeadNumericEval[expr.head](expr.args))
+    if expr.head in HeadCollect and expr.attr & Attribute.COMMUTATIVE:
+        collected = collect_terms(expr)
+        if collected is not expr:
+            modified = True
+            expr = collected
+
+    # rewrite with the first matching global rule until none applies, a rule returning
+    # the expression unchanged counts as not applying
+    rewritten = True
+    while rewritten:
+        rewritten = False
+        for pattern, match, transform in rule_candidates(expr):
+            profiler = profiling.PROFILER
+            if profiler is not None:
+                start = perf_counter()
+
+            if match(expr) is None:   # todo: add conditional rules
+                if profiler is not None:
+                    profiler.record_attempt(pattern, perf_counter() - start)
+                continue
+
+            if profiler is not None:
+                matched = perf_counter()
+            result = transform(expr)
+            if profiler is not None:
+                if result is expr:
+                    profiler.record_attempt(pattern, perf_counter() - start)
+                else:
+                    profiler.record_rewrite(pattern, expr, result, matched - start, perf_counter() - matched)
 
-    while len(GLOBAL_RULES[expr.head]) > 0:
-        for rule in GLOBAL_RULES[expr.head]:
-            pattern_match = match_expr(expr, rule[0], [], {})   # todo: add conditional rules
-            if pattern_match[0]:
-                modified = True
-                expr = rule[1](expr)
+            if result is not expr:
+                modified = rewritten = True
+                expr = result
                 break
 
-    if len(expr.args) == 0 and Attribute.HAS_IDENTITY in expr.attr:
-        return True, HeadIdentity[expr.head]
+    if len(expr.args) == 0 and expr.attr & Attribute.HAS_IDENTITY:
+        return True, atomize(HeadIdentity[expr.head])
 
     return modified, expr
@@ -0,0 +1,247 @@
+import mmap
+import struct
+import sys
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Union
+from expr import Expr
+from atom import Atom, String, Symbol, Boolean, TRUE, FALSE, atomize
+from head import head_mask
+from nums import Integer, Rational, Real, Complex
+from rule import Blank, BlankTyped
+
+# compact binary encoding of expressions. A file is the magic followed by records, each a tag byte
+# and varint fields. Strings (heads, symbol names, ...) are written once and referred to by index,
+# nodes are written in post order and every node gets the next index, so a parent refers to its
+# args by index and a subtree shared anywhere in the file is written once. A ROOT record yields the
+# node it refers to, so a corpus of expressions is decoded one expression at a time.
+#   with open(path, "wb") as file:
+#       dump(exprs, file)
+#   for expr in load_file(path):     # memory mapped
+#       ...
+
+MAGIC = b"EXB1"
+
+TAG_STRING = 0          # length, utf-8 bytes
+TAG_ROOT = 1            # node
+TAG_EXPR = 2            # head string, extra attribute bits, arg count, arg nodes
+TAG_INTEGER = 3         # zigzag value
+TAG_RATIONAL = 4        # zigzag numerator, denominator
+TAG_REAL = 5            # little endian double
+TAG_COMPLEX = 6         # real node, imaginary node
+TAG_SYMBOL = 7          # name string
+TAG_STRING_ATOM = 8     # text string
+TAG_TRUE = 9
+TAG_FALSE = 10
+TAG_BLANK = 11          # name string
+TAG_BLANK_TYPED = 12    # name string, head string
+
+DOUBLE = struct.Struct("<d")
+FLUSH_SIZE = 1 << 16
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+def zigzag(n: int) -> int:
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def unzigzag(n: int) -> int:
+    return n >> 1 if n & 1 == 0 else -((n + 1) >> 1)
+
+
+def varint(n: int, out: bytearray):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+class Encoder:
+    # strings and nodes written by one encoder are shared by all expressions written after them.
+    # Output is buffered, flush writes what is left.
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.strings: Dict[str, int] = {}
+        self.nodes: Dict[Expr, int] = {}
+        self.out = bytearray(MAGIC)
+
+    def string(self, text: str) -> int:
+        index = self.strings.get(text)
+        if index is None:
+            data = text.encode("utf-8")
+            self.out.append(TAG_STRING)
+            varint(len(data), self.out)
+            self.out += data
+            index = self.strings[text] = len(self.strings)
+        return index
+
+    def write(self, expr: Expr):
+        # post order without recursion, a node is written once all its args have an index
+        stack = [expr]
+        while len(stack) > 0:
+            node = stack[-1]
+            if node in self.nodes:
+                stack.pop()
+                continue
+            children = atom_children(node) if isinstance(node, Atom) else node.args
+            pending = [arg for arg in children if arg not in self.nodes]
+            if len(pending) > 0:
+                stack.extend(reversed(pending))
+                continue
+            stack.pop()
+            self.node(node)
+
+        self.out.append(TAG_ROOT)
+        varint(self.nodes[expr], self.out)
+        if len(self.out) >= FLUSH_SIZE:
+            self.flush()
+
+    def node(self, node: Expr):
+        kind = type(node)
+        if kind is Integer:
+            self.out.append(TAG_INTEGER)
+            varint(zigzag(node.value), self.out)
+        elif kind is Rational:
+            self.out.append(TAG_RATIONAL)
+            varint(zigzag(node.num.value), self.out)
+            varint(node.den.value, self.out)
+        elif kind is Real:
+            self.out.append(TAG_REAL)
+            self.out += DOUBLE.pack(node.value)
+        elif kind is Complex:
+            self.out.append(TAG_COMPLEX)
+            for part in atom_children(node):
+                varint(self.nodes[part], self.out)
+        elif kind is Symbol or kind is String or kind is Blank:
+            text = self.string(node.text)
+            self.out.append(TAG_SYMBOL if kind is Symbol else TAG_STRING_ATOM if kind is String else TAG_BLANK)
+            varint(text, self.out)
+        elif kind is BlankTyped:
+            text, head_type = self.string(node.text), self.string(node.head_type)
+            self.out.append(TAG_BLANK_TYPED)
+            varint(text, self.out)
+            varint(head_type, self.out)
+        elif kind is Boolean:
+            self.out.append(TAG_TRUE if node.value else TAG_FALSE)
+        elif kind is Expr:
+            # only attributes the node has beyond its head's are stored, the head's are looked up when decoding
+            head = self.string(node.head)
+            self.out.append(TAG_EXPR)
+            varint(head, self.out)
+            varint(node.attr & ~head_mask(node.head), self.out)
+            varint(len(node.args), self.out)
+            for arg in node.args:
+                varint(self.nodes[arg], self.out)
+        else:
+            raise TypeError("can't serialize {}".format(kind.__name__))
+        self.nodes[node] = len(self.nodes)
+
+    def flush(self):
+        self.stream.write(self.out)
+        self.out = bytearray()
+
+
+def atom_children(atom: Atom) -> List[Expr]:
+    # Complex is the only atom made of other atoms
+    if type(atom) is Complex:
+        return [atomize(atom.real), atomize(atom.imag)]
+    return []
+
+
+class Decoder:
+    # decodes records on demand from anything supporting the buffer protocol, a memory mapped file
+    # is read in place
+    def __init__(self, data: Buffer):
+        self.data = memoryview(data).cast("B")
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not an expression file")
+        self.position = len(MAGIC)
+        self.strings: List[str] = []
+        self.nodes: List[Expr] = []
+
+    def varint(self) -> int:
+        data = self.data
+        result = shift = 0
+        while True:
+            byte = data[self.position]
+            self.position += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def __iter__(self) -> Iterator[Expr]:
+        data = self.data
+        nodes = self.nodes
+        strings = self.strings
+        end = len(data)
+        while self.position < end:
+            tag = data[self.position]
+            self.position += 1
+
+            if tag == TAG_ROOT:
+                yield nodes[self.varint()]
+            elif tag == TAG_STRING:
+                length = self.varint()
+                # heads are compared by identity, so decoded strings are interned
+                strings.append(sys.intern(str(data[self.position:self.position + length], "utf-8")))
+                self.position += length
+            elif tag == TAG_EXPR:
+                head = strings[self.varint()]
+                attr = self.varint()
+                args = [nodes[self.varint()] for _ in range(self.varint())]
+                nodes.append(Expr(head, args, attr))
+            elif tag == TAG_INTEGER:
+                nodes.append(Integer(unzigzag(self.varint())))
+            elif tag == TAG_SYMBOL:
+                nodes.append(Symbol(strings[self.varint()]))
+            elif tag == TAG_RATIONAL:
+                num = unzigzag(self.varint())
+                nodes.append(Rational(num, self.varint()))
+            elif tag == TAG_REAL:
+                nodes.append(Real(DOUBLE.unpack_from(data, self.position)[0]))
+                self.position += DOUBLE.size
+            elif tag == TAG_COMPLEX:
+                real = nodes[self.varint()]
+                nodes.append(Complex(real, nodes[self.varint()]))
+            elif tag == TAG_STRING_ATOM:
+                nodes.append(String(strings[self.varint()]))
+            elif tag == TAG_TRUE:
+                nodes.append(TRUE)
+            elif tag == TAG_FALSE:
+                nodes.append(FALSE)
+            elif tag == TAG_BLANK:
+                nodes.append(Blank(strings[self.varint()]))
+            elif tag == TAG_BLANK_TYPED:
+                text = strings[self.varint()]
+                nodes.append(BlankTyped(text, strings[self.varint()]))
+            else:
+                raise ValueError("unknown record {} at byte {}".format(tag, self.position - 1))
+
+
+def dump(exprs: Iterable[Expr], stream: BinaryIO):
+    encoder = Encoder(stream)
+    for expr in exprs:
+        encoder.write(expr)
+    encoder.flush()
+
+
+def dumps(exprs: Iterable[Expr]) -> bytes:
+    stream = BytesIO()
+    dump(exprs, stream)
+    return stream.getvalue()
+
+
+def loads(data: Buffer) -> List[Expr]:
+    return list(Decoder(data))
+
+
+def load_file(path: str) -> Iterator[Expr]:
+    # expressions of the file one by one, the file is memory mapped and closed once exhausted
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            decoder = Decoder(mapped)
+            try:
+                yield from decoder
+            finally:
+                decoder.data.release()
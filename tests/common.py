@@ -0,0 +1,47 @@
+from fractions import Fraction
+from random import Random
+from typing import Dict
+from expr import Expr
+from atom import symbols
+from nums import Integer, Rational, from_number
+from rule import eval_expr, substitute
+
+# expression generators and helpers shared by the tests. Every test uses a fixed seed.
+
+a, b, c, _x, _y, _z = symbols("a b c _x _y _z")
+SYMBOLS = [a, b, c]
+VALUES = {a: Integer(2), b: Integer(-3), c: Rational(1, 2)}
+
+
+def random_expr(rng: Random, depth: int) -> Expr:
+    if depth == 0 or rng.random() < 0.2:
+        kind = rng.randrange(3)
+        if kind == 0:
+            return rng.choice(SYMBOLS)
+        if kind == 1:
+            return Integer(rng.randint(-5, 5))
+        return from_number(Fraction(rng.randint(-5, 5), rng.randint(2, 4)))
+
+    head = rng.choice(["Plus", "Mult", "Power", "Neg"])
+    if head == "Power":
+        return Expr("Power", [random_expr(rng, depth - 1), Integer(rng.randint(-2, 3))])
+    if head == "Neg":
+        return Expr("Neg", [random_expr(rng, depth - 1)])
+    return Expr(head, [random_expr(rng, depth - 1) for _ in range(rng.randint(2, 3))])
+
+
+def polynomial_expr(rng: Random, depth: int) -> Expr:
+    # like random_expr with non negative integer exponents and integer constants
+    if depth == 0 or rng.random() < 0.2:
+        return rng.choice(SYMBOLS) if rng.random() < 0.6 else Integer(rng.randint(-5, 5))
+
+    head = rng.choice(["Plus", "Mult", "Power", "Neg"])
+    if head == "Power":
+        return Expr("Power", [polynomial_expr(rng, depth - 1), Integer(rng.randint(0, 3))])
+    if head == "Neg":
+        return Expr("Neg", [polynomial_expr(rng, depth - 1)])
+    return Expr(head, [polynomial_expr(rng, depth - 1) for _ in range(rng.randint(2, 3))])
+
+
+def numeric_value(expr: Expr, values: Dict[Expr, Expr]) -> Expr:
+    return eval_expr(substitute(expr, values)[1])[1]
@@ -0,0 +1,46 @@
+from random import Random
+from expr import Expr
+from atom import Symbol
+from nums import Integer
+from rule import Rule
+from batch import simplify, simplify_many, simplify_unordered
+from common import a, _x, random_expr
+
+# simplifying on a process pool gives the results of simplifying in this process, in input order
+
+RULES = [Rule(Expr("Power", [_x, Integer(2)]), Expr("Mult", [Symbol("x"), Symbol("x")]))]
+
+
+def exprs(seed: int, n: int):
+    rng = Random(seed)
+    result = []
+    while len(result) < n:
+        expr = random_expr(rng, 4)
+        try:
+            simplify(expr, RULES)
+        except ZeroDivisionError:
+            continue
+        result.append(expr)
+    return result
+
+
+def test_workers_match_serial():
+    inputs = exprs(41, 300)
+    serial = list(simplify_many(inputs, RULES, workers=1))
+    assert serial == [simplify(expr, RULES) for expr in inputs]
+    assert list(simplify_many(inputs, RULES, workers=2, chunksize=7)) == serial
+
+
+def test_unordered_positions():
+    inputs = exprs(43, 100)
+    results = dict(simplify_unordered(iter(inputs), RULES, workers=2, chunksize=9))
+    assert sorted(results) == list(range(100))
+    assert all(results[i] is simplify(expr, RULES) for i, expr in enumerate(inputs))
+
+
+def test_deep_expressions():
+    deep = a
+    for i in range(5000):
+        deep = Expr("f", [deep, Integer(i)])
+    shallow = Expr("Plus", [a, a])
+    assert list(simplify_many([deep, shallow], workers=2, chunksize=1)) == [deep, Expr("Mult", [Integer(2), a])]
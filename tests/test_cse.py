@@ -0,0 +1,53 @@
+from random import Random
+from typing import Dict
+from expr import Expr
+from atom import Symbol
+from rule import substitute
+from parsing import parse
+from cse import count_uses, cse, format_cse
+from common import a, random_expr
+
+# substituting the temporaries back gives the expression cse started from
+
+
+def inline(bindings, result: Expr) -> Expr:
+    values: Dict[Expr, Expr] = {}
+    for temp, value in bindings:
+        values[temp] = substitute(value, values)[1]
+    return substitute(result, values)[1]
+
+
+def test_cse_round_trip():
+    rng = Random(31)
+    for _ in range(200):
+        shared = random_expr(rng, 2)
+        expr = Expr("f", [random_expr(rng, 3), shared, Expr("g", [shared, random_expr(rng, 2)])])
+        bindings, result = cse(expr)
+        assert inline(bindings, result) is expr, str(expr)
+        for i, (temp, value) in enumerate(bindings):
+            later = {later_temp for later_temp, _ in bindings[i:]}
+            assert count_uses(value).keys().isdisjoint(later)
+
+
+def test_shared_subterms_are_bound_once():
+    bindings, result = cse(parse("(a+b)^2*f(a+b)+t0"))
+    assert [(str(temp), str(value)) for temp, value in bindings] == [("t1", "a+b")]
+    assert result is parse("t1^2*f(t1)+t0")
+    assert format_cse(parse("f(a+b,a+b)")) == "t0 = a+b\nf(t0,t0)"
+
+
+def test_min_uses():
+    expr = parse("f(a+b,a+b,a*b)")
+    assert cse(expr, min_uses=3) == ([], expr)
+    assert len(cse(expr, min_uses=1)[0]) == 2
+
+
+def test_deep_sharing():
+    # the tree has 2^2000 leaves, the dag and the bindings 2000 nodes
+    expr = a
+    for _ in range(2000):
+        expr = Expr("f", [expr, expr])
+    bindings, result = cse(expr, prefix="s")
+    assert len(bindings) == 1999
+    assert result is Expr("f", [Symbol("s1998"), Symbol("s1998")])
+    assert inline(bindings, result) is expr
@@ -0,0 +1,59 @@
+from random import Random
+from expr import Expr
+from nums import Integer
+from poly import Poly
+from rule import GLOBAL_RULES, eval_expr
+import derivative
+from derivative import diff, gradient
+from common import SYMBOLS, a, b, c, polynomial_expr
+
+# derivatives of polynomials are checked against differentiating their expanded terms
+
+
+def poly_diff(poly: Poly, gen: Expr) -> Poly:
+    if gen not in poly.gens:
+        return Poly.constant(0, poly.gens)
+    i = poly.gens.index(gen)
+    terms = {}
+    for monomial, coefficient in poly.terms.items():
+        if monomial[i] > 0:
+            lowered = monomial[:i] + (monomial[i] - 1,) + monomial[i + 1:]
+            terms[lowered] = terms.get(lowered, 0) + coefficient * monomial[i]
+    return Poly(terms, poly.gens)
+
+
+def test_diff_polynomials():
+    rng = Random(17)
+    for _ in range(200):
+        expr = polynomial_expr(rng, 4)
+        expected = poly_diff(Poly.from_expr(expr), a)
+        assert Poly.from_expr(diff(expr, a)) == expected, str(expr)
+
+
+def test_gradient_matches_diff():
+    rng = Random(19)
+    for _ in range(100):
+        expr = polynomial_expr(rng, 4)
+        partials = gradient(expr, SYMBOLS)
+        for var in SYMBOLS:
+            assert Poly.from_expr(partials[var]) == Poly.from_expr(diff(expr, var)), str(expr)
+
+
+def test_unknown_heads_stay_derivatives():
+    expr = Expr("Sin", [Expr("Mult", [a, b])])
+    assert diff(expr, a) is Expr("D", [expr, a])
+    assert diff(expr, c) is Integer(0)
+
+
+def test_install_evaluates_derivatives():
+    square = Expr("D", [Expr("Power", [a, Integer(2)]), a])
+    try:
+        assert eval_expr(square)[1] is square
+        derivative.install()
+        derivative.install()
+        assert len(GLOBAL_RULES["D"]) == 1
+        assert eval_expr(square)[1] is Expr("Mult", [Integer(2), a])
+        unknown = Expr("D", [Expr("Sin", [a]), a])
+        assert eval_expr(unknown)[1] is unknown
+    finally:
+        GLOBAL_RULES.pop("D", None)
@@ -0,0 +1,71 @@
+from expr import Expr
+from atom import Symbol, symbols
+from nums import Integer
+from rule import Rule
+from egraph import EGraph, saturate
+from common import a, _x, _y, _z
+
+x, y, z = symbols("x y z")
+
+
+def f(u: Expr, v: Expr) -> Expr:
+    return Expr("f", [u, v])
+
+
+def chain(n: int) -> Expr:
+    expr = Symbol("s0")
+    for i in range(1, n):
+        expr = f(expr, Symbol("s{}".format(i)))
+    return expr
+
+
+ASSOCIATIVITY = [
+    Rule(f(_x, f(_y, _z)), f(f(x, y), z)),
+    Rule(f(f(_x, _y), _z), f(x, f(y, z))),
+    Rule(f(_x, _y), f(y, x)),
+]
+
+
+def test_associativity_saturates():
+    # every non empty subset of the terms is a class, every binary tree over it an e-node
+    graph = EGraph()
+    root = graph.add(chain(6))
+    assert graph.run(ASSOCIATIVITY, iterations=100) == "saturated"
+    assert len(graph.nodes) == 2 ** 6 - 1
+    assert graph.find(root) == graph.find(graph.add(f(Symbol("s5"), chain(5))))
+
+
+def test_rematching_changed_classes_finds_all_matches():
+    # a run only matches near the classes the previous iteration changed, separate runs of one
+    # iteration match everywhere
+    incremental, full = EGraph(), EGraph()
+    incremental.add(chain(6))
+    full.add(chain(6))
+    assert incremental.run(ASSOCIATIVITY[:2], iterations=100) == "saturated"
+    while full.run(ASSOCIATIVITY[:2], iterations=1) != "saturated":
+        pass
+    assert (len(incremental), len(incremental.nodes)) == (len(full), len(full.nodes))
+
+
+def test_condition_rechecked_when_smallest_expression_changes():
+    # the class of Neg(k(a)) only gets a negative number once k(a) is merged with 1
+    rules = [Rule(Expr("k", [_x]), Integer(1)), Rule(Expr("g", [_x]), Expr("h", [x]), Expr("Less", [x, Integer(0)]))]
+    graph = EGraph()
+    root = graph.add(Expr("g", [Expr("Neg", [Expr("k", [a])])]))
+    assert graph.run(rules) == "saturated"
+    assert graph.find(graph.add(Expr("h", [Integer(-1)]))) == graph.find(root)
+
+
+def test_saturate_extracts_smallest():
+    rules = [Rule(Expr("Mult", [_x, Integer(1)]), x), Rule(Expr("Plus", [_x, Expr("Neg", [_x])]), Integer(0))]
+    expr = Expr("Plus", [Expr("Mult", [a, Integer(1)]), Expr("Neg", [a])])
+    assert saturate(expr, rules) is Integer(0)
+
+
+def test_limits():
+    graph = EGraph()
+    graph.add(chain(9))
+    assert graph.run(ASSOCIATIVITY, iterations=100, node_limit=500) == "nodes"
+    graph = EGraph()
+    graph.add(chain(9))
+    assert graph.run(ASSOCIATIVITY, iterations=2) == "iterations"
@@ -0,0 +1,64 @@
+from random import Random
+import pytest
+from parsing import parse
+from expr import Expr
+from nums import Integer, Rational, Real
+from rule import eval_expr, fold_numbers
+from common import VALUES, a, b, numeric_value, random_expr
+
+
+def test_eval_keeps_value():
+    rng = Random(23)
+    for _ in range(1000):
+        expr = random_expr(rng, 4)
+        try:
+            expected = numeric_value(expr, VALUES)
+        except ZeroDivisionError:
+            continue
+        assert numeric_value(eval_expr(expr)[1], VALUES) is expected, str(expr)
+
+
+@pytest.mark.parametrize("text, collected", [
+    ("a+2*a", "3*a"),
+    ("a-a", "0"),
+    ("b+a-a", "b"),
+    ("2*a-3*a", "-a"),
+    ("a*b-b*a+c", "c"),
+    ("2*a*b+a*b", "3*a*b"),
+    ("a*a^2", "a^3"),
+    ("a*a^-1", "1"),
+])
+def test_collect_like_terms(text, collected):
+    assert eval_expr(parse(text))[1] is parse(collected)
+
+
+def test_no_like_terms():
+    expr = eval_expr(parse("+".join("{}*x{}^2".format(i % 7 + 2, i) for i in range(1000))))[1]
+    assert len(expr.args) == 1000
+    assert eval_expr(expr) == (False, expr)
+
+
+@pytest.mark.parametrize("args, folded", [
+    ([Integer(2), a, Integer(3)], [Integer(5), a]),
+    ([Integer(2), a, Integer(-2)], [a]),
+    ([Integer(0), a, b], [a, b]),
+    ([Real(0.5), a, Rational(1, 2)], [Real(1.0), a]),
+    ([a, b], [a, b]),
+])
+def test_partial_fold_plus(args, folded):
+    expr = Expr("Plus", args)
+    expected = folded[0] if len(folded) == 1 else Expr("Plus", folded)
+    assert fold_numbers(expr) is expected
+    assert eval_expr(expr)[1] is expected
+
+
+@pytest.mark.parametrize("args, folded", [
+    ([Integer(2), a, Rational(1, 2)], [a]),
+    ([Integer(1), a, b], [a, b]),
+    ([Integer(2), a, Integer(3), b], [Integer(6), a, b]),
+])
+def test_partial_fold_mult(args, folded):
+    expr = Expr("Mult", args)
+    expected = folded[0] if len(folded) == 1 else Expr("Mult", folded)
+    assert fold_numbers(expr) is expected
+    assert eval_expr(expr)[1] is expected
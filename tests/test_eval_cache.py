@@ -0,0 +1,66 @@
+from random import Random
+import pytest
+from expr import Expr
+from nums import Integer
+from rule import EVAL_CACHE, GLOBAL_RULES, eval_expr
+from common import a, b, _x, random_expr
+
+# eval_expr with the result cache enabled, the cache is disabled again after each test
+
+
+@pytest.fixture
+def cache():
+    EVAL_CACHE.clear()
+    EVAL_CACHE.resize(1000)
+    yield EVAL_CACHE
+    EVAL_CACHE.resize(0)
+    EVAL_CACHE.clear()
+
+
+def test_cached_results_match(cache):
+    rng = Random(29)
+    exprs = [random_expr(rng, 4) for _ in range(300)]
+    cache.resize(0)
+    expected = []
+    for expr in exprs:
+        try:
+            expected.append(eval_expr(expr))
+        except ZeroDivisionError:
+            expected.append(None)
+    cache.resize(1000)
+    for _ in range(2):
+        for expr, result in zip(exprs, expected):
+            if result is not None:
+                assert eval_expr(expr) == result, str(expr)
+
+
+def test_hits(cache):
+    expr = Expr("Plus", [Expr("Mult", [Integer(2), a]), a, b])
+    eval_expr(expr)
+    hits = cache.stats()["hits"]
+    assert eval_expr(expr) == (True, Expr("Plus", [Expr("Mult", [Integer(3), a]), b]))
+    assert cache.stats()["hits"] == hits + 1
+
+
+def test_evicts_least_recently_used(cache):
+    cache.resize(3)
+    evictions = cache.stats()["evictions"]
+    exprs = [Expr("f{}".format(i), []) for i in range(3)]
+    for expr in exprs:
+        eval_expr(expr)
+    assert list(cache.entries) == exprs
+    eval_expr(exprs[0])
+    eval_expr(Expr("f3", []))
+    assert list(cache.entries) == [exprs[2], exprs[0], Expr("f3", [])]
+    assert cache.stats()["evictions"] == evictions + 1
+
+
+def test_rule_changes_invalidate(cache):
+    expr = Expr("cached", [a])
+    assert eval_expr(expr) == (False, expr)
+    try:
+        GLOBAL_RULES["cached"].append((Expr("cached", [_x]), lambda node: node.args[0]))
+        assert eval_expr(expr) == (True, a)
+    finally:
+        GLOBAL_RULES.pop("cached")
+    assert eval_expr(expr) == (False, expr)
@@ -0,0 +1,42 @@
+import gc
+import math
+import pickle
+from expr import Expr, INTERN_TABLE
+from atom import Symbol
+from nums import Integer, Real
+from parsing import parse
+from common import a, b
+
+# structurally equal nodes are the same object
+
+
+def test_interned():
+    assert Expr("f", [a, Integer(1)]) is Expr("f", [Symbol("a"), 1])
+    assert Expr("f", [a, b]) is not Expr("f", [b, a])
+    assert hash(Expr("g", [a])) == hash(Expr("g", [a]))
+
+
+def test_interned_entries_are_released():
+    key = Expr("released", [a]).intern_key()
+    gc.collect()
+    assert key not in INTERN_TABLE
+
+
+def test_pickle_interns():
+    expr = Expr("f", [a, Expr("g", [b, Real(0.5)])])
+    assert pickle.loads(pickle.dumps(expr)) is expr
+
+
+def test_real_signed_zero():
+    assert Real(-0.0) is not Real(0.0)
+    assert math.copysign(1.0, Real(-0.0).value) == -1.0
+    assert Real(math.nan) is Real(math.nan)
+
+
+def test_deep_printing():
+    node = a
+    for i in range(20000):
+        node = Expr("f", [node, Integer(i % 7)]) if i % 2 else Expr("Plus", [Expr("Neg", [node]), Integer(i % 5 - 2)])
+    assert parse(str(node)) is node
+    assert parse(node.__full__()) is node
+    assert str(node).count("+(-f(") == 9999
@@ -0,0 +1,68 @@
+from random import Random
+from expr import Expr
+from atom import Symbol
+from nums import Integer, Rational
+from rule import GLOBAL_RULES, eval_expr, substitute
+from incremental import IncrementalEvaluator
+from common import SYMBOLS, a, b, c, _x, random_expr
+
+# after every edit the evaluator gives what evaluating the edited expression from scratch gives
+
+
+def expected(expr: Expr, bindings) -> Expr:
+    return eval_expr(substitute(expr, bindings)[1] if len(bindings) > 0 else expr)[1]
+
+
+def test_bindings_match_eval():
+    rng = Random(37)
+    values = [Integer(2), Integer(-1), Rational(1, 3), a, Expr("Plus", [b, Integer(1)])]
+    for _ in range(100):
+        expr = random_expr(rng, 4)
+        evaluator = IncrementalEvaluator(expr)
+        bindings = {}
+        try:
+            for _ in range(5):
+                symbol = rng.choice(SYMBOLS)
+                if rng.random() < 0.2:
+                    evaluator.unbind(symbol)
+                    bindings.pop(symbol, None)
+                else:
+                    value = rng.choice(values)
+                    evaluator.bind(symbol, value)
+                    bindings[symbol] = value
+                want = expected(expr, bindings)
+                assert evaluator.evaluate()[1] is want, str(expr)
+        except ZeroDivisionError:
+            continue
+
+
+def test_bind_recomputes_path():
+    terms = [Expr("f", [Symbol("s{}".format(i)), Integer(i)]) for i in range(1000)]
+    evaluator = IncrementalEvaluator(Expr("Plus", terms))
+    evaluator.evaluate()
+    evaluator.bind(Symbol("s500"), Integer(1))
+    result = evaluator.evaluate()[1]
+    assert evaluator.recomputed == 3
+    assert result is eval_expr(Expr("Plus", terms[:500] + [Expr("f", [Integer(1), Integer(500)])] + terms[501:]))[1]
+
+
+def test_replace_at():
+    expr = Expr("f", [Expr("Plus", [a, b]), Expr("g", [Expr("Mult", [a, c])])])
+    evaluator = IncrementalEvaluator(expr, {a: Integer(2)})
+    evaluator.evaluate()
+    edited = evaluator.replace_at([1, 0], Expr("Mult", [a, a]))
+    assert edited is Expr("f", [Expr("Plus", [a, b]), Expr("g", [Expr("Mult", [a, a])])])
+    assert evaluator.evaluate()[1] is expected(edited, {a: Integer(2)})
+    evaluator.collect()
+    assert Expr("Mult", [a, c]) not in evaluator.results
+
+
+def test_rule_changes_invalidate():
+    expr = Expr("Plus", [Expr("incremental", [a]), b])
+    evaluator = IncrementalEvaluator(expr)
+    assert evaluator.evaluate() == (False, expr)
+    try:
+        GLOBAL_RULES["incremental"].append((Expr("incremental", [_x]), lambda node: node.args[0]))
+        assert evaluator.evaluate() == (True, Expr("Plus", [a, b]))
+    finally:
+        GLOBAL_RULES.pop("incremental")
@@ -0,0 +1,48 @@
+import math
+from random import Random
+import pytest
+from expr import Expr
+from nums import Number, Integer, Real, to_number
+from parsing import parse
+from common import SYMBOLS, a, b, c, numeric_value, random_expr
+
+# compiled functions against numeric evaluation, skipped without numpy
+
+
+def test_lambdify_matches_evaluation():
+    numpy = pytest.importorskip("numpy")
+    from lambdify import lambdify
+
+    rng = Random(17)
+    values = {a: 1.25, b: -0.75, c: 2.5}
+    substitutions = {symbol: Real(value) for symbol, value in values.items()}
+    for _ in range(200):
+        expr = random_expr(rng, 4)
+        value = numeric_value(expr, substitutions)
+        if not isinstance(value, Number):
+            # division by zero stays unevaluated
+            continue
+        expected = complex(to_number(value))
+        try:
+            with numpy.errstate(all="ignore"):
+                result = complex(lambdify(expr, SYMBOLS)(*values.values()))
+        except ZeroDivisionError:
+            continue
+        if not (math.isfinite(abs(expected)) and math.isfinite(abs(result))):
+            continue
+        assert result == pytest.approx(expected, rel=1e-9, abs=1e-9), str(expr)
+
+
+def test_lambdify_literals_and_depth():
+    pytest.importorskip("numpy")
+    from lambdify import lambdify
+
+    assert lambdify(parse("a^-2"), [a])(2.0) == 0.25
+    assert lambdify(Expr("Plus", [a, Real(math.inf)]), [a])(1.0) == math.inf
+    assert math.isnan(lambdify(Expr("Mult", [a, Real(math.nan)]), [a])(1.0))
+
+    node = a
+    for i in range(500):
+        node = Expr("Plus", [Expr("Mult", [node, Real(0.5)]), Integer(1)])
+    expected = to_number(numeric_value(node, {a: Real(1.0)}))
+    assert lambdify(node, [a])(1.0) == pytest.approx(expected)
@@ -0,0 +1,150 @@
+from collections import Counter
+from itertools import product
+from random import Random
+from typing import FrozenSet, List, Set, Tuple
+import pytest
+from expr import Expr
+from atom import Atom, Symbol
+from head import Attribute
+from nums import Integer
+from rule import Blank, Rule, apply_rule, check_conditions, match_all, match_expr, sub_multisets
+from parsing import parse
+from common import SYMBOLS, a, b, _x, _y, _z
+
+# ac matching against a brute force split of the args over the pattern
+
+Binding = FrozenSet[Tuple[str, Expr]]
+
+
+def ac_subject(rng: Random, head: str) -> Expr:
+    args = []
+    for _ in range(rng.randint(2, 4)):
+        if rng.random() < 0.3:
+            args.append(Expr("Power", [rng.choice(SYMBOLS), Integer(rng.randint(2, 3))]))
+        else:
+            args.append(rng.choice(SYMBOLS))
+    return Expr(head, args)
+
+
+def ac_pattern(rng: Random, head: str) -> Expr:
+    args = []
+    for _ in range(rng.randint(2, 3)):
+        kind = rng.randrange(4)
+        if kind < 2:
+            args.append(rng.choice([_x, _y, _z]))
+        elif kind == 2:
+            args.append(rng.choice(SYMBOLS))
+        else:
+            args.append(Expr("Power", [rng.choice([_x, _y, a]), rng.choice([_z, Integer(2)])]))
+    return Expr(head, args)
+
+
+def merge(bindings: List[Set[Binding]]) -> Set[Binding]:
+    merged: Set[Binding] = {frozenset()}
+    for options in bindings:
+        result = set()
+        for left in merged:
+            for right in options:
+                combined = dict(left)
+                if all(combined.setdefault(name, value) is value for name, value in right):
+                    result.add(frozenset(combined.items()))
+        merged = result
+    return merged
+
+
+def brute_force(expr: Expr, pattern: Expr) -> Set[Binding]:
+    # every binding by trying all ways to split the args of an ac head over the pattern args. Args
+    # left over go to UNMATCHED when every plain blank of the pattern is bound by its other args.
+    if type(pattern) is Blank:
+        return {frozenset([(pattern.text, expr)])}
+    if isinstance(pattern, Atom):
+        return {frozenset()} if pattern is expr else set()
+    if isinstance(expr, Atom) or expr.head != pattern.head:
+        return set()
+
+    if not expr.attr & Attribute.COMMUTATIVE:
+        if len(expr.args) != len(pattern.args):
+            return set()
+        return merge([brute_force(arg, pattern_arg) for arg, pattern_arg in zip(expr.args, pattern.args)])
+
+    results = set()
+    k = len(pattern.args)
+    plain = [j for j in range(k) if type(pattern.args[j]) is Blank]
+    names = {pattern.args[j].text for j in plain}
+    for assignment in product(range(k + 1), repeat=len(expr.args)):
+        groups = [[arg for arg, i in zip(expr.args, assignment) if i == j] for j in range(k + 1)]
+        if any(len(group) == 0 for group in groups[:k]):
+            continue
+        values = [group[0] if len(group) == 1 else expr.copy(group) for group in groups[:k]]
+        others = merge([brute_force(values[j], pattern.args[j]) for j in range(k) if j not in plain])
+        for binding in others:
+            if len(groups[k]) > 0 and not names <= {name for name, _ in binding}:
+                continue
+            bindings = [{binding}] + [brute_force(values[j], pattern.args[j]) for j in plain]
+            if len(groups[k]) > 0:
+                bindings.append({frozenset([("UNMATCHED", expr.copy(groups[k]))])})
+            results |= merge(bindings)
+    return results
+
+
+@pytest.mark.parametrize("head", ["Plus", "Mult"])
+def test_ac_match_complete(head):
+    rng = Random(7)
+    for _ in range(300):
+        expr = ac_subject(rng, head)
+        pattern = ac_pattern(rng, head)
+        if expr.head != head or pattern.head != head:
+            continue
+        found = {frozenset(binding.items()) for binding in match_all(expr, pattern)}
+        assert found == brute_force(expr, pattern), "{} against {}".format(expr, pattern)
+
+
+def test_ac_match_repeated_blank():
+    expr = Expr("Plus", [a, a, b, b])
+    found = {frozenset(binding.items()) for binding in match_all(expr, Expr("Plus", [_x, _x]))}
+    assert found == brute_force(expr, Expr("Plus", [_x, _x]))
+    assert frozenset([("x", Expr("Plus", [a, b]))]) in found
+
+
+def test_ac_match_with_conditions():
+    # conditions checked on partial bindings keep exactly the matches that satisfy them
+    rng = Random(19)
+    conditions = [Expr("Less", [_x, Integer(0)]), Expr("Greater", [Expr("Plus", [_x, _y]), Integer(0)])]
+    expr = Expr("Plus", [Integer(-2), Integer(3), a, Expr("Power", [b, Integer(2)])])
+    for _ in range(100):
+        pattern = ac_pattern(rng, "Plus")
+        if pattern.head != "Plus":
+            continue
+        for cond in conditions:
+            found = {frozenset(binding.items()) for binding in match_all(expr, pattern, [cond])}
+            expected = {binding for binding in brute_force(expr, pattern) if check_conditions([cond], dict(binding))}
+            assert found == expected, "{} against {} if {}".format(expr, pattern, cond)
+
+
+def test_sub_multisets():
+    groups = [(a, 2), (b, 0), (Integer(1), 3), (Integer(2), 1)]
+    for size in range(7):
+        found = [Counter(parts) for parts in sub_multisets(groups, size)]
+        expected = [Counter({arg: n for (arg, _), n in zip(groups, counts) if n > 0})
+                    for counts in sorted(product(*(range(n + 1) for _, n in groups)), reverse=True) if sum(counts) == size]
+        assert found == expected
+
+
+def test_ac_match_wide_sum():
+    distinct = Expr("Plus", [Symbol("s{}".format(i)) for i in range(2001)])
+    assert not match_expr(distinct, Expr("Plus", [_x, _x, _y]), [], {})[0]
+    assert match_expr(distinct, Expr("Plus", [_x, _y]), [], {})[0]
+
+    repeated = Expr("Plus", [Symbol("s{}".format(i % 1000)) for i in range(2001)])
+    matched, binding = match_expr(repeated, Expr("Plus", [_x, _x, _y]), [], {})
+    assert matched and Expr("Plus", [binding["x"], binding["x"], binding["y"]]) is repeated
+
+
+def test_nested_ac_pattern_matches_exactly():
+    z = Symbol("z")
+    assert apply_rule(parse("a*b*y+c"), Rule(parse("a*b+c"), z)) == (False, parse("a*b*y+c"))
+    assert apply_rule(parse("g(a+b+c)"), Rule(parse("g(a+b)"), z)) == (False, parse("g(a+b+c)"))
+    assert apply_rule(parse("a*b+c+d"), Rule(parse("a*b+c"), z)) == (True, parse("z+d"))
+    assert apply_rule(parse("g(a+b)+c"), Rule(parse("g(a+b)"), z)) == (True, parse("z+c"))
+    assert list(match_all(parse("g(a+b+c)"), parse("g(a+_x)"))) == [{"x": parse("b+c")}]
+    assert not match_expr(parse("g(a+b+c)"), parse("g(a+b)"), [], {})[0]
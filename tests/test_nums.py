@@ -0,0 +1,81 @@
+from fractions import Fraction
+from random import Random
+import pytest
+from nums import Complex, Integer, Rational, Real, complex_parts, fold_compare, fold_mult, fold_neg, fold_plus, fold_power, \
+    from_number, to_number
+
+# the numeric kernel folds like python arithmetic on the native values, exactly unless a Real is
+# involved
+
+
+def random_number(rng: Random):
+    kind = rng.randrange(4)
+    if kind == 0:
+        return Integer(rng.randint(-20, 20))
+    if kind == 1:
+        return from_number(Fraction(rng.randint(-20, 20), rng.randint(1, 12)))
+    if kind == 2:
+        return Real(rng.randint(-40, 40) / 4)
+    return Complex(Integer(rng.randint(-5, 5)), from_number(Fraction(rng.randint(-5, 5), rng.randint(1, 3))))
+
+
+def parts(number):
+    # exact (real, imaginary) parts, python complex numbers would round the parts to floats
+    return complex_parts(number) if type(number) is Complex else (to_number(number), 0)
+
+
+def native_sum(values):
+    re, im = 0, 0
+    for value_re, value_im in values:
+        re, im = re + value_re, im + value_im
+    return re, im
+
+
+def native_product(values):
+    re, im = 1, 0
+    for value_re, value_im in values:
+        re, im = re * value_re - im * value_im, re * value_im + im * value_re
+    return re, im
+
+
+@pytest.mark.parametrize("fold, native", [(fold_plus, native_sum), (fold_mult, native_product)])
+def test_fold_matches_native(fold, native):
+    rng = Random(47)
+    for _ in range(500):
+        args = [random_number(rng) for _ in range(rng.randint(1, 5))]
+        expected = native([parts(arg) for arg in args])
+        folded = fold(args)
+        if any(type(part) is float for part in parts(folded)):
+            assert parts(folded) == pytest.approx(expected), [str(arg) for arg in args]
+        else:
+            assert parts(folded) == expected, [str(arg) for arg in args]
+        if all(type(arg) is not Complex for arg in args):
+            kind = type(expected[0])
+            assert type(folded) is (Real if kind is float else Integer if kind is int or
+                                    expected[0].denominator == 1 else Rational)
+
+
+def test_fold_exact_types():
+    assert fold_plus([Rational(1, 2), Rational(1, 2)]) is Integer(1)
+    assert fold_plus([Rational(1, 6), Rational(1, 10)]) is Rational(4, 15)
+    assert fold_mult([Integer(3), Rational(1, 3)]) is Integer(1)
+    assert fold_plus([Complex(Integer(1), Integer(2)), Complex(Integer(1), Integer(-2))]) is Integer(2)
+    assert fold_mult([Complex(Integer(0), Integer(1)), Complex(Integer(0), Integer(1))]) is Integer(-1)
+    assert fold_neg(Rational(1, 2)) is Rational(-1, 2)
+    assert fold_plus([Integer(i) for i in range(10000)]) is Integer(49995000)
+
+
+def test_fold_power():
+    assert fold_power(Integer(2), Integer(10)) is Integer(1024)
+    assert fold_power(Integer(2), Integer(-2)) is Rational(1, 4)
+    assert fold_power(Rational(2, 3), Integer(2)) is Rational(4, 9)
+    assert fold_power(Real(4.0), Rational(1, 2)) is Real(2.0)
+    # no exact value or no value at all, the node stays as it is
+    assert fold_power(Integer(2), Rational(1, 2)) is None
+    assert fold_power(Integer(0), Integer(-1)) is None
+
+
+def test_fold_compare():
+    assert fold_compare(Rational(1, 3), Real(0.5), True) is True
+    assert fold_compare(Integer(2), Rational(3, 2), False) is True
+    assert fold_compare(Complex(Integer(1), Integer(1)), Integer(0), True) is None
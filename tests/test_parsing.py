@@ -0,0 +1,49 @@
+from random import Random
+import pytest
+from expr import Expr
+from nums import Integer
+from rule import Blank, eval_expr, match_expr
+from parsing import parse
+from common import random_expr
+
+# printed expressions parse back to the same node
+
+
+def test_parse_round_trip():
+    rng = Random(3)
+    for _ in range(500):
+        expr = random_expr(rng, 4)
+        assert parse(str(expr)) is expr, str(expr)
+
+
+@pytest.mark.parametrize("text", ["-3^2", "(-3)^2", "2^-1", "-x^2", "(-x)^2", "x^y^z", "(x^y)^z", "x-(-2)", "-2*x", "-(2*x)",
+                                  "-(4)", "-(2+x)", "-(1.5)", "--4"])
+def test_parse_print(text):
+    expr = parse(text)
+    assert parse(str(expr)) is expr
+
+
+def test_negative_power_precedence():
+    assert parse("-3^2") is Expr("Neg", [Expr("Power", [Integer(3), Integer(2)])])
+    assert parse("(-3)^2") is Expr("Power", [Integer(-3), Integer(2)])
+    assert eval_expr(parse("-3^2"))[1] is Integer(-9)
+
+
+def test_call_heads_are_interned():
+    assert parse("Plus(a,Plus(b,c))") is parse("a+b+c")
+    assert eval_expr(parse("Mult(2,Mult(a,b))"))[1] is parse("2*a*b")
+
+    parsed = parse("parsedhead(a)")
+    a, x = parsed.args[0], Blank("x")
+    assert Expr("parsedhead", [a]) is parsed
+    assert match_expr(Expr("parsedhead", [a]), Expr("parsedhead", [x]), [], {})[0]
+
+
+def test_nested_groups():
+    depth = 5000
+    text = "(" * depth + "a" + "".join("+b{})".format(i % 3) for i in range(depth))
+    expr = parse(text)
+    assert expr.head == "Plus" and len(expr.args) == depth + 1
+    assert parse("((a*b)*c)*d") is parse("a*b*c*d")
+    assert parse("((a+b)*c)+d") is Expr("Plus", [Expr("Mult", [parse("a+b"), parse("c")]), parse("d")])
+    assert parse("-(a+b)+c") is parse("-(a+b+c)")
@@ -0,0 +1,31 @@
+from fractions import Fraction
+from random import Random
+import pytest
+from expr import Expr
+from nums import Rational
+from parsing import parse
+from poly import Poly
+from common import VALUES, a, numeric_value, polynomial_expr
+
+# expanded polynomials evaluate like the expressions they come from
+
+
+def test_poly_matches_evaluation():
+    rng = Random(13)
+    for _ in range(300):
+        expr = polynomial_expr(rng, 4)
+        expanded = Poly.from_expr(expr).to_expr()
+        assert numeric_value(expanded, VALUES) is numeric_value(expr, VALUES), str(expr)
+
+
+@pytest.mark.parametrize("text", ["2*a*3", "2*3", "(2*3)^2", "-(2*3)", "a*0", "(a-a)^2"])
+def test_poly_constants(text):
+    expr = parse(text)
+    expanded = Poly.from_expr(expr).to_expr()
+    assert numeric_value(expanded, VALUES) is numeric_value(expr, VALUES)
+
+
+def test_poly_coefficients():
+    assert Poly.from_expr(parse("2*a*3")).terms == {(1,): 6}
+    assert Poly.from_expr(parse("(a+1)^2")).terms == {(2,): 1, (1,): 2, (0,): 1}
+    assert Poly.from_expr(Expr("Mult", [Rational(1, 2), a])).terms == {(1,): Fraction(1, 2)}
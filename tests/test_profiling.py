@@ -0,0 +1,54 @@
+import pytest
+from expr import Expr
+from atom import Symbol
+from rule import GLOBAL_RULES, Rule, apply_rule, eval_expr
+import profiling
+from profiling import disable_profiling, enable_profiling
+from common import a, b, _x
+
+# rule statistics collected while profiling is enabled
+
+UNWRAP = Rule(Expr("f", [_x]), Symbol("x"))
+
+
+@pytest.fixture
+def traced():
+    rewrites = []
+    profiler = enable_profiling(lambda rule, expr, result: rewrites.append((rule, expr, result)))
+    yield profiler, rewrites
+    disable_profiling()
+
+
+def test_rule_stats(traced):
+    profiler, rewrites = traced
+    expr = Expr("g", [Expr("f", [a]), Expr("f", [Expr("Plus", [a, b])]), b])
+    assert apply_rule(expr, UNWRAP)[1] is Expr("g", [a, Expr("Plus", [a, b]), b])
+
+    stats = profiler.rules[UNWRAP]
+    assert stats.matches == 2 and stats.attempts >= 3
+    assert (stats.nodes_in, stats.nodes_out) == (2 + 4, 1 + 3)
+    assert set(rewrites) == {(UNWRAP, Expr("f", [a]), a), (UNWRAP, Expr("f", [Expr("Plus", [a, b])]), Expr("Plus", [a, b]))}
+    assert profiler.export()[0]["rule"] == str(UNWRAP)
+
+    lines = profiler.report().split("\n")
+    assert len(lines) == 2 and lines[1].endswith(str(UNWRAP))
+
+
+def test_global_rule_stats(traced):
+    profiler, rewrites = traced
+    pattern = Expr("profiled", [_x])
+    try:
+        GLOBAL_RULES["profiled"].append((pattern, lambda node: node.args[0]))
+        assert eval_expr(Expr("Plus", [Expr("profiled", [a]), b]))[1] is Expr("Plus", [a, b])
+    finally:
+        GLOBAL_RULES.pop("profiled")
+    assert profiler.rules[pattern].label == "global " + str(pattern)
+    assert profiler.rules[pattern].matches == 1
+    assert [expr for _, expr, _ in rewrites] == [Expr("profiled", [a])]
+
+
+def test_disabled():
+    profiler = enable_profiling()
+    assert disable_profiling() is profiler and profiling.PROFILER is None
+    apply_rule(Expr("f", [a]), UNWRAP)
+    assert len(profiler.rules) == 0
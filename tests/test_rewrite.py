@@ -0,0 +1,75 @@
+import pytest
+from expr import Expr
+from atom import Symbol
+from nums import Integer
+from rule import Rule, apply_rule
+from rewrite import Strategy, rewrite
+from common import a, b, c, _x, _y
+
+# fixpoint rewriting under the different strategies
+
+x, y = Symbol("x"), Symbol("y")
+
+
+@pytest.mark.parametrize("strategy", list(Strategy))
+def test_wide_node(strategy):
+    wide = Expr("Plus", [Expr("g", [Symbol("s{}".format(i))]) for i in range(5000)])
+    assert rewrite(wide, [Rule(Expr("h", [_x]), _x)], strategy) == (False, wide)
+
+    rule = Rule(Expr("g", [Symbol("s5")]), Integer(1))
+    assert rewrite(wide, [rule], strategy) == (True, apply_rule(wide, rule)[1])
+
+
+def s(n: int, x: Expr) -> Expr:
+    for _ in range(n):
+        x = Expr("s", [x])
+    return x
+
+
+ZERO = Symbol("z")
+# addition of numbers s(s(...s(z))), rewriting add(x, y) moves an s out of x per step
+PEANO = [
+    Rule(Expr("add", [ZERO, _y]), y),
+    Rule(Expr("add", [Expr("s", [_x]), _y]), Expr("s", [Expr("add", [x, y])])),
+]
+
+
+@pytest.mark.parametrize("strategy", [Strategy.INNERMOST, Strategy.OUTERMOST])
+def test_fixpoint(strategy):
+    expr = Expr("add", [s(3, ZERO), Expr("add", [s(2, ZERO), s(1, ZERO)])])
+    assert rewrite(expr, PEANO, strategy) == (True, s(6, ZERO))
+
+
+@pytest.mark.parametrize("strategy", [Strategy.INNERMOST, Strategy.OUTERMOST])
+def test_deep_fixpoint(strategy):
+    expr = Expr("add", [s(300, ZERO), ZERO])
+    assert rewrite(expr, PEANO, strategy) == (True, s(300, ZERO))
+
+
+def test_innermost_rewrites_args_first():
+    rules = [Rule(Expr("g", [_x]), a), Rule(Expr("f", [Expr("g", [_x])]), b)]
+    expr = Expr("f", [Expr("g", [c])])
+    assert rewrite(expr, rules, Strategy.INNERMOST)[1] is Expr("f", [a])
+    assert rewrite(expr, rules, Strategy.OUTERMOST)[1] is b
+
+
+def test_bottom_up_once():
+    rules = [Rule(Expr("g", [_x]), Expr("g", [Expr("g", [x])]))]
+    expr = Expr("f", [Expr("g", [a]), Expr("g", [b])])
+    expected = Expr("f", [Expr("g", [Expr("g", [a])]), Expr("g", [Expr("g", [b])])])
+    assert rewrite(expr, rules, Strategy.BOTTOM_UP_ONCE) == (True, expected)
+
+
+@pytest.mark.parametrize("strategy", list(Strategy))
+def test_max_steps(strategy):
+    # g(x) -> g(g(x)) never reaches a fixpoint, rewriting stops after max_steps applications
+    rules = [Rule(Expr("g", [_x]), Expr("g", [Expr("g", [x])]))]
+    changed, result = rewrite(Expr("g", [a]), rules, strategy, max_steps=5)
+    assert changed and result.head == "g" and result.depth <= 6
+
+
+@pytest.mark.parametrize("strategy", [Strategy.INNERMOST, Strategy.OUTERMOST])
+def test_cycle(strategy):
+    rules = [Rule(Expr("f", [_x]), Expr("g", [x])), Rule(Expr("g", [_x]), Expr("f", [x]))]
+    result = rewrite(Expr("f", [a]), rules, strategy, max_steps=100)[1]
+    assert result in (Expr("f", [a]), Expr("g", [a]))
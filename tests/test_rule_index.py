@@ -0,0 +1,46 @@
+from random import Random
+import pytest
+from expr import Expr
+from atom import Atom
+from head import Attribute, HeadAttributes
+from nums import Integer
+from rule import BlankTyped, GLOBAL_RULES, compile_rule, rule_candidates
+from common import a, b, _x, _y, _z
+
+# the candidates of the discrimination net must keep every rule a linear scan finds
+
+
+@pytest.fixture
+def indexed_rules():
+    HeadAttributes["h"] = [Attribute.COMMUTATIVE]
+    g = lambda *args: Expr("g", list(args))
+    h = lambda *args: Expr("h", list(args))
+    patterns = {
+        "g": [g(_x), g(_x, _y), g(a, _x), g(_x, a), g(g(_x), _y), g(g(a, _y), b), g(BlankTyped("x", "Integer"), _y),
+              g(_x, _x), g(Integer(1), _y, _z)],
+        "h": [h(_x, _y), h(a, _x), h(a, b), h(g(_x), _y), h(BlankTyped("x", "Symbol"), Integer(1)), h(_x, _x),
+              h(a, _x, _y)]
+    }
+    for head, head_patterns in patterns.items():
+        GLOBAL_RULES[head] = [(pattern, lambda expr: expr) for pattern in head_patterns]
+    yield
+    for head in patterns:
+        del GLOBAL_RULES[head]
+    del HeadAttributes["h"]
+
+
+def index_subject(rng: Random, depth: int) -> Expr:
+    if depth == 0 or rng.random() < 0.3:
+        return rng.choice([a, b, Integer(1), Integer(2)])
+    return Expr(rng.choice(["g", "h"]), [index_subject(rng, depth - 1) for _ in range(rng.randint(1, 3))])
+
+
+def test_rule_candidates_match_linear_scan(indexed_rules):
+    rng = Random(11)
+    for _ in range(500):
+        expr = index_subject(rng, 3)
+        if isinstance(expr, Atom):
+            continue
+        scanned = [pattern for pattern, _ in GLOBAL_RULES[expr.head] if compile_rule(pattern, [])(expr) is not None]
+        indexed = [pattern for pattern, matcher, _ in rule_candidates(expr) if matcher(expr) is not None]
+        assert indexed == scanned, str(expr)
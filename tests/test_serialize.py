@@ -0,0 +1,40 @@
+import gc
+import math
+from random import Random
+from expr import Expr
+from atom import String, Symbol, TRUE, FALSE
+from nums import Integer, Real, Complex
+from rule import BlankTyped, eval_expr, match_expr
+from serialize import dumps, loads
+from common import a, _x, random_expr
+
+# decoding gives back the same interned nodes
+
+
+def test_dumps_loads_identity():
+    rng = Random(5)
+    exprs = [random_expr(rng, 5) for _ in range(200)]
+    exprs += [Real(1.5), Real(-0.0), Real(0.0), Real(math.inf), Complex(Integer(1), Real(-2.5)), String("text"),
+              TRUE, FALSE, _x, BlankTyped("y", "Integer"), Integer(1 << 100), Integer(-(1 << 70)),
+              Expr("f", [Expr("g", []), Symbol("s")])]
+    decoded = loads(dumps(exprs))
+    assert len(decoded) == len(exprs)
+    for expr, result in zip(exprs, decoded):
+        assert result is expr, str(expr)
+
+
+def test_dumps_loads_deep():
+    node = a
+    for i in range(20000):
+        node = Expr("f", [node, Integer(i % 5)])
+    assert loads(dumps([node]))[0] is node
+
+
+def test_decoded_heads_are_interned():
+    # the nodes don't exist any more when decoding, so they are built from the decoded strings
+    data = dumps([Expr("Mult", [Integer(7), Symbol("decoded")]), Expr("decodedhead", [Symbol("decoded")])])
+    gc.collect()
+    product, call = loads(data)
+    assert Expr("Mult", [Integer(2), product]) is Expr("Mult", [Integer(2), Integer(7), Symbol("decoded")])
+    assert eval_expr(Expr("Neg", [Expr("Mult", [Integer(2), product])]))[1] is Expr("Neg", [Expr("Mult", [Integer(14), Symbol("decoded")])])
+    assert match_expr(call, Expr("decodedhead", [_x]), [], {})[0]